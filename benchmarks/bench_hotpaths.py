@@ -0,0 +1,289 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: bench_hotpaths.py
+# @author: zyt
+# @time: 2018/08/09
+# ====================
+"""
+benchmark of the hot paths cal_teff, cal_logg and mass_age_giant, scalar and batched, on synthetic catalogs of giants
+and dwarfs spread over every mode and [fe/h] band. reports the latency per star, rows/s and the peak memory of every
+case, after checking the scalar outputs against benchmarks/golden_values.json and the batched ones against the
+scalar outputs (within the printed precision), so a speedup cannot silently change the results. e.g.
+    python benchmarks/bench_hotpaths.py --sizes 1000 100000 10000000 --json bench.json
+    python benchmarks/bench_hotpaths.py --check-only
+    python benchmarks/bench_hotpaths.py --update-golden  # after a deliberate change of the calibrations
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from params import (cal_teff, cal_teff_batch, cal_teff_consensus, cal_logg, cal_logg_batch, mass_age_giant,
+                    mass_age_giant_batch)
+#======================================================================================================================
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_values.json')
+GOLDEN_ROWS, GOLDEN_SEED = 500, 2018
+MODES = [(star_type, mode) for star_type in ('giant', 'dwarf') for mode in (0, 1, 2)]
+# half a unit of the last printed digit of cal_teff ('{:07.2f}'), cal_logg ('{:.3f}') and mass_age_giant ('{:.3f}')
+TOLERANCE = {'teff': 0.005, 'logg': 0.0005, 'mass_age': 0.0005}
+GOLDEN_KEYS = ['teff {} {}'.format(star_type, mode) for star_type, mode in MODES] + ['logg', 'mass_age']
+
+
+def synthetic_stars(n, seed=0):
+    """
+    photometry and the logg, mass/age inputs of n stars, half giants and half dwarfs, with colors over (and a bit
+    beyond) the calibrated ranges and [fe/h] over the four ramirez2005 bands -4.0 ~ 0.5
+    """
+    rng = np.random.RandomState(seed)
+    vmag = rng.uniform(6., 15., n)
+    vmk = rng.uniform(0.3, 4.6, n)
+    stars = {'vmag': vmag, 'ksmag': vmag - vmk, 'jmag': vmag - 0.76 * vmk + rng.normal(0., 0.05, n),
+             'hmag': vmag - 0.94 * vmk + rng.normal(0., 0.05, n), 'bmag': vmag + rng.uniform(0.1, 1.7, n),
+             'e_bv': rng.uniform(0., 0.15, n), 'feh': rng.uniform(-4.0, 0.5, n),
+             'star_type': np.where(np.arange(n) % 2, 'dwarf', 'giant'),
+             'a_v': rng.uniform(0., 0.5, n), 'plx': rng.uniform(0.0005, 0.02, n), 'teff': rng.uniform(3500., 8000., n),
+             'mass': rng.uniform(0.7, 3.0, n), 'logg': rng.uniform(1.5, 3.6, n), 'mh': rng.uniform(-1.0, 0.4, n),
+             'cm': rng.uniform(-0.25, 0.15, n), 'nm': rng.uniform(-0.1, 0.45, n)}
+    # mass_age_giant is only calibrated for 4000 ~ 5000 k
+    stars['teff_giant'] = rng.uniform(3900., 5100., n)
+    return stars
+
+
+#======================================================================================================================
+def scalar_teff(s, i, star_type, mode):
+    return cal_teff(s['jmag'][i], s['hmag'][i], s['ksmag'][i], s['bmag'][i], s['vmag'][i], s['e_bv'][i],
+                    s['feh'][i], mode=mode, star_type=star_type, display=False)
+
+
+def scalar_logg(s, i):
+    try:
+        return cal_logg(s['vmag'][i], s['a_v'][i], s['plx'][i], s['teff'][i], s['mass'][i], s['mh'][i])
+    except ValueError:
+        return 'error'
+
+
+def scalar_mass_age(s, i):
+    try:
+        return mass_age_giant(s['teff_giant'][i], s['logg'][i], s['mh'][i], s['cm'][i], s['nm'][i])
+    except ValueError:
+        return 'error'
+
+
+def scalar_outputs(s, n):
+    """
+    the strings of the scalar functions for the first n stars, 'error' where they raise
+    """
+    out = {}
+    for star_type, mode in MODES:
+        out['teff {} {}'.format(star_type, mode)] = [scalar_teff(s, i, star_type, mode) for i in range(n)]
+    out['logg'] = [scalar_logg(s, i) for i in range(n)]
+    out['mass_age'] = [scalar_mass_age(s, i) for i in range(n)]
+    return out
+
+
+def batch_teff(s, star_type, mode, stop=None):
+    return cal_teff_batch(*[s[key][:stop] for key in ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv', 'feh')],
+                          mode=mode, star_type=star_type)
+
+
+def batch_logg(s, stop=None):
+    return cal_logg_batch(*[s[key][:stop] for key in ('vmag', 'a_v', 'plx', 'teff', 'mass', 'mh')])
+
+
+def batch_mass_age(s, stop=None):
+    return mass_age_giant_batch(*[s[key][:stop] for key in ('teff_giant', 'logg', 'mh', 'cm', 'nm')])
+
+
+def load_golden(path=GOLDEN_PATH):
+    """
+    {key of GOLDEN_KEYS: the strings of the scalar function for every star}
+    """
+    with open(path) as f:
+        return json.load(f)['values']
+
+
+def _mismatches(golden, values, valid, tol):
+    """
+    indices where a batched value differs from the scalar string by more than tol, or one of them is missing
+    """
+    bad = []
+    for i, (text, value, ok) in enumerate(zip(golden, values, valid)):
+        if text == 'error' or not ok:
+            if (text == 'error') != (not ok):
+                bad.append(i)
+        elif np.any(np.abs(np.array(text.split(), dtype=float) - value) > tol):
+            bad.append(i)
+    return bad
+
+
+def check_case(key, s, scalar, golden=None):
+    """
+    compare one of GOLDEN_KEYS: the scalar outputs with the golden values (unless golden is None) and the batched
+    outputs with the scalar ones
+    :param scalar: scalar_outputs of the stars s
+    :return: list of failure messages, empty if everything agrees
+    """
+    failures = []
+    if golden is not None:
+        bad = [i for i, (a, b) in enumerate(zip(golden[key], scalar[key])) if a != b]
+        if bad:
+            failures.append('scalar {}: {} stars differ from the golden values, e.g. star {}: {} != {}'.format(
+                key, len(bad), bad[0], scalar[key][bad[0]], golden[key][bad[0]]))
+    n = len(scalar[key])
+    if key == 'logg':
+        res = batch_logg(s, n)
+        bad = _mismatches(scalar[key], res['logg'], res['branch'] >= 0, TOLERANCE['logg'])
+        if bad:
+            failures.append('cal_logg_batch: {} stars differ from cal_logg'.format(len(bad)))
+    elif key == 'mass_age':
+        res = batch_mass_age(s, n)
+        bad = _mismatches(scalar[key], np.column_stack([res['mass'], res['logage']]), res['valid'],
+                          TOLERANCE['mass_age'])
+        if bad:
+            failures.append('mass_age_giant_batch: {} stars differ from mass_age_giant'.format(len(bad)))
+    else:
+        star_type, mode = key.split()[1], int(key.split()[2])
+        res = batch_teff(s, star_type, mode, n)
+        # teff is 0.0 where out of range, as in the strings of cal_teff
+        values = np.where(res['valid'], res['teff'], 0.0)[:, :len(scalar[key][0].split())]
+        bad = _mismatches(scalar[key], values, np.ones(n, bool), TOLERANCE['teff'])
+        if bad:
+            failures.append('cal_teff_batch {} mode {}: {} stars differ from cal_teff'.format(star_type, mode,
+                                                                                              len(bad)))
+    return failures
+
+
+def check_golden(update=False, path=GOLDEN_PATH):
+    """
+    check_case of every key of the golden values, after rewriting them from the scalar outputs with update
+    :return: list of failure messages, empty if everything agrees
+    """
+    s = synthetic_stars(GOLDEN_ROWS, GOLDEN_SEED)
+    scalar = scalar_outputs(s, GOLDEN_ROWS)
+    if update:
+        with open(path, 'w') as f:
+            json.dump({'rows': GOLDEN_ROWS, 'seed': GOLDEN_SEED, 'values': scalar}, f, indent=0, sort_keys=True)
+    golden = None if update else load_golden(path)
+    failures = []
+    for key in GOLDEN_KEYS:
+        failures += check_case(key, s, scalar, golden)
+    return failures
+
+
+#======================================================================================================================
+def _rss_kb(field):
+    """
+    VmRSS / VmHWM (kB) of this process from /proc, ru_maxrss where there is no /proc
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak():
+    """
+    restart the peak rss (VmHWM) at the current rss, linux >= 4.0
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def measure(func, rows, repeat=3):
+    """
+    best wall time of repeat calls of func and the peak memory above the rss before the first call
+    :return: dict of seconds, us_per_star, rows_per_s, peak_mb (nan where the peak cannot be reset)
+    """
+    gc.collect()
+    exact = _reset_peak()
+    start = _rss_kb('VmRSS')
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.time()
+        func()
+        best = min(best, time.time() - t0)
+    peak = (_rss_kb('VmHWM') - start) / 1024. if exact else np.nan
+    return {'seconds': best, 'us_per_star': best / rows * 1e6, 'rows_per_s': rows / best, 'peak_mb': peak}
+
+
+def cases(s, n, scalar_rows):
+    """
+    (name, rows, function) of every benchmark on the first n stars of s, the scalar ones on scalar_rows stars
+    """
+    m = min(n, scalar_rows)
+    out = []
+    for star_type, mode in MODES:
+        out.append(('cal_teff {} mode {}'.format(star_type, mode), m,
+                    lambda star_type=star_type, mode=mode: [scalar_teff(s, i, star_type, mode) for i in range(m)]))
+        out.append(('cal_teff_batch {} mode {}'.format(star_type, mode), n,
+                    lambda star_type=star_type, mode=mode: batch_teff(s, star_type, mode, n)))
+    out.append(('cal_teff_batch mixed types mode 0', n, lambda: batch_teff(s, s['star_type'][:n], 0, n)))
+    out.append(('cal_teff_consensus mixed types', n, lambda: cal_teff_consensus(
+        *[s[key][:n] for key in ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv', 'feh')],
+        star_type=s['star_type'][:n])))
+    out.append(('cal_logg', m, lambda: [scalar_logg(s, i) for i in range(m)]))
+    out.append(('cal_logg_batch', n, lambda: batch_logg(s, n)))
+    out.append(('mass_age_giant', m, lambda: [scalar_mass_age(s, i) for i in range(m)]))
+    out.append(('mass_age_giant_batch', n, lambda: batch_mass_age(s, n)))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='catalog sizes, up to 10000000')
+    parser.add_argument('--scalar-rows', type=int, default=10000, help='stars timed on the scalar (per star) paths')
+    parser.add_argument('--repeat', type=int, default=3, help='best of repeat runs')
+    parser.add_argument('--filter', help='only the cases whose name contains this')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--check-only', action='store_true', help='only run the golden value checks')
+    parser.add_argument('--update-golden', action='store_true', help='rewrite golden_values.json from cal_teff ...')
+    parser.add_argument('--skip-check', action='store_true', help='benchmark without the golden value checks')
+    args = parser.parse_args(argv)
+
+    if not args.skip_check:
+        failures = check_golden(update=args.update_golden)
+        for failure in failures:
+            sys.stderr.write('FAILED ' + failure + '\n')
+        if failures:
+            return 1
+        sys.stderr.write('golden values {}\n'.format('written' if args.update_golden else 'ok'))
+    if args.check_only or args.update_golden:
+        return 0
+
+    s = synthetic_stars(max(args.sizes))
+    results = []
+    print '{:<36} {:>10} {:>10} {:>12} {:>14} {:>10}'.format('case', 'rows', 'seconds', 'us/star', 'rows/s',
+                                                            'peak MB')
+    for n in sorted(args.sizes):
+        for name, rows, func in cases(s, n, args.scalar_rows):
+            if args.filter and args.filter not in name:
+                continue
+            if rows < n and any(r['case'] == name and r['rows'] == rows for r in results):
+                continue  # the scalar rows are capped, already timed
+            r = measure(func, rows, args.repeat)
+            r.update(case=name, rows=rows)
+            results.append(r)
+            print '{:<36} {:>10} {:>10.4f} {:>12.3f} {:>14.0f} {:>10.1f}'.format(
+                name, rows, r['seconds'], r['us_per_star'], r['rows_per_s'], r['peak_mb'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'numpy': np.__version__, 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
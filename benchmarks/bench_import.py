@@ -0,0 +1,71 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: bench_import.py
+# @author: zyt
+# @time: 2018/08/18
+# ====================
+"""
+startup cost of the modules: every module is imported in a fresh interpreter, repeat times, and the median time of
+the import statement and of the whole process (start, import, exit) are reported, with the heavy packages the import
+pulled in. --repo measures another checkout, e.g. the previous commit, to compare. e.g.
+    python benchmarks/bench_import.py --repeat 20
+    git worktree add /tmp/old HEAD~1 && python benchmarks/bench_import.py --repo /tmp/old
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+import numpy as np
+#======================================================================================================================
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+MODULES = ('numpy', 'calibrations', 'params', 'solver', 'service', 'pipeline', 'cal_params')
+HEAVY = ('pandas', 'matplotlib', 'numba', 'pyarrow', 'astropy', 'scipy')
+_CHILD = '''
+import json, sys, timeit
+t0 = timeit.default_timer()
+import {module}
+seconds = timeit.default_timer() - t0
+sys.stdout.write(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def time_import(module, repo=REPO):
+    """
+    import module in a new interpreter started in repo
+    :return: (seconds of the import, seconds of the process, heavy packages loaded)
+    """
+    t0 = timeit.default_timer()
+    out = subprocess.check_output([sys.executable, '-c', _CHILD.format(module=module, heavy=HEAVY)], cwd=repo)
+    process = timeit.default_timer() - t0
+    res = json.loads(out)
+    return res['seconds'], process, res['loaded']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='import time of the modules, each in a fresh interpreter')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='modules to import (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=10, help='interpreters per module, the median is reported')
+    parser.add_argument('--repo', default=REPO, help='checkout to import from (default: this one)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+    results = []
+    print '{:<16} {:>10} {:>12}  {}'.format('module', 'import ms', 'process ms', 'heavy packages loaded')
+    for module in args.modules:
+        time_import(module, args.repo)  # warm the disk cache and the .pyc files
+        runs = [time_import(module, args.repo) for _ in range(args.repeat)]
+        seconds, process = np.median([run[0] for run in runs]), np.median([run[1] for run in runs])
+        loaded = runs[-1][2]
+        print '{:<16} {:>10.1f} {:>12.1f}  {}'.format(module, 1e3 * seconds, 1e3 * process, ' '.join(loaded) or '-')
+        results.append({'module': module, 'import_seconds': seconds, 'process_seconds': process, 'loaded': loaded})
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'repo': os.path.abspath(args.repo), 'results': results}, f,
+                      indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
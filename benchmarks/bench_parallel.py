@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: bench_parallel.py
+# @author: zyt
+# @time: 2018/07/26
+# ====================
+"""
+scaling benchmark of parallel.run_parallel: the same synthetic catalog on 1, 2, 4 ... workers, reporting rows/s,
+speedup and parallel efficiency. e.g.
+    python benchmarks/bench_parallel.py --rows 2000000 --chunksize 50000 --max-workers 64 --format fits
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from parallel import run_parallel
+#======================================================================================================================
+def synthetic_catalog(n, seed=0):
+    """
+    giants and dwarfs with colors and [fe/h] spread over the calibrated ranges, plus the logg and mass/age inputs
+    """
+    rng = np.random.RandomState(seed)
+    vmag = rng.uniform(8., 14., n)
+    vmk = rng.uniform(1.0, 3.5, n)
+    return pd.DataFrame({'ID': np.arange(n), 'Vmag': vmag, 'Bmag': vmag + 0.28 * vmk + rng.normal(0., 0.05, n),
+                         'Jmag': vmag - 0.75 * vmk, 'Hmag': vmag - 0.93 * vmk, 'Kmag': vmag - vmk,
+                         'E_BV': rng.uniform(0., 0.1, n), 'FeH': rng.uniform(-3.0, 0.4, n),
+                         'plx': rng.uniform(0.001, 0.01, n), 'mass': rng.uniform(0.8, 2.5, n),
+                         'CM': rng.uniform(-0.2, 0.1, n), 'NM': rng.uniform(-0.05, 0.3, n),
+                         'TYPE': np.where(rng.rand(n) < 0.6, 'giant', 'dwarf')})
+
+
+def write_catalog(df, path):
+    if path.endswith('.fits'):
+        from astropy.table import Table
+        Table.from_pandas(df).write(path)
+    elif path.endswith('.parquet'):
+        df.to_parquet(path, row_group_size=50000)
+    else:
+        df.to_csv(path, sep=' ', index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--format', default='dat', choices=['dat', 'fits', 'parquet'])
+    parser.add_argument('--teff-only', action='store_true', help='skip the logg and mass/age chain')
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        catalog = os.path.join(tmp, 'catalog.' + args.format)
+        write_catalog(synthetic_catalog(args.rows), catalog)
+        counts = sorted(set([2 ** i for i in range(args.max_workers.bit_length()) if 2 ** i <= args.max_workers] +
+                            [args.max_workers]))
+        base = None
+        print '{:>8} {:>10} {:>12} {:>8} {:>10}'.format('workers', 'seconds', 'rows/s', 'speedup', 'efficiency')
+        for workers in counts:
+            output = os.path.join(tmp, 'out_{}.parquet'.format(workers))
+            t0 = time.time()
+            run_parallel(catalog, output, workers=workers, chunksize=args.chunksize, star_type='TYPE',
+                         chain=not args.teff_only)
+            seconds = time.time() - t0
+            base = base or seconds
+            print '{:>8} {:>10.2f} {:>12.0f} {:>8.2f} {:>10.2f}'.format(workers, seconds, args.rows / seconds,
+                                                                          base / seconds, base / seconds / workers)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
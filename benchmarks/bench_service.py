@@ -0,0 +1,96 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: bench_service.py
+# @author: zyt
+# @time: 2018/08/13
+# ====================
+"""
+load test of service.py: the server runs in this process, closed-loop clients in other processes each send
+single-star requests over a kept-alive connection for a while. reports requests/s, the client side p50/p99
+latency and the batches the server formed. e.g.
+    python benchmarks/bench_service.py --clients 64 --seconds 10 --stars-per-request 1
+"""
+import argparse
+import httplib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from service import ParamsServer
+#======================================================================================================================
+def _star(rng):
+    vmag, vmk = rng.uniform(8., 14.), rng.uniform(1.5, 3.2)
+    return {'vmag': vmag, 'ksmag': vmag - vmk, 'jmag': vmag - 0.76 * vmk, 'hmag': vmag - 0.94 * vmk,
+            'bmag': vmag + 0.3 * vmk, 'e_bv': rng.uniform(0., 0.1), 'feh': rng.uniform(-1.5, 0.3),
+            'plx': rng.uniform(0.001, 0.01), 'mass': rng.uniform(0.8, 2.5), 'cm': 0.0, 'nm': 0.1,
+            'star_type': 'giant' if rng.rand() < 0.6 else 'dwarf'}
+
+
+def client(args):
+    """
+    send requests until the deadline, return the latencies (s)
+    """
+    port, deadline, per_request, seed = args
+    rng = np.random.RandomState(seed)
+    bodies = [json.dumps({'stars': [_star(rng) for _ in range(per_request)]} if per_request > 1 else _star(rng))
+              for _ in range(64)]
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    i = 0
+    while time.time() < deadline:
+        t0 = time.time()
+        conn.request('POST', '/params', bodies[i % len(bodies)], {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('status {}'.format(response.status))
+        latencies.append(time.time() - t0)
+        i += 1
+    conn.close()
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--seconds', type=float, default=5.)
+    parser.add_argument('--stars-per-request', type=int, default=1)
+    parser.add_argument('--max-batch', type=int, default=1024)
+    parser.add_argument('--max-wait-ms', type=float, default=2.)
+    args = parser.parse_args(argv)
+
+    server = ParamsServer(('127.0.0.1', 0), max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000.)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = server.server_address[1]
+    print '{:>8} {:>10} {:>12} {:>10} {:>10} {:>12}'.format('clients', 'requests', 'requests/s', 'p50 ms', 'p99 ms',
+                                                            'stars/batch')
+    try:
+        for clients in args.clients:
+            batches, batch_stars = server.batcher.batches, server.batcher.batch_stars
+            pool = multiprocessing.Pool(clients)
+            deadline = time.time() + args.seconds
+            t0 = time.time()
+            results = pool.map(client, [(port, deadline, args.stars_per_request, seed) for seed in range(clients)])
+            seconds = time.time() - t0
+            pool.close()
+            pool.join()
+            latencies = np.concatenate([np.asarray(r) for r in results])
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+            nbatch = server.batcher.batches - batches
+            print '{:>8} {:>10} {:>12.0f} {:>10.2f} {:>10.2f} {:>12.1f}'.format(
+                clients, len(latencies), len(latencies) / seconds, p50, p99,
+                (server.batcher.batch_stars - batch_stars) / float(max(nbatch, 1)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
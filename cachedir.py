@@ -0,0 +1,64 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: cachedir.py
+# @author: zyt
+# @time: 2018/08/06
+# ====================
+"""
+on-disk cache entries shared by the processes of a run: an entry is a directory of .npy files plus index.json,
+written under a temporary name and renamed into place, so readers only ever see complete entries.
+"""
+import json
+import os
+import shutil
+import tempfile
+#======================================================================================================================
+CACHE_ROOT = os.path.join(os.path.expanduser('~'), '.cache', 'cal_params')
+
+
+def write_json(path, obj):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.rename(tmp, path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_dirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:  # made by another worker meanwhile
+            if not os.path.isdir(path):
+                raise
+
+
+def entry_exists(entry):
+    return os.path.exists(os.path.join(entry, 'index.json'))
+
+
+def publish(entry, save):
+    """
+    create the cache entry directory with save(path), unless it exists or another process wins the race
+    :param save: writes the files of the entry into the (new) directory path, index.json last
+    """
+    if entry_exists(entry):
+        return entry
+    make_dirs(os.path.dirname(entry))
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    try:
+        path = os.path.join(tmp, 'entry')
+        os.makedirs(path)
+        save(path)
+        os.rename(path, entry)  # only complete entries carry the final name
+    except OSError:
+        if not entry_exists(entry):  # not just lost the race to another worker
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
@@ -0,0 +1,90 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: cal_params.py
+# @author: zyt
+# @time: 2018/07/24
+# ====================
+"""
+command line entry of the streaming pipeline, e.g.
+    python cal_params.py teff input.dat -o out.parquet --column e_bv=E_BV_SF --column feh=FeH2
+    python cal_params.py params input.fits -o out.csv --star-type TYPE --chunksize 50000 --workers 32
+teff only calculates teff, params chains teff -> logg -> mass/age where the inputs are there.
+"""
+import argparse
+import logging
+import sys
+import profiling
+#======================================================================================================================
+def parse_columns(items):
+    """
+    ['e_bv=E_BV_SF', ...] -> {'e_bv': 'E_BV_SF', ...}
+    """
+    columns = {}
+    for item in items or []:
+        key, sep, name = item.partition('=')
+        if not sep or not key or not name:
+            raise argparse.ArgumentTypeError('column mapping should be argument=column, not {}'.format(item))
+        columns[key] = name
+    return columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='teff, logg and mass/age of a catalog, streamed in chunks')
+    parser.add_argument('command', choices=['teff', 'params'], help='teff only, or teff -> logg -> mass/age')
+    parser.add_argument('input', help='.dat/.txt (whitespace), .csv, .fits or .parquet catalog')
+    parser.add_argument('-o', '--output', required=True,
+                        help='.parquet, .csv or .dat/.txt output, or a directory for a parquet file per chunk')
+    parser.add_argument('--column', action='append', metavar='ARG=COLUMN',
+                        help='map an input to a column, e.g. jmag=Jmag, e_bv=E_BV_SF, feh=FeH2 (repeatable)')
+    parser.add_argument('--mode', type=int, default=0, choices=[0, 1, 2], help='0 for v-k, 1 for v-j/v-h, 2 for b-v')
+    parser.add_argument('--star-type', default='giant', help="'giant', 'dwarf' or a column holding them")
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows in memory at a time')
+    parser.add_argument('--format', dest='fmt', help='input format if not clear from the file name')
+    parser.add_argument('--skiprows', type=int, help='lines to skip at the top of a text catalog')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes, 0 for all cpus (default 1)')
+    parser.add_argument('--workdir', help='shard checkpoints of a parallel run, rerun with it to resume')
+    parser.add_argument('--dustmap', help='local sfd dust map (directory of the lambert fits or a healpix fits), '
+                                          'e(b-v) is then looked up at the ra/dec columns')
+    parser.add_argument('--dust-scale', default='sf11', choices=['sf11', 'sfd'],
+                        help='sf11 (default, 0.86 x sfd) or the original sfd e(b-v)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write stage timings, branch hits and out of range counts to PATH (.json, or .prom '
+                             'for the prometheus text format)')
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='INFO logs the branch and out of range counts of every calibration at the end')
+    parser.add_argument('--consensus', action='store_true',
+                        help='teff as the weighted mean of all the calibrations, with scatter, count and flags')
+    parser.add_argument('--keep-column', action='append', metavar='COLUMN',
+                        help='input column to copy to the output (repeatable), all of them by default')
+    parser.add_argument('--id-column', help='id of the stars, always kept')
+    parser.add_argument('--buckets', type=int,
+                        help='write a parquet dataset with the rows in this many buckets by the hash of the id')
+    args = parser.parse_args(argv)
+    try:
+        columns = parse_columns(args.column)
+    except argparse.ArgumentTypeError as err:
+        parser.error(str(err))
+    kw = dict(chunksize=args.chunksize, columns=columns, mode=args.mode, star_type=args.star_type,
+              chain=args.command == 'params', fmt=args.fmt, skiprows=args.skiprows, dustmap=args.dustmap,
+              dust_scale=args.dust_scale, consensus=args.consensus, keep_columns=args.keep_column,
+              id_column=args.id_column, buckets=args.buckets)
+    if args.buckets and not args.id_column:
+        parser.error('--buckets needs --id-column')
+    logging.basicConfig(level=getattr(logging, args.log_level), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.profile:
+        profiling.enable()
+    if args.workers == 1:
+        from pipeline import run_catalog
+        rows = run_catalog(args.input, args.output, **kw)
+    else:
+        from parallel import run_parallel
+        rows = run_parallel(args.input, args.output, workers=args.workers or None, workdir=args.workdir, **kw)
+    sys.stderr.write('{} rows written to {}\n'.format(rows, args.output))
+    if args.profile:
+        profiling.disable().write(args.profile)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
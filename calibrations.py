@@ -0,0 +1,228 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: calibrations.py
+# @author: zyt
+# @time: 2018/07/20
+# ====================
+"""
+registry of the empirical teff-color calibrations used by params.cal_teff.
+each calibration is loaded once into contiguous float64 arrays, keyed by (source, star_type, color), and holds
+the theta_eff coefficients (and the ramirez2005 polynomial corrections) of every branch together with the
+color/[fe/h] box the branch applies to. a new calibration is added with one register() call.
+"""
+from collections import OrderedDict, namedtuple
+import numpy as np
+from kernels import eval_boxes
+from profiling import stage
+#======================================================================================================================
+a99 = [[0.5558, 0.2105, 1.981e-3, -9.965e-3, 1.325e-2, -2.726e-3],
+        [0.3770, 0.3660, -3.170e-2, -3.074e-3, -2.765e-3, -2.973e-3],
+        [0.5716, 0.5404, -6.126e-2, -4.862e-2, -1.777e-2, -7.969e-3],
+        [0.6177, 0.4354, -4.025e-3, 5.204e-2, -0.1127, -1.385e-2]]
+a96 = [[0.555, 0.195, 0.013, -0.008, 0.009, -0.002],
+        [0.566, 0.217, -0.003, -0.024, 0.037, -0.002],
+        [0.541, 0.533, 0.007, -0.019, -0.047, -0.011]]
+c10 = [[0.5057, 0.2600, -0.0146, -0.0131, 0.0288, 0.0016],
+        [0.5665, 0.4809, -0.0060, -0.0613, -0.0042, -0.0055],
+        [0.4669, 0.3849, -0.0350, -0.0140, 0.0225, 0.0011],
+        [0.5251, 0.2553, -0.0119, -0.0187, 0.0410, 0.0025]]
+r05g = [[0.4405, 0.3272, -0.0252, -0.0016, -0.0053, -0.0040],
+        [0.2943, 0.5604, -0.0677, 0.0179, -0.0532, -0.0088],
+        [0.4354, 0.3405, -0.0263, -0.0012, -0.0049, -0.0027],
+        [0.5737, 0.4882, -0.0149, 0.0563, -0.1160, -0.0114]]
+r05d = [[0.4942, 0.2809, -0.0180, -0.0294, 0.0444, -0.0008],
+        [0.4050, 0.4792, -0.0617, -0.0392, 0.0401, -0.0023],
+        [0.4931, 0.3056, -0.0241, -0.0396, 0.0678, 0.0020],
+        [0.5002, 0.6440, -0.0690, -0.0230, -0.0566, -0.0170]]
+cor_r05g_vmk = [[-72.6664, 36.5361, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [86.0358, -65.4928, 10.8901, 0.0, 0.0, 0.0, 0.0],
+                [-6.96153, 14.3298, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [-943.925, 1497.64, -795.867, 138.965, 0.0, 0.0, 0.0]]
+cor_r05g_vmj = [[-122.595, 76.4847, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [-10.3848, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [4.18695, 13.8937, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [-67.7716, 28.9202, 0.0, 0.0, 0.0, 0.0, 0.0]]
+cor_r05g_vmh = [[-377.022, 334.733, -69.8093, 0.0, 0.0, 0.0, 0.0],
+                [71.7949, -55.5383, 9.61821, 0.0, 0.0, 0.0, 0.0],
+                [-27.4190, 20.7082, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [-46.2946, 20.1061, 0.0, 0.0, 0.0, 0.0, 0.0]]
+cor_r05g_bmv = [[112.116, -372.622, 67.1254, 395.333, -203.471, 0.0, 0.0],
+                [-12.9762, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [606.032, -1248.79, 627.453, 0.0, 0.0, 0.0, 0.0],
+                [-9.26209, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]
+
+cor_r05d_vmk = [[-1425.36, 3218.36, -2566.54, 859.644, -102.554, 0.0, 0.0],
+                [2.35133, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [-1849.46, 4577.00, -4284.02, 1700.38, -268.589, 0.0, 0.0],
+                [215.721, -796.519, 714.423, -175.678, 0.0, 0.0, 0.0]]
+cor_r05d_vmj = [[422.406, -910.603, 621.335, -132.566, 0.0, 0.0, 0.0],
+                [-466.616, 658.349, -220.454, 0.0, 0.0, 0.0, 0.0],
+                [-862.072, 1236.84, -423.729, 0.0, 0.0, 0.0, 0.0],
+                [-1046.10, 1652.06, -597.340, 0.0, 0.0, 0.0, 0.0]]
+cor_r05d_vmh = [[-53.5574, 36.0990, 15.6878, -8.84468, 0.0, 0.0, 0.0],
+                [1.60629, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [506.559, -1277.52, 939.519, -208.621, 0.0, 0.0, 0.0],
+                [-471.588, 643.972, -199.639, 0.0, 0.0, 0.0, 0.0]]
+cor_r05d_bmv = [[-261.548, 684.977, -470.049, 79.8977, 0.0, 0.0, 0.0],
+                [-324.033, 1516.44, -2107.37, 852.150, 0.0, 0.0, 0.0],
+                [30.5985, -46.7882, 0.0, 0.0, 0.0, 0.0, 0.0],
+                [139.965, -292.329, 0.0, 0.0, 0.0, 0.0, 0.0]]
+
+def formula_teff(a0, a1, a2, a3, a4, a5, col_index, feh):
+    theta_eff = a0 + a1*col_index + a2*col_index**2 + a3*col_index*feh + a4*feh + a5*feh**2
+    return 5040./theta_eff
+
+def cor_r05(p0, p1, p2, p3, p4, p5, p6, col_index):
+    peff = p0 + p1*col_index + p2*col_index**2 + p3*col_index**3 + p4*col_index**4 + p5*col_index**5 \
+           + p6*col_index**6
+    return peff
+
+#======================================================================================================================
+Calibration = namedtuple('Calibration', ['source', 'star_type', 'color', 'index', 'coef', 'cor', 'order', 'boxes',
+                                         'branch', 'rows'])
+CALIBRATIONS = OrderedDict()
+
+# dereddened colors the calibrations are applied to, vmktcs is v-k with k in the tcs system (alonso199x)
+COLOR_INDICES = ('vmktcs', 'vmk', 'vmj', 'vmh', 'bmv')
+nan = np.nan
+
+
+def register(source, star_type, color, index, coef, boxes, branch, cor=None):
+    """
+    add a calibration to CALIBRATIONS, one row of coef/boxes/branch (/cor) per branch of the calibration
+    :param index: one of COLOR_INDICES
+    :param coef: a0 ~ a5 of formula_teff
+    :param boxes: (color min, color max, feh min, feh max), nan for no limit. a star takes the first box it falls in,
+                  so a last box of nan also takes the stars with nan colors, as the else of an if/elif chain
+    :param branch: id reported for each row, e.g. the equation number or the [fe/h] band
+    :param cor: p0 ~ p6 of cor_r05 added to the teff, for ramirez2005
+    """
+    if index not in COLOR_INDICES:
+        raise ValueError('unknown color index {}!'.format(index))
+    coef = np.ascontiguousarray(coef, dtype=np.float64)
+    boxes = np.ascontiguousarray(boxes, dtype=np.float64)
+    branch = np.ascontiguousarray(branch, dtype=np.int8)
+    order = None
+    if cor is not None:
+        cor = np.ascontiguousarray(cor, dtype=np.float64)
+        order = np.array([np.flatnonzero(p).max() if p.any() else 0 for p in cor])
+    if not len(coef) == len(boxes) == len(branch) or cor is not None and len(cor) != len(coef):
+        raise ValueError('one row of coefficients, box and branch is needed per branch!')
+    for arr in (coef, boxes, branch, cor, order):
+        if arr is not None:
+            arr.setflags(write=False)
+    # the same rows as plain floats for eval_teff_scalar, None for no limit
+    rows = [(tuple(None if np.isnan(lim) else float(lim) for lim in boxes[i]), coef[i].tolist(),
+             None if cor is None else cor[i, :order[i] + 1].tolist(), int(branch[i])) for i in range(len(coef))]
+    CALIBRATIONS[source, star_type, color] = Calibration(source, star_type, color, index, coef, cor, order, boxes,
+                                                         branch, rows)
+
+
+def get_calibration(source, star_type, color):
+    try:
+        return CALIBRATIONS[source, star_type, color]
+    except KeyError:
+        raise KeyError('no calibration of {} for {} {}!'.format(source, star_type, color))
+
+
+def _cor_r05_batch(cor, col_index):
+    """
+    cor_r05 summed in the same order, skipping the zero terms (adding 0.0 leaves the sum unchanged)
+    """
+    peff = cor[0] + np.zeros_like(col_index)
+    for power, p in enumerate(cor[1:], 1):
+        if p != 0.0:
+            peff += p*col_index**power
+    return peff
+
+
+def eval_teff(cal, col_index, feh):
+    """
+    evaluate a registered calibration on arrays of dereddened color and [fe/h], in one compiled pass with numba
+    (kernels.eval_boxes), with a numpy mask per box otherwise
+    :return: teff (0.0 out of range) and the branch used (-1 out of range)
+    """
+    if eval_boxes is not None:
+        with stage('teff.kernel', np.size(col_index)):
+            return eval_boxes(cal, col_index, feh)
+    col_index = np.asarray(col_index, dtype=float)
+    feh = np.asarray(feh, dtype=float)
+    teff = np.zeros(col_index.shape)
+    branch = np.full(col_index.shape, -1, dtype=np.int8)
+    todo = np.ones(col_index.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):  # nan colors/[fe/h] fall out of every limited box
+        for i, (cmin, cmax, fmin, fmax) in enumerate(cal.boxes):
+            with stage('teff.select'):
+                mask = todo.copy()
+                for arr, lim, cmp in ((col_index, cmin, np.greater_equal), (col_index, cmax, np.less_equal),
+                                      (feh, fmin, np.greater_equal), (feh, fmax, np.less_equal)):
+                    if not np.isnan(lim):
+                        mask &= cmp(arr, lim)
+            if mask.any():
+                with stage('teff.formula'):
+                    col = col_index[mask]
+                    value = formula_teff(*(list(cal.coef[i]) + [col, feh[mask]]))
+                    if cal.cor is not None:
+                        value = value + _cor_r05_batch(cal.cor[i, :cal.order[i] + 1], col)
+                    teff[mask] = value
+                    branch[mask] = cal.branch[i]
+            todo &= ~mask
+    return teff, branch
+
+
+def eval_teff_scalar(cal, col_index, feh):
+    """
+    eval_teff for a single star, in plain python floats
+    """
+    for (cmin, cmax, fmin, fmax), coef, cor, branch in cal.rows:
+        if (cmin is None or col_index >= cmin) and (cmax is None or col_index <= cmax) and \
+           (fmin is None or feh >= fmin) and (fmax is None or feh <= fmax):
+            teff = formula_teff(*(coef + [col_index, feh]))
+            if cor is not None:
+                teff += sum(p*col_index**power for power, p in enumerate(cor) if p != 0.0)
+            return teff, branch
+    return 0.0, -1
+
+#======================================================================================================================
+# alonso1999 (giants) and alonso1996 (dwarfs), branch is the equation number of the paper
+register('alonso1999', 'giant', 'v-k', 'vmktcs', a99[0:2], [(0.20, 2.50, nan, nan), (nan, nan, nan, nan)], [8, 9])
+register('alonso1999', 'giant', 'b-v', 'bmv', a99[2:4], [(0.20, 0.80, nan, nan), (nan, nan, nan, nan)], [3, 4])
+register('alonso1996', 'dwarf', 'v-k', 'vmktcs', a96[0:2], [(0.40, 1.6, nan, nan), (1.60, 2.2, nan, nan)], [7, 8])
+register('alonso1996', 'dwarf', 'b-v', 'bmv', a96[2:3], [(0.20, 0.80, nan, nan)], [1])
+
+# ramirez2005, branch is the [fe/h] band, 0 for -0.5~0.5, 1 for -1.5~-0.5, 2 for -2.5~-1.5, 3 for -4.0~-2.5
+r05_bands = [0, 1, 2, 3]
+register('ramirez2005', 'giant', 'v-k', 'vmk', [r05g[0]] * 4,
+         [(1.244, 3.286, -0.5, 0.5), (1.366, 4.474, -1.5, -0.5), (1.334, 3.549, -2.5, -1.5),
+          (1.258, 2.768, -4.0, -2.5)], r05_bands, cor_r05g_vmk)
+register('ramirez2005', 'giant', 'v-j', 'vmj', [r05g[1]] * 4,
+         [(1.259, 2.400, -0.5, 0.5), (1.030, 3.418, -1.5, -0.5), (1.033, 2.679, -2.5, -1.5),
+          (0.977, 2.048, -4.0, -2.5)], r05_bands, cor_r05g_vmj)
+register('ramirez2005', 'giant', 'v-h', 'vmh', [r05g[2]] * 4,
+         [(1.194, 3.059, -0.5, 0.5), (1.293, 4.263, -1.5, -0.5), (1.273, 3.416, -2.5, -1.5),
+          (1.232, 2.625, -4.0, -2.5)], r05_bands, cor_r05g_vmh)
+# the b-v bands 1 and 2 use the correction of band 0 and band 2 starts at 0605, both as cal_teff always did
+register('ramirez2005', 'giant', 'b-v', 'bmv', [r05g[3]] * 4,
+         [(0.144, 1.668, -0.5, 0.5), (0.664, 1.558, -1.5, -0.5), (0605, 1.352, -2.5, -1.5),
+          (0.680, 1.110, -4.0, -2.5)], r05_bands,
+         [cor_r05g_bmv[0], cor_r05g_bmv[0], cor_r05g_bmv[0], cor_r05g_bmv[3]])
+register('ramirez2005', 'dwarf', 'v-k', 'vmk', [r05d[0]] * 4,
+         [(0.896, 3.360, -0.5, 0.5), (1.060, 2.665, -1.5, -0.5), (1.101, 2.670, -2.5, -1.5),
+          (1.126, 2.596, -4.0, -2.5)], r05_bands, cor_r05d_vmk)
+register('ramirez2005', 'dwarf', 'v-j', 'vmj', [r05d[1]] * 4,
+         [(0.815, 2.608, -0.5, 0.5), (0.860, 2.087, -1.5, -0.5), (0.927, 1.983, -2.5, -1.5),
+          (0.891, 1.932, -4.0, -2.5)], r05_bands, cor_r05d_vmj)
+register('ramirez2005', 'dwarf', 'v-h', 'vmh', [r05d[2]] * 4,
+         [(0.839, 3.215, -0.5, 0.5), (1.032, 2.532, -1.5, -0.5), (1.070, 2.535, -2.5, -1.5),
+          (1.093, 2.388, -4.0, -2.5)], r05_bands, cor_r05d_vmh)
+register('ramirez2005', 'dwarf', 'b-v', 'bmv', [r05d[3]] * 4,
+         [(0.310, 1.507, -0.5, 0.5), (0.307, 1.202, -1.5, -0.5), (0.335, 1.030, -2.5, -1.5),
+          (0.343, 0.976, -4.0, -2.5)], r05_bands,
+         [cor_r05d_bmv[0], cor_r05d_bmv[0], cor_r05d_bmv[0], cor_r05d_bmv[3]])
+
+# casagrande2010 (dwarfs and subgiants), single branch 0
+register('casagrande2010', 'dwarf', 'v-k', 'vmk', c10[0:1], [(0.78, 3.15, -5.0, 0.40)], [0])
+register('casagrande2010', 'dwarf', 'b-v', 'bmv', c10[1:2], [(0.18, 1.29, -5.0, 0.40)], [0])
+register('casagrande2010', 'dwarf', 'v-j', 'vmj', c10[2:3], [(0.61, 2.44, -5.0, 0.40)], [0])
+register('casagrande2010', 'dwarf', 'v-h', 'vmh', c10[3:4], [(0.67, 3.01, -5.0, 0.40)], [0])
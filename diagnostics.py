@@ -0,0 +1,96 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: diagnostics.py
+# @author: zyt
+# @time: 2018/08/15
+# ====================
+"""
+diagnostic plots of whole catalogs. every class of stars (dwarfs, giants, ir excess ...) is one scatter call, and
+classes of more than max_points stars are drawn as hexbin densities instead, so a survey renders in seconds and the
+file size does not grow with the stars. the figures are made without pyplot, nothing is shown.
+    fig = plot_teff_comparison(teff_spec, teff_irfm, dwarf)
+    fig.savefig('comp_teff.pdf', bbox_inches='tight')
+"""
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
+from matplotlib.patches import Patch
+#======================================================================================================================
+MAX_POINTS = 50000  # stars of a class drawn as points, a density above
+GRIDSIZE = 150  # hexagons across the x range of a density
+CLASS_CMAPS = {'blue': 'Blues', 'red': 'Reds', 'k': 'Greys', 'black': 'Greys', 'green': 'Greens'}
+
+
+def new_figure(figsize=(8, 6), dpi=120):
+    """
+    a Figure on the agg canvas, savefig picks the backend of the file format (pdf, png ...)
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def draw_classes(ax, x, y, classes, max_points=MAX_POINTS, gridsize=GRIDSIZE, extent=None, s=20, **kw):
+    """
+    the stars of every class as one scatter, or a hexbin density when the class has more than max_points stars
+    :param classes: [(label, mask, color), ...], drawn in this order
+    :param extent: (xmin, xmax, ymin, ymax) shared by the densities, so their hexagons line up; the range of the
+                   finite points by default
+    :param kw: passed to scatter, e.g. marker
+    :return: legend handles of the classes
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if extent is None and finite.any():
+        extent = (x[finite].min(), x[finite].max(), y[finite].min(), y[finite].max())
+    handles = []
+    for label, mask, color in classes:
+        pick = finite & np.broadcast_to(mask, x.shape)
+        n = np.count_nonzero(pick)
+        if n > max_points:
+            # translucent, so the densities of overlapping classes mix instead of hiding each other
+            ax.hexbin(x[pick], y[pick], gridsize=gridsize, extent=extent, mincnt=1, bins='log',
+                      cmap=CLASS_CMAPS.get(color, 'viridis'), linewidths=0., alpha=0.6)
+            handles.append(Patch(color=color, label='{} ({})'.format(label, n)))
+        else:
+            # rasterized: a pdf holds one image of the points instead of an object per star
+            handles.append(ax.scatter(x[pick], y[pick], c=color, s=s, edgecolors='none', rasterized=n > 1000,
+                                      label=label, **kw))
+    return handles
+
+
+def plot_teff_comparison(teff_spec, teff_irfm, dwarf, lim=(3000, 6000), max_points=MAX_POINTS, fig=None):
+    """
+    teff_irfm against teff_spec with the 1:1 line, and teff_spec - teff_irfm below, dwarfs blue and giants red
+    :param dwarf: bool array, True for the dwarfs
+    :param lim: (K) teff range of both axes
+    :return: the Figure
+    """
+    teff_spec, teff_irfm = np.asarray(teff_spec, dtype=float), np.asarray(teff_irfm, dtype=float)
+    dwarf, lim = np.asarray(dwarf, dtype=bool), tuple(lim)
+    classes = [('dwarf', dwarf, 'blue'), ('giant', ~dwarf, 'red')]
+    fig = fig or new_figure()
+    gs = GridSpec(2, 1, height_ratios=[3, 1], hspace=0.05)
+
+    upper = fig.add_subplot(gs[0])
+    handles = draw_classes(upper, teff_spec, teff_irfm, classes, max_points=max_points, extent=lim + lim)
+    upper.plot(lim, lim, 'k-')
+    upper.set_ylabel('Teff_IRFM (K)')
+    upper.set_xlim(lim)
+    upper.set_ylim(lim)
+    upper.legend(handles=handles)
+    upper.tick_params(labelbottom=False)
+
+    lower = fig.add_subplot(gs[1], sharex=upper)
+    delta = teff_spec - teff_irfm
+    with np.errstate(invalid='ignore'):
+        shown = np.isfinite(delta) & (teff_spec >= lim[0]) & (teff_spec <= lim[1])
+    span = np.abs(delta[shown]).max() if shown.any() else 1.
+    draw_classes(lower, teff_spec, delta, classes, max_points=max_points, extent=lim + (-span, span))
+    lower.plot(lim, [0., 0.], 'k:')
+    lower.set_xlabel('Teff_spec (K)')
+    lower.set_ylabel('delta_teff')
+    lower.set_xlim(lim)
+    return fig
@@ -0,0 +1,222 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: extinction.py
+# @author: zyt
+# @time: 2018/08/01
+# ====================
+"""
+e(b-v) from a local copy of the schlegel, finkbeiner & davis (1998) dust map instead of the irsa dust service,
+so whole catalogs are reddened offline. the map is either the pair of lambert projections
+(SFD_dust_4096_ngp.fits, SFD_dust_4096_sgp.fits) in a directory, or a healpix map in one fits file (needs healpy).
+the maps are memory mapped, only the pixels around the stars are read, and the values are bilinearly interpolated.
+schlafly & finkbeiner (2011) rescaled the sfd e(b-v) by 0.86, which is the default (scale='sf11'), as in cal_teff.
+    dust = DustMap('/data/sfd')
+    res = cal_teff_batch(jmag, hmag, ksmag, bmag, vmag, dust.ebv_radec(ra, dec), feh)
+"""
+import os
+import numpy as np
+#======================================================================================================================
+SFD_FILES = ('SFD_dust_4096_ngp.fits', 'SFD_dust_4096_sgp.fits')
+SCALES = {'sfd': 1.0, 'sf11': 0.86}
+# icrs unit vector -> galactic unit vector (hipparcos, esa 1997)
+ICRS_TO_GALACTIC = np.array([[-0.0548755604162154, -0.8734370902348850, -0.4838350155487132],
+                             [+0.4941094278755837, -0.4448296299600112, +0.7469822444972189],
+                             [-0.8676661490190047, -0.1980763734312015, +0.4559837761750669]])
+
+
+def radec_to_lb(ra, dec):
+    """
+    icrs ra, dec (deg) -> galactic l (0 ~ 360 deg), b (deg)
+    """
+    ra, dec = np.radians(ra), np.radians(dec)
+    cos_dec = np.cos(dec)
+    x, y, z = np.tensordot(ICRS_TO_GALACTIC, [cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axes=1)
+    return np.degrees(np.arctan2(y, x)) % 360., np.degrees(np.arcsin(np.clip(z, -1., 1.)))
+
+
+def _bilinear(image, x, y):
+    """
+    image interpolated at the pixel coordinates x, y (0 at the center of the first pixel), edges are extended
+    """
+    ny, nx = image.shape
+    x0, y0 = np.floor(x), np.floor(y)
+    fx, fy = x - x0, y - y0
+    x0, y0 = x0.astype(np.intp), y0.astype(np.intp)
+    x1, y1 = np.clip(x0 + 1, 0, nx - 1), np.clip(y0 + 1, 0, ny - 1)
+    x0, y0 = np.clip(x0, 0, nx - 1), np.clip(y0, 0, ny - 1)
+    return ((1. - fy) * ((1. - fx) * image[y0, x0] + fx * image[y0, x1]) +
+            fy * ((1. - fx) * image[y1, x0] + fx * image[y1, x1]))
+
+
+class _ArrayLRU(object):
+    """
+    least recently used cache of floats keyed by int64, looked up and filled a whole array of keys at a time.
+    the keys are kept sorted for np.searchsorted, every lookup is one tick of the clock
+    """
+    def __init__(self, maxsize):
+        self.maxsize = int(maxsize)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+        self.used = np.empty(0, dtype=np.int64)
+        self.tick = 0
+        self.hits = self.misses = 0
+
+    def get(self, keys):
+        """
+        :param keys: sorted unique int64
+        :return: values (nan where missing), found mask
+        """
+        self.tick += 1
+        values = np.full(len(keys), np.nan)
+        if not len(self.keys):
+            found = np.zeros(len(keys), dtype=bool)
+        else:
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[pos] == keys
+            self.used[pos[found]] = self.tick
+            values[found] = self.values[pos[found]]
+        self.hits += int(found.sum())
+        self.misses += int(len(keys) - found.sum())
+        return values, found
+
+    def put(self, keys, values):
+        """
+        :param keys: sorted unique int64 not in the cache
+        """
+        if self.maxsize <= 0 or not len(keys):
+            return
+        if len(keys) > self.maxsize:
+            keys, values = keys[:self.maxsize], values[:self.maxsize]
+        pos = np.searchsorted(self.keys, keys)
+        self.keys = np.insert(self.keys, pos, keys)
+        self.values = np.insert(self.values, pos, values)
+        self.used = np.insert(self.used, pos, self.tick)
+        extra = len(self.keys) - self.maxsize
+        if extra > 0:
+            keep = np.ones(len(self.keys), dtype=bool)
+            keep[np.argpartition(self.used, extra - 1)[:extra]] = False
+            self.keys, self.values, self.used = self.keys[keep], self.values[keep], self.used[keep]
+
+    def clear(self):
+        self.__init__(self.maxsize)
+
+
+class DustMap(object):
+    """
+    e(b-v) lookup of a local sfd dust map
+    """
+    def __init__(self, path, scale='sf11', cache_size=2 ** 20, precision=1e-3, column=0):
+        """
+        :param path: directory of the lambert projections SFD_FILES, or a healpix fits file
+        :param scale: 'sf11' (default, 0.86 x sfd), 'sfd' or a number multiplied to the map
+        :param cache_size: sky positions kept in the lru cache, 0 for no cache
+        :param precision: (deg) with the cache, the positions are rounded to this grid, which keys the cache
+        :param column: column name or number of the healpix map in its table
+        """
+        self.path = path
+        self.scale = SCALES[scale] if scale in SCALES else float(scale)
+        self.precision = float(precision)
+        self.column = column
+        self.cache = _ArrayLRU(cache_size)
+        self._hduls = []
+        self._lambert = self._healpix = None
+        if not os.path.isdir(path) and not os.path.isfile(path):
+            raise IOError('no dust map at {}!'.format(path))
+
+    def _open(self):
+        from astropy.io import fits
+        if os.path.isdir(self.path):
+            self._lambert = []
+            for name in SFD_FILES:
+                hdul = fits.open(os.path.join(self.path, name), memmap=True)
+                self._hduls.append(hdul)
+                h = hdul[0].header
+                self._lambert.append((hdul[0].data, h['LAM_NSGP'], h['LAM_SCAL'], h['CRPIX1'], h['CRPIX2']))
+        else:
+            hdul = fits.open(self.path, memmap=True)
+            self._hduls.append(hdul)
+            hdu = next(hdu for hdu in hdul if isinstance(hdu, fits.BinTableHDU))
+            # maps of nside >= 256 are stored 1024 pixels a row, the reshape is still a view of the memmap
+            image = np.asarray(hdu.data.field(self.column)).reshape(-1)
+            self._healpix = (image, hdu.header.get('ORDERING', 'RING').strip().upper() == 'NESTED')
+
+    def close(self):
+        for hdul in self._hduls:
+            hdul.close()
+        self._hduls = []
+        self._lambert = self._healpix = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup(self, l, b):
+        """
+        uncached sfd e(b-v) at l, b (deg, finite)
+        """
+        if self._lambert is None and self._healpix is None:
+            self._open()
+        l, b = np.radians(l), np.radians(b)
+        if self._healpix is not None:
+            import healpy as hp
+            image, nest = self._healpix
+            pix, weight = hp.get_interp_weights(hp.npix2nside(len(image)), np.pi / 2. - b, l, nest=nest)
+            return (image[pix] * weight).sum(axis=0)
+        out = np.empty(len(l))
+        for image, nsgp, lam_scal, crpix1, crpix2 in self._lambert:
+            sel = b >= 0 if nsgp == 1 else b < 0
+            rho = lam_scal * np.sqrt(1. - nsgp * np.sin(b[sel]))
+            x = crpix1 - 1. + rho * np.cos(l[sel])
+            y = crpix2 - 1. - nsgp * rho * np.sin(l[sel])
+            out[sel] = _bilinear(image, x, y)
+        return out
+
+    def ebv(self, l, b):
+        """
+        e(b-v) at galactic l, b (deg), nan where a coordinate is nan
+        :return: float array of the broadcast shape of l, b
+        """
+        l, b = np.broadcast_arrays(np.asarray(l, dtype=float), np.asarray(b, dtype=float))
+        shape, l, b = l.shape, l.ravel(), b.ravel()
+        out = np.full(l.shape, np.nan)
+        ok = np.isfinite(l) & np.isfinite(b)
+        if self.cache.maxsize <= 0:
+            out[ok] = self._lookup(l[ok], b[ok])
+            return out.reshape(shape) * self.scale
+
+        # the cache works on a grid of positions, repeated stars are only looked up once
+        nb = int(round(180. / self.precision)) + 1
+        il = np.round(l[ok] / self.precision).astype(np.int64) % int(round(360. / self.precision))
+        ib = np.round((b[ok] + 90.) / self.precision).astype(np.int64)
+        keys, inverse = np.unique(il * nb + ib, return_inverse=True)
+        values, found = self.cache.get(keys)
+        if not found.all():
+            new = keys[~found]
+            values[~found] = self._lookup((new // nb) * self.precision, (new % nb) * self.precision - 90.)
+            self.cache.put(new, values[~found])
+        out[ok] = values[inverse]
+        return out.reshape(shape) * self.scale
+
+    def ebv_radec(self, ra, dec):
+        """
+        e(b-v) at icrs ra, dec (deg)
+        """
+        return self.ebv(*radec_to_lb(np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)))
+
+
+_DUST_MAPS = {}
+
+
+def get_dustmap(path, scale='sf11'):
+    """
+    DustMap of path, opened once per process, so the pipeline workers share the cache over their chunks
+    """
+    if isinstance(path, DustMap):
+        return path
+    key = (os.path.abspath(path), scale)
+    if key not in _DUST_MAPS:
+        _DUST_MAPS[key] = DustMap(path, scale=scale)
+    return _DUST_MAPS[key]
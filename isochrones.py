@@ -0,0 +1,365 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: isochrones.py
+# @author: zyt
+# @time: 2018/08/03
+# ====================
+"""
+bayesian ages and masses from a local grid of parsec (cmd output) or mist (.iso) isochrones, after
+jorgensen & lindegren (2005): every isochrone point is weighted by the gaussian likelihood of the observed teff,
+logg and [m/h] times the imf and age priors, and the posterior of log(age) and mass are summarized per star.
+the grid is read once into flat arrays sorted by the cells of an index over ([m/h], logg, logte), so a star only
+visits the points within nsigma of it instead of the whole grid.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from cachedir import CACHE_ROOT, make_dirs, publish, read_json, write_json
+#======================================================================================================================
+# canonical column: names in parsec (cmd 3.x and 2.x) and mist isochrone files
+ISO_COLUMNS = (('logage', ('logAge', 'log(age/yr)', 'log10_isochrone_age_yr')),
+               ('mini', ('Mini', 'M_ini', 'initial_mass')),
+               ('mass', ('Mass', 'M_act', 'star_mass')),
+               ('logte', ('logTe', 'log_Teff')),
+               ('logg', ('logg', 'logG', 'log_g')),
+               ('mh', ('MH', '[M/H]', '[M/H]_init', '[Fe/H]_init', '[Fe/H]')),
+               ('z', ('Zini', 'Z', 'Z_ini')),
+               ('imf', ('int_IMF',)))
+Z_SUN = 0.0152  # parsec, for [m/h] = log10(z / z_sun) when the file has no [m/h] column
+MASS_RESOLUTION = 1e-3  # (msun) of the mass percentiles, the age percentiles are on the ages of the grid
+AGE_PRIORS = ('uniform', 'log')  # flat in age, flat in log(age)
+# arrays of an IsochroneGrid, saved one .npy each in the on-disk cache; bump CACHE_VERSION when they change
+GRID_ARRAYS = ('mh', 'logg', 'logte', 'logage', 'mass', 'weight_log', 'weight_uniform', 'starts', 'age_axis',
+               'age_bin', 'mass_axis', 'mass_bin')
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(CACHE_ROOT, 'isochrones')
+# posterior mean and percentiles of log(age/yr) and of the (current) mass, and the number of isochrone points used
+AgeResult = namedtuple('AgeResult', ['logage', 'mass', 'logage_percentiles', 'mass_percentiles', 'npoints'])
+
+
+def _header(path):
+    """
+    column names of an isochrone file: the last comment line before the data naming a logte column
+    """
+    names = None
+    with open(path) as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if not stripped.startswith('#'):
+                break
+            tokens = stripped.lstrip('#').split()
+            if any(token in ('logTe', 'log_Teff') for token in tokens):
+                names = tokens
+    if names is None:
+        raise ValueError('no isochrone column header in {}!'.format(path))
+    return names
+
+
+def read_isochrone_file(path):
+    """
+    :return: {canonical column: float array} of one parsec or mist isochrone file
+    """
+    import pandas as pd
+    names = _header(path)
+    table = pd.read_csv(path, delim_whitespace=True, comment='#', header=None, names=names, usecols=range(len(names)))
+    columns = {}
+    for key, aliases in ISO_COLUMNS:
+        for alias in aliases:
+            if alias in table:
+                columns[key] = pd.to_numeric(table[alias], errors='coerce').values.astype(float)
+                break
+    if 'mh' not in columns and 'z' in columns:
+        columns['mh'] = np.log10(columns['z'] / Z_SUN)
+    missing = [key for key in ('logage', 'mini', 'mass', 'logte', 'logg', 'mh') if key not in columns]
+    if missing:
+        raise ValueError('{} has no {} column!'.format(path, ', '.join(missing)))
+    return columns
+
+
+def _half_spacing(x):
+    """
+    width of the bin of every point of a sorted 1-d array: half the distance to the neighbours on both sides
+    """
+    if len(x) < 2:
+        return np.ones(len(x))
+    edges = np.concatenate([[x[0]], 0.5 * (x[1:] + x[:-1]), [x[-1]]])
+    return np.diff(edges)
+
+
+def _lookup_spacing(values, unique):
+    return _half_spacing(unique)[np.searchsorted(unique, values)]
+
+
+class IsochroneGrid(object):
+    """
+    isochrone points as flat arrays (logte, logg, mh, logage, mass) plus prior weights, sorted by index cell
+    """
+    def __init__(self, columns, cell=(0.1, 0.1, 0.01)):
+        """
+        :param columns: {canonical column: array}, from read_isochrone_file
+        :param cell: ([m/h], logg, logte) size of the cells of the index
+        """
+        c = dict((key, np.asarray(value, dtype=float)) for key, value in columns.items())
+        ok = np.ones(len(c['logte']), dtype=bool)
+        for key in ('logage', 'mini', 'mass', 'logte', 'logg', 'mh'):
+            ok &= np.isfinite(c[key])
+        c = dict((key, value[ok]) for key, value in c.items())
+
+        # imf weight of every point along its isochrone, from the integrated imf when the file has it
+        bounds = np.flatnonzero((np.diff(c['mh']) != 0) | (np.diff(c['logage']) != 0)) + 1
+        imf = np.empty(len(c['mini']))
+        for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(imf)]):
+            if 'imf' in c:
+                imf[start:stop] = np.abs(_half_spacing(c['imf'][start:stop]))
+            else:  # salpeter
+                imf[start:stop] = c['mini'][start:stop] ** -2.35 * np.abs(_half_spacing(c['mini'][start:stop]))
+        # age (linear and log) and [m/h] bin widths of every point over the ages and metallicities of the grid
+        ages, mhs = np.unique(c['logage']), np.unique(c['mh'])
+        self.weight_log = imf * _lookup_spacing(c['logage'], ages) * _lookup_spacing(c['mh'], mhs)
+        self.weight_uniform = imf * _lookup_spacing(10 ** c['logage'], 10 ** ages) * _lookup_spacing(c['mh'], mhs)
+
+        self.cell = np.asarray(cell, dtype=float)
+        coords = np.column_stack([c['mh'], c['logg'], c['logte']])
+        self.origin = coords.min(axis=0)
+        self.shape = (np.floor((coords.max(axis=0) - self.origin) / self.cell).astype(np.intp) + 1)
+        cells = self._linear(*np.floor((coords - self.origin) / self.cell).astype(np.intp).T)
+        order = np.argsort(cells, kind='mergesort')
+        self.mh, self.logg, self.logte = [np.ascontiguousarray(coords[order, i]) for i in range(3)]
+        self.logage, self.mass = c['logage'][order], c['mass'][order]
+        self.weight_log, self.weight_uniform = self.weight_log[order], self.weight_uniform[order]
+        # points of cell k are starts[k]:starts[k + 1]
+        self.starts = np.searchsorted(cells[order], np.arange(np.prod(self.shape) + 1))
+        # the percentiles are read from weighted histograms over these axes instead of sorting every star's points
+        self.age_axis = np.unique(self.logage)
+        self.age_bin = np.searchsorted(self.age_axis, self.logage)
+        rounded = np.round(self.mass / MASS_RESOLUTION) * MASS_RESOLUTION
+        self.mass_axis = np.unique(rounded)
+        self.mass_bin = np.searchsorted(self.mass_axis, rounded)
+
+    @classmethod
+    def from_arrays(cls, arrays, cell, origin, shape):
+        """
+        IsochroneGrid of already indexed arrays (GRID_ARRAYS), e.g. memory mapped from the cache
+        """
+        grid = cls.__new__(cls)
+        for name in GRID_ARRAYS:
+            setattr(grid, name, arrays[name])
+        grid.cell, grid.origin = np.asarray(cell, dtype=float), np.asarray(origin, dtype=float)
+        grid.shape = np.asarray(shape, dtype=np.intp)
+        return grid
+
+    def __len__(self):
+        return len(self.logte)
+
+    def _linear(self, im, ig, it):
+        return (im * self.shape[1] + ig) * self.shape[2] + it
+
+    def _segments(self, lo, hi):
+        """
+        point ranges of the cells inside the boxes lo ~ hi (n, 3), every (mh, logg) row of a box is one contiguous
+        range because logte varies fastest
+        :return: star of every segment, segment start, segment stop
+        """
+        i0 = np.maximum(np.floor((lo - self.origin) / self.cell), 0).astype(np.intp)
+        i1 = np.minimum(np.floor((hi - self.origin) / self.cell), self.shape - 1).astype(np.intp)
+        empty = (i1 < i0).any(axis=1)
+        nm, ng = i1[:, 0] - i0[:, 0] + 1, i1[:, 1] - i0[:, 1] + 1
+        nseg = np.where(empty, 0, nm * ng)
+        star = np.repeat(np.arange(len(lo)), nseg)
+        k = np.arange(nseg.sum()) - np.repeat(np.cumsum(nseg) - nseg, nseg)
+        im, ig = i0[star, 0] + k // ng[star], i0[star, 1] + k % ng[star]
+        start = self.starts[self._linear(im, ig, i0[star, 2])]
+        stop = self.starts[self._linear(im, ig, i1[star, 2]) + 1]
+        return star, start, stop
+
+    def posterior(self, teff, e_teff, logg, e_logg, mh, e_mh, nsigma=4., age_prior='uniform',
+                  percentiles=(16, 50, 84), max_pairs=2 ** 22):
+        """
+        batched posterior of log(age) and mass
+        :param teff, e_teff: (K)
+        :param nsigma: isochrone points with chi2 > nsigma**2 in (logte, logg, [m/h]) are left out
+        :param age_prior: 'uniform' in age (default) or 'log' for uniform in log(age)
+        :param max_pairs: star x isochrone point (or histogram bin) pairs in memory at a time
+        :return: AgeResult, nan for stars without isochrone points within nsigma
+        """
+        if age_prior not in AGE_PRIORS:
+            raise ValueError('age_prior should be one of {}!'.format(', '.join(AGE_PRIORS)))
+        arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                       for x in (teff, e_teff, logg, e_logg, mh, e_mh)])
+        teff, e_teff, logg, e_logg, mh, e_mh = [a.ravel() for a in arrays]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = np.column_stack([mh, logg, np.log10(teff)])
+            sig = np.column_stack([e_mh, e_logg, e_teff / (teff * np.log(10.))])
+            todo = np.flatnonzero(np.isfinite(x).all(axis=1) & (sig > 0).all(axis=1))
+        weight = self.weight_uniform if age_prior == 'uniform' else self.weight_log
+        n, q = len(teff), np.asarray(percentiles, dtype=float) / 100.
+        out = AgeResult(np.full(n, np.nan), np.full(n, np.nan), np.full((n, len(q)), np.nan),
+                        np.full((n, len(q)), np.nan), np.zeros(n, dtype=np.intp))
+        if not len(todo):
+            return out
+
+        star, start, stop = self._segments(x[todo] - nsigma * sig[todo], x[todo] + nsigma * sig[todo])
+        pairs = np.bincount(star, weights=stop - start, minlength=len(todo))
+        # split the stars so that every batch holds at most max_pairs pairs and histogram bins (and at least one star)
+        cum = np.cumsum(pairs)
+        per_batch = max(1, max_pairs // max(len(self.age_axis), len(self.mass_axis)))
+        first = 0
+        while first < len(todo):
+            last = np.searchsorted(cum, cum[first] - pairs[first] + max_pairs, side='right')
+            last = max(first + 1, min(last, first + per_batch))
+            a, b = np.searchsorted(star, [first, last])  # the segments are ordered by star
+            self._posterior_batch(out, todo[first:last], x, sig, weight, nsigma, q, star[a:b] - first,
+                                  start[a:b], stop[a:b])
+            first = last
+        return out
+
+    def _posterior_batch(self, out, index, x, sig, weight, nsigma, q, star, start, stop):
+        length = stop - start
+        total = length.sum()
+        if not total:
+            return
+        # point index of every (star, point) pair: the concatenation of the ranges start:stop
+        point = np.arange(total) - np.repeat(np.cumsum(length) - length - start, length)
+        star = np.repeat(star, length)
+        chi2 = np.zeros(total)
+        for grid, xk, sk in ((self.mh, x[index, 0], sig[index, 0]), (self.logg, x[index, 1], sig[index, 1]),
+                             (self.logte, x[index, 2], sig[index, 2])):
+            chi2 += ((grid[point] - xk[star]) / sk[star]) ** 2
+        keep = chi2 <= nsigma ** 2
+        star, point = star[keep], point[keep]
+        w = np.exp(-0.5 * chi2[keep]) * weight[point]
+        nstar = len(index)
+        total_w = np.bincount(star, weights=w, minlength=nstar)
+        found = total_w > 0
+        out.npoints[index] = np.bincount(star, minlength=nstar)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name, values, bins, axis, pct in (
+                    ('logage', self.logage, self.age_bin, self.age_axis, out.logage_percentiles),
+                    ('mass', self.mass, self.mass_bin, self.mass_axis, out.mass_percentiles)):
+                getattr(out, name)[index] = np.where(found, np.bincount(star, weights=w * values[point],
+                                                                        minlength=nstar) / total_w, np.nan)
+                pct[index[found]] = _binned_percentiles(star, bins[point], w, nstar, axis, q)[found]
+
+
+def _binned_percentiles(star, bins, w, nstar, axis, q):
+    """
+    per star, the first value of axis whose normalized cumulative weight reaches q
+    :return: (nstar, len(q)), rows of stars without weight are garbage
+    """
+    nbin = len(axis)
+    hist = np.bincount(star * nbin + bins, weights=w, minlength=nstar * nbin).reshape(nstar, nbin)
+    cum = np.cumsum(hist, axis=1)
+    cum /= cum[:, -1:]
+    idx = np.column_stack([(cum < qi).sum(axis=1) for qi in q])
+    return axis[np.minimum(idx, nbin - 1)]
+
+
+def read_isochrones(paths, cell=(0.1, 0.1, 0.01)):
+    """
+    IsochroneGrid of one or several parsec/mist files (e.g. one per metallicity)
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    tables = [read_isochrone_file(path) for path in paths]
+    keys = set.intersection(*[set(table) for table in tables])
+    return IsochroneGrid(dict((key, np.concatenate([table[key] for table in tables])) for key in keys), cell=cell)
+
+
+#======================================================================================================================
+def _file_hash(path, stamps):
+    """
+    sha1 of the file content, remembered in stamps by (size, mtime) so unchanged files are not read again
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = stamps.get(path)
+    if stamp and stamp[:2] == [st.st_size, st.st_mtime]:
+        return stamp[2]
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    stamps[path] = [st.st_size, st.st_mtime, sha.hexdigest()]
+    return stamps[path][2]
+
+
+def cache_key(paths, cell=(0.1, 0.1, 0.01), cache_dir=CACHE_DIR):
+    """
+    cache entry name of a grid: sha1 of the source file hashes, the index cells and CACHE_VERSION
+    """
+    stamp_path = os.path.join(cache_dir, 'stamps.json')
+    try:
+        stamps = read_json(stamp_path)
+    except (IOError, ValueError):
+        stamps = {}
+    before = dict(stamps)
+    hashes = [_file_hash(path, stamps) for path in paths]
+    if stamps != before:
+        write_json(stamp_path, stamps)
+    meta = json.dumps([CACHE_VERSION, hashes, [float(c) for c in cell]])
+    return hashlib.sha1(meta.encode('utf-8')).hexdigest()
+
+
+def save_grid(grid, path, sources=()):
+    """
+    write the arrays of grid as .npy files plus index.json into the (existing) directory path
+    """
+    for name in GRID_ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(getattr(grid, name)))
+    write_json(os.path.join(path, 'index.json'),
+                {'version': CACHE_VERSION, 'cell': grid.cell.tolist(), 'origin': grid.origin.tolist(),
+                 'shape': [int(n) for n in grid.shape], 'sources': [os.path.abspath(p) for p in sources]})
+
+
+def load_grid(path, mmap_mode='r'):
+    """
+    IsochroneGrid saved by save_grid, memory mapped (read only) by default
+    """
+    index = read_json(os.path.join(path, 'index.json'))
+    if index['version'] != CACHE_VERSION:
+        raise ValueError('{} is a version {} cache, not {}!'.format(path, index['version'], CACHE_VERSION))
+    arrays = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)) for name in GRID_ARRAYS)
+    return IsochroneGrid.from_arrays(arrays, index['cell'], index['origin'], index['shape'])
+
+
+def load_isochrones(paths, cell=(0.1, 0.1, 0.01), cache_dir=CACHE_DIR):
+    """
+    read_isochrones through the on-disk cache: the first call parses the files and saves the indexed grid under
+    cache_dir, later calls (from any process) memory map it. a change of the files or of cell makes a new entry
+    :param cache_dir: None to always parse the files
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if cache_dir is None:
+        return read_isochrones(paths, cell=cell)
+    make_dirs(cache_dir)
+    entry = os.path.join(cache_dir, cache_key(paths, cell, cache_dir))
+    return load_grid(publish(entry, lambda path: save_grid(read_isochrones(paths, cell=cell), path, sources=paths)))
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """
+    remove every cached grid
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+_GRIDS = {}
+
+
+def get_isochrones(paths, cache_dir=CACHE_DIR):
+    """
+    IsochroneGrid of paths, loaded once per process through the on-disk cache
+    """
+    if isinstance(paths, IsochroneGrid):
+        return paths
+    key = (paths,) if isinstance(paths, str) else tuple(paths)
+    if key not in _GRIDS:
+        _GRIDS[key] = load_isochrones(list(key), cache_dir=cache_dir)
+    return _GRIDS[key]
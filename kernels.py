@@ -0,0 +1,128 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: kernels.py
+# @author: zyt
+# @time: 2018/08/17
+# ====================
+"""
+optional compiled kernels, used when numba is installed: the box selection, theta_eff polynomial and ramirez2005
+correction of calibrations.eval_teff, and the relation selection and bolometric correction of params.cal_logg_batch,
+each in one loop over the stars, without the masks and the temporaries (color**2 ... color**6, color*feh ...) of the
+numpy path. every term is computed as numpy does (x*x for **2, pow for the higher powers, in the same order), so the
+results are identical. numba is imported and the kernels compiled at their first call (cached on disk by numba), so
+importing this module stays as cheap as numpy.
+without numba, or with the environment variable CAL_PARAMS_NO_NUMBA set, eval_boxes and logg_bc are None and the
+callers use numpy.
+"""
+import imp
+import math
+import os
+import numpy as np
+#======================================================================================================================
+def _have_numba():
+    if os.environ.get('CAL_PARAMS_NO_NUMBA'):
+        return False
+    try:
+        imp.find_module('numba')  # found without importing it
+    except ImportError:
+        return False
+    return True
+
+
+_KERNELS = {}
+
+
+def _kernels():
+    """
+    the compiled kernels {name: function}, numba imported and the functions jitted at the first call
+    """
+    if not _KERNELS:
+        import numba
+        jit = numba.njit(nogil=True, cache=True)
+        _KERNELS.update(eval_boxes=jit(_eval_boxes), logg_bc=jit(_logg_bc))
+    return _KERNELS
+
+
+eval_boxes = logg_bc = None
+
+if _have_numba():
+    def _eval_boxes(col_index, feh, boxes, coef, cor, order, branch_id, teff, branch):
+        for k in range(col_index.shape[0]):
+            c, f = col_index[k], feh[k]
+            teff[k], branch[k] = 0.0, -1
+            for i in range(boxes.shape[0]):
+                # a star takes the first box it falls in, nan limits are open and nan inputs fall out of the others
+                box = boxes[i]
+                if not (np.isnan(box[0]) or c >= box[0]) or not (np.isnan(box[1]) or c <= box[1]) \
+                   or not (np.isnan(box[2]) or f >= box[2]) or not (np.isnan(box[3]) or f <= box[3]):
+                    continue
+                a = coef[i]
+                value = 5040. / (a[0] + a[1] * c + a[2] * (c * c) + a[3] * c * f + a[4] * f + a[5] * (f * f))
+                if order[i] >= 0:
+                    peff = cor[i, 0] + 0.0
+                    for power in range(1, order[i] + 1):
+                        p = cor[i, power]
+                        if p != 0.0:
+                            if power == 1:
+                                peff += p * c
+                            elif power == 2:
+                                peff += p * (c * c)
+                            else:
+                                peff += p * math.pow(c, float(power))
+                    value = value + peff
+                teff[k], branch[k] = value, branch_id[i]
+                break
+
+    def _logg_bc(teff, feh, ranges, bands, coef, bc, branch):
+        for k in range(teff.shape[0]):
+            logt, f = math.log10(teff[k]) if teff[k] > 0 else np.nan, feh[k]
+            bc[k], branch[k] = np.nan, -1
+            for b in range(ranges.shape[0]):
+                hit = False
+                for j in range(bands.shape[0]):
+                    if ranges[b, j, 0] <= logt <= ranges[b, j, 1] and bands[j, 0] <= f <= bands[j, 1]:
+                        hit = True
+                        break
+                if hit:  # the cool relation wins where both apply
+                    c, x = coef[b], logt - 3.52
+                    bc[k] = c[0] / x + c[1] + c[2] * x + c[3] * (x * x) + c[4] * x * f + c[5] * f + c[6] * (f * f)
+                    branch[k] = b
+                    break
+
+    _ARGS = {}
+
+    def eval_boxes(cal, col_index, feh):
+        """
+        calibrations.eval_teff of the calibration cal in one pass
+        :return: teff (0.0 out of range) and the branch used (-1 out of range)
+        """
+        key = cal[:3]
+        if key not in _ARGS:
+            nbox = len(cal.boxes)
+            if cal.cor is None:
+                cor, order = np.zeros((nbox, 1)), np.full(nbox, -1, dtype=np.int64)
+            else:
+                cor, order = np.ascontiguousarray(cal.cor), np.asarray(cal.order, dtype=np.int64)
+            _ARGS[key] = (np.ascontiguousarray(cal.boxes), np.ascontiguousarray(cal.coef), cor, order,
+                          np.ascontiguousarray(cal.branch))
+        col_index, feh = np.broadcast_arrays(np.asarray(col_index, dtype=float), np.asarray(feh, dtype=float))
+        teff = np.empty(col_index.shape)
+        branch = np.empty(col_index.shape, dtype=np.int8)
+        _kernels()['eval_boxes'](np.ascontiguousarray(col_index).ravel(), np.ascontiguousarray(feh).ravel(),
+                                 *(_ARGS[key] + (teff.reshape(-1), branch.reshape(-1))))
+        return teff, branch
+
+    def logg_bc(teff, feh, relations, feh_bands):
+        """
+        the bolometric correction of params.cal_logg_batch and the relation used (-1 out of range), in one pass
+        :param relations: params.BC_RELATIONS, feh_bands params.BC_FEH_BANDS
+        """
+        ranges = np.array([r for r, _ in relations], dtype=float)
+        coef = np.array([c for _, c in relations], dtype=float)
+        teff, feh = np.ascontiguousarray(teff, dtype=float), np.ascontiguousarray(feh, dtype=float)
+        bc = np.empty(teff.shape)
+        branch = np.empty(teff.shape, dtype=np.int8)
+        _kernels()['logg_bc'](teff.ravel(), feh.ravel(), ranges, np.array(feh_bands, dtype=float), coef,
+                              bc.reshape(-1), branch.reshape(-1))
+        return bc, branch
@@ -0,0 +1,159 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: parallel.py
+# @author: zyt
+# @time: 2018/07/26
+# ====================
+"""
+run the pipeline of a whole survey on a pool of worker processes.
+the catalog is cut into shards of chunksize rows, every shard is calculated by a worker and checkpointed to the
+work directory, and the shards are written to the output in the input order. a run that crashed restarts from the
+shards already in the work directory. fits and parquet shards are read by the workers themselves, text catalogs
+are read by the main process and sent over.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import pandas as pd
+import profiling
+from params import log_teff_summary
+from pipeline import ChunkWriter, _suffix, chunk_summary, read_chunks, run_chunk
+#======================================================================================================================
+MANIFEST = 'manifest.json'
+
+
+def _shard_path(workdir, index):
+    return os.path.join(workdir, 'shard_{:06d}.pkl'.format(index))
+
+
+def _shards(path, chunksize, fmt=None, skiprows=None):
+    """
+    yield (index, source) of every shard, source is a DataFrame or (path, suffix, start, stop) to read in the worker
+    """
+    suffix = _suffix(path, fmt)
+    if suffix == '.fits':
+        from astropy.io import fits
+        with fits.open(path, memmap=True) as hdul:
+            nrows = next(hdu for hdu in hdul if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU))).data.shape[0]
+        for index, start in enumerate(range(0, nrows, chunksize)):
+            yield index, (path, suffix, start, min(start + chunksize, nrows))
+    elif suffix == '.parquet':
+        import pyarrow.parquet as pq
+        for index in range(pq.ParquetFile(path).num_row_groups):  # one row group per shard
+            yield index, (path, suffix, index, index + 1)
+    else:
+        for index, df in enumerate(read_chunks(path, chunksize=chunksize, fmt=fmt, skiprows=skiprows)):
+            yield index, df
+
+
+def _read_source(source):
+    if isinstance(source, pd.DataFrame):
+        return source
+    path, suffix, start, stop = source
+    if suffix == '.parquet':
+        import pyarrow.parquet as pq
+        # a block per column and the arrow buffers released while converting, numeric columns are not copied
+        return pq.ParquetFile(path).read_row_group(start).to_pandas(split_blocks=True, self_destruct=True)
+    return next(read_chunks(path, chunksize=stop - start, fmt=suffix, start=start))
+
+
+def _run_shard(args):
+    """
+    :return: index of the shard and the profile of the shard (None unless profiling is on in the main process)
+    """
+    index, source, workdir, kw, profile = args
+    if profile:
+        profiling.enable()
+    with profiling.stage('read') as timer:
+        df = _read_source(source)
+        timer.rows = len(df)
+    out = run_chunk(df, **kw)
+    path = _shard_path(workdir, index)
+    with profiling.stage('write.shard', len(out)):
+        out.to_pickle(path + '.tmp')
+        os.rename(path + '.tmp', path)  # only complete shards ever carry the final name
+    return index, profile and profiling.disable().snapshot()
+
+
+def _check_manifest(workdir, settings):
+    path = os.path.join(workdir, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f) != settings:
+                raise ValueError('{} holds shards of another run, remove it or pick another workdir!'.format(workdir))
+    else:
+        with open(path, 'w') as f:
+            json.dump(settings, f)
+
+
+def run_parallel(path, output, workers=None, chunksize=100000, workdir=None, columns=None, mode=0,
+                 star_type='giant', chain=True, fmt=None, skiprows=None, keep=False, dustmap=None, dust_scale='sf11',
+                 consensus=False, keep_columns=None, id_column=None, buckets=None):
+    """
+    pipeline.run_catalog on a process pool, with the output rows in the input order
+    :param workers: number of processes, all cpus by default
+    :param chunksize: rows per shard (parquet catalogs are sharded by row group)
+    :param workdir: where the shards are checkpointed, output + '.shards' by default; rerunning with the same
+                    workdir skips the shards already finished, unless the input file changed since
+    :param keep: keep the workdir after the output is written
+    :param dustmap: path of a local dust map for e(b-v), opened once in every worker
+    :param keep_columns: input columns kept in the output, id_column and buckets for a bucketed dataset as in
+                         run_catalog
+    with profiling on, the profiles of the workers are merged into the active profiler
+    :return: number of rows written
+    """
+    workers = workers or multiprocessing.cpu_count()
+    workdir = workdir or output + '.shards'
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    if keep_columns is not None and id_column is not None and id_column not in keep_columns:
+        keep_columns = [id_column] + list(keep_columns)
+    kw = {'columns': columns, 'mode': mode, 'star_type': star_type, 'chain': chain,
+          'dustmap': dustmap and os.path.abspath(dustmap), 'dust_scale': dust_scale,
+          'consensus': consensus, 'keep_columns': keep_columns}
+    # the size and mtime of the input tell a rewritten catalog from the one the shards were calculated from
+    st = os.stat(path)
+    _check_manifest(workdir, dict(kw, input=os.path.abspath(path), input_size=st.st_size, input_mtime=st.st_mtime,
+                                  fmt=fmt, chunksize=chunksize, skiprows=skiprows))
+
+    profiler = profiling.active()
+
+    def finish(job):
+        snapshot = job.get()[1]
+        if snapshot:
+            profiler.merge(snapshot)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending, nshard = [], 0
+        for index, source in _shards(path, chunksize, fmt=fmt, skiprows=skiprows):
+            nshard = index + 1
+            if os.path.exists(_shard_path(workdir, index)):
+                continue  # finished before the crash
+            pending.append(pool.apply_async(_run_shard, [(index, source, workdir, kw, profiler is not None)]))
+            while len(pending) >= 2 * workers:  # bound the shards held in memory
+                finish(pending.pop(0))
+        for job in pending:
+            finish(job)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    summary = {}
+    with ChunkWriter(output, id_column=id_column, buckets=buckets) as writer:
+        for index in range(nshard):
+            with profiling.stage('write') as timer:
+                df = pd.read_pickle(_shard_path(workdir, index))
+                timer.rows = len(df)
+                writer.write(df)
+            chunk_summary(df, mode=mode, star_type=star_type, summary=summary)
+        rows = writer.rows
+    log_teff_summary(summary)
+    if not keep:
+        shutil.rmtree(workdir)
+    return rows
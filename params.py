@@ -10,11 +10,25 @@ calculate teff from the color indices, considering the galactic dust reddening a
 e(b-v) through the coordinate from the website: http://irsa.ipac.caltech.edu/applications/dust/.
 extinction measurement refered to schlegel, finkbeiner & davis (1998); schlafly and finkbeiner (2011)(default).
 empirical teff-color relations refered to alonso 1996,1999; ramirez 2005; casagrande 2010.
+the calculations only import numpy; pandas, the plots and the catalog i/o (pipeline.py) are imported where they are
+used, so short-lived workers start fast.
 """
+from collections import namedtuple
+import logging
+import sys
 import numpy as np
-import pandas as pd
+from calibrations import CALIBRATIONS, get_calibration, eval_teff, eval_teff_scalar
+from isochrones import get_isochrones
+from kernels import logg_bc
+from profiling import active, branch_hits, stage
 #======================================================================================================================
-def cal_teff(jmag, hmag, ksmag, bmag, vmag, e_bv, feh=0.0, mode=0, star_type='giant', display=True):
+# per-star diagnostics go to this logger at debug level, summaries of whole batches at info (see log_teff_summary)
+logger = logging.getLogger('cal_params')
+logger.addHandler(logging.NullHandler())
+
+
+#======================================================================================================================
+def cal_teff(jmag, hmag, ksmag, bmag, vmag, e_bv, feh=0.0, mode=0, star_type='giant', display=True, as_str=True):
     """
     :param jmag: 2mass magnitude system
     :param hmag: 2mass magnitude system
@@ -22,436 +36,405 @@ def cal_teff(jmag, hmag, ksmag, bmag, vmag, e_bv, feh=0.0, mode=0, star_type='gi
     :param bmag: johnson system
     :param vmag: johnson system
     :param e_bv:
-    :param feh: default is 0.0
+    :param feh: default is 0.0, nan and 99.0 (unknown) are taken as 0.0
     :param mode: mode = 0 (default) for v-k,  1 for v-j and v-h,  2 for b-v
     :param star_type: giant or dwarf
+    :param display: print the calibration (and equation) used or out of range, otherwise it is only logged to the
+                    'cal_params' logger at debug level
+    :param as_str: True (default) for the formatted string, False for a TeffResult
     :return: teff
     2005Ramirez calibrations range from F0 to K5 (4000 K ~ 7000 K), metallicity range -3.5 ~ 0.4
     """
-    teff = np.zeros(3)
-    bmv = bmag - vmag
-    bmv_0 = bmv - e_bv
-
-    e_vmj = e_bv * 2.16  # ramirez2005ii
-    vmj = vmag - jmag
-    vmj_0 = vmj - e_vmj
-
-    e_vmh = e_bv * 2.51  # ramirez2005ii
-    vmh = vmag - hmag
-    vmh_0 = vmh - e_vmh
-
-    e_vmk = e_bv * 2.70  # ramirez2005ii
-    vmk = vmag - ksmag
-    vmk_0 = vmk - e_vmk  # here k represent ks from 2mass
-
-    e_vmktcs = e_bv * 2.74  # 2005ramirezi
-
-# vmktcs_1 = 0.05 + 0.993*vmk_0 # alonso1998
-    a99 = [[0.5558, 0.2105, 1.981e-3, -9.965e-3, 1.325e-2, -2.726e-3],
-            [0.3770, 0.3660, -3.170e-2, -3.074e-3, -2.765e-3, -2.973e-3],
-            [0.5716, 0.5404, -6.126e-2, -4.862e-2, -1.777e-2, -7.969e-3],
-            [0.6177, 0.4354, -4.025e-3, 5.204e-2, -0.1127, -1.385e-2]]
-    a96 = [[0.555, 0.195, 0.013, -0.008, 0.009, -0.002],
-            [0.566, 0.217, -0.003, -0.024, 0.037, -0.002],
-            [0.541, 0.533, 0.007, -0.019, -0.047, -0.011]]
-    c10 = [[0.5057, 0.2600, -0.0146, -0.0131, 0.0288, 0.0016],
-            [0.5665, 0.4809, -0.0060, -0.0613, -0.0042, -0.0055]]
-    r05g = [[0.4405, 0.3272, -0.0252, -0.0016, -0.0053, -0.0040],
-            [0.2943, 0.5604, -0.0677, 0.0179, -0.0532, -0.0088],
-            [0.4354, 0.3405, -0.0263, -0.0012, -0.0049, -0.0027],
-            [0.5737, 0.4882, -0.0149, 0.0563, -0.1160, -0.0114]]
-    r05d = [[0.4942, 0.2809, -0.0180, -0.0294, 0.0444, -0.0008],
-            [0.4050, 0.4792, -0.0617, -0.0392, 0.0401, -0.0023],
-            [0.4931, 0.3056, -0.0241, -0.0396, 0.0678, 0.0020],
-            [0.5002, 0.6440, -0.0690, -0.0230, -0.0566, -0.0170]]
-    cor_r05g_vmk = [[-72.6664, 36.5361, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [86.0358, -65.4928, 10.8901, 0.0, 0.0, 0.0, 0.0],
-                    [-6.96153, 14.3298, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [-943.925, 1497.64, -795.867, 138.965, 0.0, 0.0, 0.0]]
-    cor_r05g_vmj = [[-122.595, 76.4847, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [-10.3848, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [4.18695, 13.8937, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [-67.7716, 28.9202, 0.0, 0.0, 0.0, 0.0, 0.0]]
-    cor_r05g_vmh = [[-377.022, 334.733, -69.8093, 0.0, 0.0, 0.0, 0.0],
-                    [71.7949, -55.5383, 9.61821, 0.0, 0.0, 0.0, 0.0],
-                    [-27.4190, 20.7082, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [-46.2946, 20.1061, 0.0, 0.0, 0.0, 0.0, 0.0]]
-    cor_r05g_bmv = [[112.116, -372.622, 67.1254, 395.333, -203.471, 0.0, 0.0],
-                    [-12.9762, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [606.032, -1248.79, 627.453, 0.0, 0.0, 0.0, 0.0],
-                    [-9.26209, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]
-
-    cor_r05d_vmk = [[-1425.36, 3218.36, -2566.54, 859.644, -102.554, 0.0, 0.0],
-                    [2.35133, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [-1849.46, 4577.00, -4284.02, 1700.38, -268.589, 0.0, 0.0],
-                    [215.721, -796.519, 714.423, -175.678, 0.0, 0.0, 0.0]]
-    cor_r05d_vmj = [[422.406, -910.603, 621.335, -132.566, 0.0, 0.0, 0.0],
-                    [-466.616, 658.349, -220.454, 0.0, 0.0, 0.0, 0.0],
-                    [-862.072, 1236.84, -423.729, 0.0, 0.0, 0.0, 0.0],
-                    [-1046.10, 1652.06, -597.340, 0.0, 0.0, 0.0, 0.0]]
-    cor_r05d_vmh = [[-53.5574, 36.0990, 15.6878, -8.84468, 0.0, 0.0, 0.0],
-                    [1.60629, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [506.559, -1277.52, 939.519, -208.621, 0.0, 0.0, 0.0],
-                    [-471.588, 643.972, -199.639, 0.0, 0.0, 0.0, 0.0]]
-    cor_r05d_bmv = [[-261.548, 684.977, -470.049, 79.8977, 0.0, 0.0, 0.0],
-                    [-324.033, 1516.44, -2107.37, 852.150, 0.0, 0.0, 0.0],
-                    [30.5985, -46.7882, 0.0, 0.0, 0.0, 0.0, 0.0],
-                    [139.965, -292.329, 0.0, 0.0, 0.0, 0.0, 0.0]]
-
-    def formula_teff(a0, a1, a2, a3, a4, a5, col_index, feh):
-        theta_eff = a0 + a1*col_index + a2*col_index**2 + a3*col_index*feh + a4*feh + a5*feh**2
-        return 5040./theta_eff
-
-    def cor_r05(p0, p1, p2, p3, p4, p5, p6, col_index):
-        peff = p0 + p1*col_index + p2*col_index**2 + p3*col_index**3 + p4*col_index**4 + p5*col_index**5 \
-               + p6*col_index**6
-        return peff
-    if feh in [np.nan, 99.0]:
+    if feh != feh or feh == 99.0:  # nan never equals itself, so `feh in [np.nan, 99.0]` missed it
         feh = 0.0
-    if star_type == 'giant':
-        ktcs = ksmag - 0.014 + 0.027 * (jmag - ksmag)  # 2005ramirezi
-        vmktcs = vmag - ktcs
-        vmktcs_0 = vmktcs - e_vmktcs
-        if mode == 0:
-            if (vmktcs_0 >= 0.20) & (vmktcs_0 <= 2.50):
-                teff[0] = formula_teff(a99[0][0], a99[0][1], a99[0][2], a99[0][3], a99[0][4],
-                                       a99[0][5], vmktcs_0, feh)
-                if display:
-                    print 'giant v-k (alonso1999) eq.8', '{:.0f}'.format(teff[0])
-            else:
-                teff[0] = formula_teff(a99[1][0], a99[1][1], a99[1][2], a99[1][3], a99[1][4],
-                                      a99[1][5], vmktcs_0, feh)
-                if display:
-                    print 'giant v-k (alonso1999) eq.9', '{:.0f}'.format(teff[0])
-
-            teff_a = formula_teff(r05g[0][0], r05g[0][1], r05g[0][2], r05g[0][3],
-                                  r05g[0][4], r05g[0][5], vmk_0, feh)
-            if (vmk_0 >= 1.244) & (vmk_0 <= 3.286) and (feh >= -0.5) & (feh <= 0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_vmk[0][0], cor_r05g_vmk[0][1], cor_r05g_vmk[0][2], cor_r05g_vmk[0][3],
-                                  cor_r05g_vmk[0][4], cor_r05g_vmk[0][5], cor_r05g_vmk[0][6], vmk_0)
-                if display:
-                    print 'giant v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmk_0 >= 1.366) & (vmk_0 <= 4.474) and (feh >= -1.5) & (feh <= -0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_vmk[1][0], cor_r05g_vmk[1][1], cor_r05g_vmk[1][2], cor_r05g_vmk[1][3],
-                                  cor_r05g_vmk[1][4], cor_r05g_vmk[1][5], cor_r05g_vmk[1][6], vmk_0)
-                if display:
-                    print 'giant v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmk_0 >= 1.334) & (vmk_0 <= 3.549) and (feh >= -2.5) & (feh <= -1.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_vmk[2][0], cor_r05g_vmk[2][1], cor_r05g_vmk[2][2], cor_r05g_vmk[2][3],
-                                  cor_r05g_vmk[2][4], cor_r05g_vmk[2][5], cor_r05g_vmk[2][6], vmk_0)
-                if display:
-                    print 'giant v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmk_0 >= 1.258) & (vmk_0 <= 2.768) and (feh >= -4.0) & (feh <= -2.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_vmk[3][0], cor_r05g_vmk[3][1], cor_r05g_vmk[3][2], cor_r05g_vmk[3][3],
-                                  cor_r05g_vmk[3][4], cor_r05g_vmk[3][5], cor_r05g_vmk[3][6], vmk_0)
-                if display:
-                    print 'giant v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            else:
-                print 'out of ramirez2005 v-k range!'
-            return '{:07.2f}  {:07.2f}'.format(teff[0], teff[1])
-
-        if mode == 1:
-            teff_a = formula_teff(r05g[1][0], r05g[1][1], r05g[1][2], r05g[1][3],
-                                  r05g[1][4], r05g[1][5], vmj_0, feh)
-            if (vmj_0 >= 1.259) & (vmj_0 <= 2.400) & (feh >= -0.5) & (feh <= 0.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05g_vmj[0][0], cor_r05g_vmj[0][1], cor_r05g_vmj[0][2], cor_r05g_vmj[0][3],
-                                  cor_r05g_vmj[0][4], cor_r05g_vmj[0][5], cor_r05g_vmj[0][6], vmj_0)
-                if display:
-                    print 'giant v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            elif (vmj_0 >= 1.030) & (vmj_0 <= 3.418) & (feh >= -1.5) & (feh <= -0.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05g_vmj[1][0], cor_r05g_vmj[1][1], cor_r05g_vmj[1][2], cor_r05g_vmj[1][3],
-                                  cor_r05g_vmj[1][4], cor_r05g_vmj[1][5], cor_r05g_vmj[1][6], vmj_0)
-                if display:
-                    print 'giant v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            elif (vmj_0 >= 1.033) & (vmj_0 <= 2.679) & (feh >= -2.5) & (feh <= -1.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05g_vmj[2][0], cor_r05g_vmj[2][1], cor_r05g_vmj[2][2], cor_r05g_vmj[2][3],
-                                  cor_r05g_vmj[2][4], cor_r05g_vmj[2][5], cor_r05g_vmj[2][6], vmj_0)
-                if display:
-                    print 'giant v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            elif (vmj_0 >= 0.977) & (vmj_0 <= 2.048) & (feh >= -4.0) & (feh <= -2.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05g_vmj[3][0], cor_r05g_vmj[3][1], cor_r05g_vmj[3][2], cor_r05g_vmj[3][3],
-                                  cor_r05g_vmj[3][4], cor_r05g_vmj[3][5], cor_r05g_vmj[3][6], vmj_0)
-                if display:
-                    print 'giant v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            else:
-                print 'out of ramirez2005 v-j range!'
-
-            teff_b = formula_teff(r05g[2][0], r05g[2][1], r05g[2][2], r05g[2][3],
-                                  r05g[2][4], r05g[2][5], vmh_0, feh)
-            if (vmh_0 >= 1.194) & (vmh_0 <= 3.059) and (feh >= -0.5) & (feh <= 0.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05g_vmh[0][0], cor_r05g_vmh[0][1], cor_r05g_vmh[0][2], cor_r05g_vmh[0][3],
-                                  cor_r05g_vmh[0][4], cor_r05g_vmh[0][5], cor_r05g_vmh[0][6], vmh_0)
-                if display:
-                    print 'giant v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmh_0 >= 1.293) & (vmh_0 <= 4.263) & (feh >= -1.5) & (feh <= -0.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05g_vmh[1][0], cor_r05g_vmh[1][1], cor_r05g_vmh[1][2], cor_r05g_vmh[1][3],
-                                  cor_r05g_vmh[1][4], cor_r05g_vmh[1][5], cor_r05g_vmh[1][6], vmh_0)
-                if display:
-                    print 'giant v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmh_0 >= 1.273) & (vmh_0 <= 3.416) & (feh >= -2.5) & (feh <= -1.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05g_vmh[2][0], cor_r05g_vmh[2][1], cor_r05g_vmh[2][2], cor_r05g_vmh[2][3],
-                                  cor_r05g_vmh[2][4], cor_r05g_vmh[2][5], cor_r05g_vmh[2][6], vmh_0)
-                if display:
-                    print 'giant v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmh_0 >= 1.232) & (vmh_0 <= 2.625) & (feh >= -4.0) & (feh <= -2.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05g_vmh[3][0], cor_r05g_vmh[3][1], cor_r05g_vmh[3][2], cor_r05g_vmh[3][3],
-                                  cor_r05g_vmh[3][4], cor_r05g_vmh[3][5], cor_r05g_vmh[3][6], vmh_0)
-                if display:
-                    print 'giant v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            else:
-                print 'out of ramirez2005 v-h range!'
-            return '{:07.2f}  {:07.2f}'.format(teff[0], teff[1])
-
-        if mode == 2:
-            if (bmv_0 >= 0.20) & (bmv_0 <= 0.80):
-                teff[0] = formula_teff(a99[2][0], a99[2][1], a99[2][2], a99[2][3], a99[2][4],
-                                       a99[2][5], bmv_0, feh)
-                if display:
-                    print 'giant b-v (alonso1999) eq.3', '{:.0f}'.format(teff[0])
-            else:
-                teff[0] = formula_teff(a99[3][0], a99[3][1], a99[3][2], a99[3][3], a99[3][4],
-                                       a99[3][5], bmv_0, feh)
-                if display:
-                    print 'giant b-v (alonso1999) eq.4', '{:.0f}'.format(teff[0])
-
-            teff_a = formula_teff(r05g[3][0], r05g[3][1], r05g[3][2], r05g[3][3],
-                                  r05g[3][4], r05g[3][5], bmv_0, feh)
-            if (bmv_0 >= 0.144) & (bmv_0 <= 1.668) and (feh >= -0.5) & (feh <= 0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_bmv[0][0], cor_r05g_bmv[0][1], cor_r05g_bmv[0][2], cor_r05g_bmv[0][3],
-                                  cor_r05g_bmv[0][4], cor_r05g_bmv[0][5], cor_r05g_bmv[0][6], bmv_0)
-                if display:
-                    print 'giant b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (bmv_0 >= 0.664) & (bmv_0 <= 1.558) & (feh >= -1.5) & (feh <= -0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_bmv[0][0], cor_r05g_bmv[0][1], cor_r05g_bmv[0][2], cor_r05g_bmv[0][3],
-                                  cor_r05g_bmv[0][4], cor_r05g_bmv[0][5], cor_r05g_bmv[0][6], bmv_0)
-                if display:
-                    print 'giant b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (bmv_0 >= 0605) & (bmv_0 <= 1.352) & (feh >= -2.5) & (feh <= -1.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_bmv[0][0], cor_r05g_bmv[0][1], cor_r05g_bmv[0][2], cor_r05g_bmv[0][3],
-                                  cor_r05g_bmv[0][4], cor_r05g_bmv[0][5], cor_r05g_bmv[0][6], bmv_0)
-                if display:
-                    print 'giant b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (bmv_0 >= 0.680) & (bmv_0 <= 1.110) & (feh >= -4.0) & (feh <= -2.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05g_bmv[3][0], cor_r05g_bmv[3][1], cor_r05g_bmv[3][2], cor_r05g_bmv[3][3],
-                                  cor_r05g_bmv[3][4], cor_r05g_bmv[3][5], cor_r05g_bmv[3][6], bmv_0)
-                if display:
-                    print 'giant b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            else:
-                print 'out of ramirez2005 b-v range!'
-            return '{:07.2f}  {:07.2f}'.format(teff[0], teff[1])
-        else:
-            raise TypeError('mode excess the color indices ranges!')
-
-    elif star_type == 'dwarf':
-        ktcs = ksmag - 0.014 + 0.034 * (jmag - ksmag)  # 2005ramirezi
-        vmktcs = vmag - ktcs
-        vmktcs_0 = vmktcs - e_vmktcs
-        if mode == 0:
-            if (vmktcs_0 >= 0.40) and (vmktcs_0 <= 1.6):
-                teff[0] = formula_teff(a96[0][0], a96[0][1], a96[0][2], a96[0][3], a96[0][4],
-                                       a96[0][5], vmktcs_0, feh)
-                if display:
-                    print 'dwarf v-k (alonso1996) eq.7', '{:.0f}'.format(teff[0])
-            elif (vmktcs_0 > 1.60) and (vmktcs_0 <= 2.2):
-                teff[0] = formula_teff(a96[1][0], a96[1][1], a96[1][2], a96[1][3], a96[1][4],
-                                       a96[1][5], vmktcs_0, feh)
-                if display:
-                    print 'dwarf v-k (alonso1996) eq.8', '{:.0f}'.format(teff[0])
-            else:
-                print 'out of alonso1996 v-k range!'
-            teff_a = formula_teff(r05d[0][0], r05d[0][1], r05d[0][2], r05d[0][3],
-                                  r05d[0][4], r05d[0][5], vmk_0, feh)
-            if (vmk_0 >= 0.896) & (vmk_0 <= 3.360) and (feh >= -0.5) & (feh <= 0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_vmk[0][0], cor_r05d_vmk[0][1], cor_r05d_vmk[0][2], cor_r05d_vmk[0][3],
-                                  cor_r05d_vmk[0][4], cor_r05d_vmk[0][5], cor_r05d_vmk[0][6], vmk_0)
-                if display:
-                    print 'dwarf v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmk_0 >= 1.060) & (vmk_0 <= 2.665) and (feh >= -1.5) & (feh <= -0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_vmk[1][0], cor_r05d_vmk[1][1], cor_r05d_vmk[1][2], cor_r05d_vmk[1][3],
-                                  cor_r05d_vmk[1][4], cor_r05d_vmk[1][5], cor_r05d_vmk[1][6], vmk_0)
-                if display:
-                    print 'dwarf v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmk_0 >= 1.101) & (vmk_0 <= 2.670) and (feh >= -2.5) & (feh <= -1.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_vmk[2][0], cor_r05d_vmk[2][1], cor_r05d_vmk[2][2], cor_r05d_vmk[2][3],
-                                  cor_r05d_vmk[2][4], cor_r05d_vmk[2][5], cor_r05d_vmk[2][6], vmk_0)
-                if display:
-                    print 'dwarf v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmk_0 >= 1.126) & (vmk_0 <= 2.596) and (feh >= -4.0) & (feh <= -2.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_vmk[3][0], cor_r05d_vmk[3][1], cor_r05d_vmk[3][2], cor_r05d_vmk[3][3],
-                                  cor_r05d_vmk[3][4], cor_r05d_vmk[3][5], cor_r05d_vmk[3][6], vmk_0)
-                if display:
-                    print 'dwarf v-k (ramirez2005)', '{:.0f}'.format(teff[1])
-            else:
-                print 'out of ramirez2005 v-k range!'
-
-            if (vmk_0 >= 0.78) & (vmk_0 <= 3.15) & (feh >= -5.0) & (feh <= 0.40):
-                teff[2] = formula_teff(c10[0][0], c10[0][1], c10[0][2], c10[0][3], c10[0][4],
-                                       c10[0][5], vmk_0, feh)
-                if display:
-                    print 'dwarf v-k (casagrande2010)', '{:.0f}'.format(teff[2])
-            else:
-                print 'out of casagrande2010 v-k range!'
-            return '{:07.2f}  {:07.2f}  {:07.2f}'.format(teff[0], teff[1], teff[2])
-
-        if mode == 1:
-            teff_a = formula_teff(r05d[1][0], r05d[1][1], r05d[1][2], r05d[1][3],
-                                  r05d[1][4], r05d[1][5], vmj_0, feh)
-            if (vmj_0 >= 0.815) & (vmj_0 <= 2.608) & (feh >= -0.5) & (feh <= 0.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05d_vmj[0][0], cor_r05d_vmj[0][1], cor_r05d_vmj[0][2], cor_r05d_vmj[0][3],
-                                  cor_r05d_vmj[0][4], cor_r05d_vmj[0][5], cor_r05d_vmj[0][6], vmj_0)
-                if display:
-                    print 'dwarf v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            elif (vmj_0 >= 0.860) & (vmj_0 <= 2.087) & (feh >= -1.5) & (feh <= -0.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05d_vmj[1][0], cor_r05d_vmj[1][1], cor_r05d_vmj[1][2], cor_r05d_vmj[1][3],
-                                  cor_r05d_vmj[1][4], cor_r05d_vmj[1][5], cor_r05d_vmj[1][6], vmj_0)
-                if display:
-                    print 'dwarf v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            elif (vmj_0 >= 0.927) & (vmj_0 <= 1.983) & (feh >= -2.5) & (feh <= -1.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05d_vmj[2][0], cor_r05d_vmj[2][1], cor_r05d_vmj[2][2], cor_r05d_vmj[2][3],
-                                  cor_r05d_vmj[2][4], cor_r05d_vmj[2][5], cor_r05d_vmj[2][6], vmj_0)
-                if display:
-                    print 'dwarf v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            elif (vmj_0 >= 0.891) & (vmj_0 <= 1.932) & (feh >= -4.0) & (feh <= -2.5):
-                teff[0] = teff_a + \
-                          cor_r05(cor_r05d_vmj[3][0], cor_r05d_vmj[3][1], cor_r05d_vmj[3][2], cor_r05d_vmj[3][3],
-                                  cor_r05d_vmj[3][4], cor_r05d_vmj[3][5], cor_r05d_vmj[3][6], vmj_0)
-                if display:
-                    print 'dwarf v-j (ramirez2005)', '{:.0f}'.format(teff[0])
-            else:
-                print 'out of ramirez2005 v-j range!'
-
-            teff_b = formula_teff(r05d[2][0], r05d[2][1], r05d[2][2], r05d[2][3],
-                                  r05d[2][4], r05d[2][5], vmh_0, feh)
-            if (vmh_0 >= 0.839) & (vmh_0 <= 3.215) & (feh >= -0.5) & (feh <= 0.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05d_vmh[0][0], cor_r05d_vmh[0][1], cor_r05d_vmh[0][2], cor_r05d_vmh[0][3],
-                                  cor_r05d_vmh[0][4], cor_r05d_vmh[0][5], cor_r05d_vmh[0][6], vmh_0)
-                if display:
-                    print 'dwarf v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmh_0 >= 1.032) & (vmh_0 <= 2.532) & (feh >= -1.5) & (feh <= -0.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05d_vmh[1][0], cor_r05d_vmh[1][1], cor_r05d_vmh[1][2], cor_r05d_vmh[1][3],
-                                  cor_r05d_vmh[1][4], cor_r05d_vmh[1][5], cor_r05d_vmh[1][6], vmh_0)
-                if display:
-                    print 'dwarf v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmh_0 >= 1.070) & (vmh_0 <= 2.535) & (feh >= -2.5) & (feh <= -1.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05d_vmh[2][0], cor_r05d_vmh[2][1], cor_r05d_vmh[2][2], cor_r05d_vmh[2][3],
-                                  cor_r05d_vmh[2][4], cor_r05d_vmh[2][5], cor_r05d_vmh[2][6], vmh_0)
-                if display:
-                    print 'dwarf v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (vmh_0 >= 1.093) & (vmh_0 <= 2.388) & (feh >= -4.0) & (feh <= -2.5):
-                teff[1] = teff_b + \
-                          cor_r05(cor_r05d_vmh[3][0], cor_r05d_vmh[3][1], cor_r05d_vmh[3][2], cor_r05d_vmh[3][3],
-                                  cor_r05d_vmh[3][4], cor_r05d_vmh[3][5], cor_r05d_vmh[3][6], vmh_0)
-                if display:
-                    print 'dwarf v-h (ramirez2005)', '{:.0f}'.format(teff[1])
-            else:
-                print 'out of ramirez2005 v-h range!'
-            return '{:07.2f}  {:07.2f}'.format(teff[0], teff[1])
-
-        if mode == 2:
-            if (bmv_0 >= 0.20) & (bmv_0 <= 0.80):
-                teff[0] = formula_teff(a96[2][0], a96[2][1], a96[2][2], a96[2][3], a96[2][4],
-                                       a96[2][5], bmv_0, feh)
-                if display:
-                    print 'dwarf b-v (alonso1996) eq.1', '{:.0f}'.format(teff[0])
-
-            teff_a = formula_teff(r05d[3][0], r05d[3][1], r05d[3][2], r05d[3][3],
-                                  r05d[3][4], r05d[3][5], bmv_0, feh)
-            if (bmv_0 >= 0.310) & (bmv_0 <= 1.507) & (feh >= -0.5) & (feh <= 0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_bmv[0][0], cor_r05d_bmv[0][1], cor_r05d_bmv[0][2], cor_r05d_bmv[0][3],
-                                  cor_r05d_bmv[0][4], cor_r05d_bmv[0][5], cor_r05d_bmv[0][6], bmv_0)
-                if display:
-                    print 'dwarf b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (bmv_0 >= 0.307) & (bmv_0 <= 1.202) & (feh >= -1.5) & (feh <= -0.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_bmv[0][0], cor_r05d_bmv[0][1], cor_r05d_bmv[0][2], cor_r05d_bmv[0][3],
-                                  cor_r05d_bmv[0][4], cor_r05d_bmv[0][5], cor_r05d_bmv[0][6], bmv_0)
-                if display:
-                    print 'dwarf b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (bmv_0 >= 0.335) & (bmv_0 <= 1.030) & (feh >= -2.5) & (feh <= -1.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_bmv[0][0], cor_r05d_bmv[0][1], cor_r05d_bmv[0][2], cor_r05d_bmv[0][3],
-                                  cor_r05d_bmv[0][4], cor_r05d_bmv[0][5], cor_r05d_bmv[0][6], bmv_0)
-                if display:
-                    print 'dwarf b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            elif (bmv_0 >= 0.343) & (bmv_0 <= 0.976) & (feh >= -4.0) & (feh <= -2.5):
-                teff[1] = teff_a + \
-                          cor_r05(cor_r05d_bmv[3][0], cor_r05d_bmv[3][1], cor_r05d_bmv[3][2], cor_r05d_bmv[3][3],
-                                  cor_r05d_bmv[3][4], cor_r05d_bmv[3][5], cor_r05d_bmv[3][6], bmv_0)
-                if display:
-                    print 'dwarf b-v (ramirez2005)', '{:.0f}'.format(teff[1])
-            else:
-                print 'out of ramirez2005 b-v range!'
-
-            if (bmv_0 >= 0.18) & (bmv_0 <= 1.29) & (feh >= -5.0) & (feh <= 0.40):
-                teff[2] = formula_teff(c10[1][0], c10[1][1], c10[1][2], c10[1][3], c10[1][4],
-                                       c10[1][5], bmv_0, feh)
-                if display:
-                    print 'dwarf b-v (casagrande2010)', '{:.0f}'.format(teff[2])
-            else:
-                print 'out of casagrande12010 b-v range!'
-            return '{:07.2f}  {:07.2f} {:07.2f}'.format(teff[0], teff[1], teff[2])
+    if star_type not in ('giant', 'dwarf'):
+        return None
+    if mode not in (0, 1, 2):
+        raise TypeError('mode excess the color indices ranges!')
+    teff, valid, branch = [0.0, 0.0, 0.0], [False, False, False], [-1, -1, -1]
+    for i, label in enumerate(TEFF_LABELS[star_type, mode]):
+        calib, color = label.split()
+        cal = get_calibration(calib, star_type, color)
+        col_index = _color_index(cal.index, star_type, jmag, hmag, ksmag, bmag, vmag, e_bv)
+        teff[i], branch[i] = eval_teff_scalar(cal, col_index, feh)
+        valid[i] = branch[i] >= 0 and not (np.isnan(teff[i]) or np.isinf(teff[i]))
+        if active() is not None:
+            branch_hits(' '.join(cal[:3]), [branch[i]])
+        if branch[i] >= 0:
+            eq = ' eq.{}'.format(branch[i]) if calib.startswith('alonso') else ''
+            if display:
+                print '{} {} ({}){}'.format(star_type, color, calib, eq), '{:.0f}'.format(teff[i])
+            logger.debug('%s %s (%s)%s %.0f', star_type, color, calib, eq, teff[i])
+        elif (star_type, mode, i) != ('dwarf', 2, 0):
+            if display:
+                print 'out of {} {} range!'.format(calib, color)
+            logger.debug('out of %s %s range!', calib, color)
+    result = TeffResult(tuple(teff), tuple(valid), tuple(branch))
+    if as_str:
+        with stage('teff.format', 1):
+            return format_teff(result, mode=mode, star_type=star_type)
+    return result
+
+
+def format_teff(result, mode=0, star_type='giant'):
+    """
+    render a TeffResult as the string cal_teff used to return
+    """
+    if star_type == 'dwarf' and mode == 0:
+        return '{:07.2f}  {:07.2f}  {:07.2f}'.format(*result.teff)
+    if star_type == 'dwarf' and mode == 2:
+        return '{:07.2f}  {:07.2f} {:07.2f}'.format(*result.teff)
+    return '{:07.2f}  {:07.2f}'.format(*result.teff[:2])
 
-        else:
-            raise TypeError('mode excess the color indices ranges!')
 
 #======================================================================================================================
-def cal_logg(vmag, a_v, plx, teff, mass, feh=0.0, test=False):
-    global mbol_star  # change the global variable
+TEFF_COLUMNS = {'jmag': 'Jmag', 'hmag': 'Hmag', 'ksmag': 'Kmag', 'bmag': 'Bmag', 'vmag': 'Vmag', 'e_bv': 'E_BV',
+                'feh': 'FeH'}
+
+# calibration and color behind teff[0], teff[1], teff[2] for each (star_type, mode)
+TEFF_LABELS = {('giant', 0): ['alonso1999 v-k', 'ramirez2005 v-k'],
+               ('giant', 1): ['ramirez2005 v-j', 'ramirez2005 v-h'],
+               ('giant', 2): ['alonso1999 b-v', 'ramirez2005 b-v'],
+               ('dwarf', 0): ['alonso1996 v-k', 'ramirez2005 v-k', 'casagrande2010 v-k'],
+               ('dwarf', 1): ['ramirez2005 v-j', 'ramirez2005 v-h'],
+               ('dwarf', 2): ['alonso1996 b-v', 'ramirez2005 b-v', 'casagrande2010 b-v']}
+
+# one row per star: teff (0.0 where not calculated), whether it is valid and the branch used, which is the
+# equation number for alonso199x, the [fe/h] band (0 for -0.5~0.5 ... 3 for -4.0~-2.5) for ramirez2005,
+# 0 for casagrande2010 and -1 where the star is out of range. status tells why a teff is not valid, see TEFF_STATUS
+TEFF_DTYPE = np.dtype([('teff', 'f8', 3), ('valid', '?', 3), ('branch', 'i1', 3), ('status', 'u1', 3)])
+# status codes: valid, color nan, outside every box of the calibration, in a box but teff not finite,
+# no calibration in the slot (e.g. teff[2] of giants) or unknown star type
+TEFF_OK, TEFF_NO_COLOR, TEFF_OUT_OF_RANGE, TEFF_INVALID, TEFF_UNUSED = range(5)
+TEFF_STATUS = ('ok', 'no color', 'out of range', 'invalid', 'unused')
+TeffResult = namedtuple('TeffResult', ['teff', 'valid', 'branch'])
+# branch is the bolometric correction used, 0 for the cool and 1 for the hot relation of alonso1999, -1 (with nan
+# logg, bc and mbol) where the star is out of both
+LOGG_DTYPE = np.dtype([('logg', 'f8'), ('bc', 'f8'), ('mbol', 'f8'), ('branch', 'i1')])
+LoggResult = namedtuple('LoggResult', ['logg', 'bc', 'mbol', 'branch'])
+MassAgeResult = namedtuple('MassAgeResult', ['mass', 'logage'])
+# mass and log(age) of mass_age_giant_batch, nan where valid is False (out of the calibration box)
+MASS_AGE_DTYPE = np.dtype([('mass', 'f8'), ('logage', 'f8'), ('valid', '?')])
+
+
+def _color_index(index, star_type, jmag, hmag, ksmag, bmag, vmag, e_bv):
+    """
+    dereddened color named by calibrations.COLOR_INDICES
+    """
+    if index == 'vmktcs':
+        ktcs = ksmag - 0.014 + (0.027 if star_type == 'giant' else 0.034) * (jmag - ksmag)  # 2005ramirezi
+        return vmag - ktcs - e_bv * 2.74
+    if index == 'vmk':
+        return vmag - ksmag - e_bv * 2.70  # ramirez2005ii, here k represent ks from 2mass
+    if index == 'vmj':
+        return vmag - jmag - e_bv * 2.16  # ramirez2005ii
+    if index == 'vmh':
+        return vmag - hmag - e_bv * 2.51  # ramirez2005ii
+    if index == 'bmv':
+        return bmag - vmag - e_bv
+    raise ValueError('unknown color index {}!'.format(index))
+
+
+def _teff_slots(res, star_type, mode, jmag, hmag, ksmag, bmag, vmag, e_bv, feh, tables=None):
+    evaluate = eval_teff if tables is None else tables.eval
+    colors = {}
+    for i, label in enumerate(TEFF_LABELS[star_type, mode]):
+        source, color = label.split()
+        cal = get_calibration(source, star_type, color)
+        if cal.index not in colors:
+            with stage('teff.deredden', len(res)):
+                colors[cal.index] = _color_index(cal.index, star_type, jmag, hmag, ksmag, bmag, vmag, e_bv)
+        with stage('teff.calibration', len(res)):
+            teff, branch = evaluate(cal, colors[cal.index], feh)
+        res['teff'][:, i], res['branch'][:, i] = teff, branch
+        res['status'][:, i] = np.select([(branch >= 0) & np.isfinite(teff), np.isnan(colors[cal.index]), branch >= 0],
+                                        [TEFF_OK, TEFF_NO_COLOR, TEFF_INVALID], TEFF_OUT_OF_RANGE)
+        branch_hits(' '.join(cal[:3]), branch)
+
+
+def cal_teff_batch(jmag, hmag, ksmag, bmag, vmag, e_bv, feh=0.0, mode=0, star_type='giant', tables=None):
+    """
+    vectorized cal_teff for a whole catalog, every argument may be a scalar or an array (broadcast together).
+    the color and [fe/h] branches are picked with boolean masks and each formula is evaluated once per branch.
+    :param star_type: 'giant' or 'dwarf', or an array of them (one per star)
+    :param feh: nan and 99.0 are taken as 0.0, as in cal_teff
+    :param tables: teff_tables.TeffTables to interpolate teff instead of evaluating the formulas (within
+                   TeffTables.max_error), True for the tables cached on disk
+    :return: structured array of TEFF_DTYPE, res['teff'][:, i] is teff[i] of cal_teff
+    """
+    if mode not in (0, 1, 2):
+        raise TypeError('mode excess the color indices ranges!')
+    if tables is True:
+        from teff_tables import get_tables
+        tables = get_tables()
+    mags = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                 for x in (jmag, hmag, ksmag, bmag, vmag, e_bv, feh)])
+    mags[-1] = np.where(np.isnan(mags[-1]) | (mags[-1] == 99.0), 0.0, mags[-1])
+    res = np.zeros(mags[0].size, dtype=TEFF_DTYPE)
+    res['branch'] = -1
+    res['status'] = TEFF_UNUSED
+    if np.ndim(star_type) == 0:
+        if star_type in ('giant', 'dwarf'):
+            _teff_slots(res, star_type, mode, *mags, tables=tables)
+    else:
+        star_type = np.broadcast_to(np.asarray(star_type), mags[0].shape)
+        for kind in ('giant', 'dwarf'):
+            idx = np.flatnonzero(star_type == kind)
+            if idx.size:
+                sub = res[idx]
+                _teff_slots(sub, kind, mode, *[x[idx] for x in mags], tables=tables)
+                res[idx] = sub
+    res['valid'] = (res['branch'] >= 0) & np.isfinite(res['teff'])
+    return res
+
+
+def cal_teff_frame(df, mode=0, star_type='giant', columns=None, tables=None):
+    """
+    cal_teff_batch on the columns of a pandas DataFrame (or anything indexable by column name)
+    :param star_type: 'giant', 'dwarf', an array of them or the name of a column holding them
+    :param columns: {argument: column name} overriding TEFF_COLUMNS, e.g. {'e_bv': 'E_BV_SF', 'feh': 'FeH2'}
+    :return: structured array of TEFF_DTYPE with len(df) rows
+    """
+    names = dict(TEFF_COLUMNS)
+    names.update(columns or {})
+    kw = dict((key, np.asarray(df[col], dtype=float)) for key, col in names.items())
+    if isinstance(star_type, str) and star_type not in ('giant', 'dwarf'):
+        star_type = np.asarray(df[star_type])
+    return cal_teff_batch(mode=mode, star_type=star_type, tables=tables, **kw)
+
+
+def summarize_teff(branch, status, mode=0, star_type='giant', summary=None):
+    """
+    count the stars of every calibration per branch and per status, the diagnostics of a whole batch in place of
+    the lines cal_teff prints for every star
+    :param branch: res['branch'] of cal_teff_batch, (n, 3)
+    :param status: res['status'] of cal_teff_batch, (n, 3)
+    :param star_type: 'giant', 'dwarf' or an array of them
+    :param summary: a summary to add the counts to, e.g. of the previous chunks
+    :return: {'giant alonso1999 v-k': {'eq.8': n, 'out of range': n, ...}, ...}
+    """
+    summary = {} if summary is None else summary
+    branch, status = np.asarray(branch), np.asarray(status)
+    star_type = np.broadcast_to(np.asarray(star_type), branch.shape[:1])
+    for kind in ('giant', 'dwarf'):
+        sel = star_type == kind
+        if not sel.any():
+            continue
+        for i, label in enumerate(TEFF_LABELS[kind, mode]):
+            counts = summary.setdefault('{} {}'.format(kind, label), {})
+            name = 'eq.{}' if label.startswith('alonso') else 'band {}' if label.startswith('ramirez') else 'branch {}'
+            values, n = np.unique(np.where(status[sel, i] == TEFF_OK, branch[sel, i], -1 - status[sel, i]),
+                                  return_counts=True)
+            for value, k in zip(values.tolist(), n.tolist()):
+                key = name.format(value) if value >= 0 else TEFF_STATUS[-1 - value]
+                counts[key] = counts.get(key, 0) + k
+    return summary
+
+
+def log_teff_summary(summary, level=logging.INFO):
+    """
+    one line of summarize_teff per calibration to the 'cal_params' logger
+    """
+    for label in sorted(summary):
+        counts = summary[label]
+        logger.log(level, '%s: %s', label, ', '.join('{} {}'.format(counts[key], key) for key in sorted(counts)))
+
+
+#======================================================================================================================
+# typical dispersion (K) of each calibration around the irfm teff, the consensus weights are 1/sigma**2
+TEFF_SIGMA = {('alonso1999', 'giant', 'v-k'): 25., ('alonso1999', 'giant', 'b-v'): 167.,
+              ('alonso1996', 'dwarf', 'v-k'): 25., ('alonso1996', 'dwarf', 'b-v'): 130.,
+              ('ramirez2005', 'giant', 'v-k'): 30., ('ramirez2005', 'giant', 'v-j'): 40.,
+              ('ramirez2005', 'giant', 'v-h'): 35., ('ramirez2005', 'giant', 'b-v'): 100.,
+              ('ramirez2005', 'dwarf', 'v-k'): 50., ('ramirez2005', 'dwarf', 'v-j'): 60.,
+              ('ramirez2005', 'dwarf', 'v-h'): 55., ('ramirez2005', 'dwarf', 'b-v'): 90.,
+              ('casagrande2010', 'dwarf', 'v-k'): 32., ('casagrande2010', 'dwarf', 'v-j'): 59.,
+              ('casagrande2010', 'dwarf', 'v-h'): 50., ('casagrande2010', 'dwarf', 'b-v'): 73.}
+
+# bits of the consensus flags
+FLAG_NO_TEFF = 1  # no calibration gave a valid teff, teff is nan
+FLAG_SINGLE = 2  # only one calibration, scatter is nan
+FLAG_DISCREPANT = 4  # scatter above max_scatter
+FLAG_FEH_ASSUMED = 8  # [fe/h] was nan or 99.0 and taken as 0.0
+FLAG_MISSING_COLOR = 16  # a color of the star type is nan (missing magnitude)
+FLAG_OUT_OF_RANGE = 32  # a calibration with its color available was out of range
+
+# weighted mean teff of the valid calibrations, their weighted standard deviation, the number of calibrations used,
+# the flags and which calibrations were used, bit k for the k-th calibration of calibrations.CALIBRATIONS
+CONSENSUS_DTYPE = np.dtype([('teff', 'f8'), ('scatter', 'f8'), ('n_cal', 'i1'), ('flags', 'u1'), ('used', 'u4')])
+
+
+def _consensus_slots(res, star_type, jmag, hmag, ksmag, bmag, vmag, e_bv, feh, sigma, tables=None):
+    """
+    every calibration of star_type on the shared dereddened colors, combined in res
+    """
+    evaluate = eval_teff if tables is None else tables.eval
+    colors, values, weights, used = {}, [], [], []
+    flags = np.zeros(len(res), dtype=np.uint8)
+    for k, (key, cal) in enumerate(CALIBRATIONS.items()):
+        if cal.star_type != star_type:
+            continue
+        if cal.index not in colors:
+            with stage('teff.deredden', len(res)):
+                colors[cal.index] = _color_index(cal.index, star_type, jmag, hmag, ksmag, bmag, vmag, e_bv)
+            flags[np.isnan(colors[cal.index])] |= FLAG_MISSING_COLOR
+        with stage('teff.calibration', len(res)):
+            teff, branch = evaluate(cal, colors[cal.index], feh)
+        branch_hits(' '.join(key), branch)
+        valid = (branch >= 0) & np.isfinite(teff)
+        flags[~valid & ~np.isnan(colors[cal.index])] |= FLAG_OUT_OF_RANGE
+        res['used'][valid] |= np.uint32(1 << k)
+        values.append(np.where(valid, teff, 0.0))
+        weights.append(np.where(valid, 1. / sigma[key] ** 2, 0.0))
+        res['n_cal'] += valid
+    if not values:
+        return
+    with stage('teff.combine', len(res)), np.errstate(invalid='ignore', divide='ignore'):
+        values, weights = np.array(values), np.array(weights)
+        total = weights.sum(axis=0)
+        teff = (weights * values).sum(axis=0) / total
+        scatter = np.sqrt((weights * (values - teff) ** 2).sum(axis=0) / total)
+    res['teff'] = teff
+    res['scatter'] = np.where(res['n_cal'] > 1, scatter, np.nan)
+    res['flags'] |= flags
+
+
+def cal_teff_consensus(jmag, hmag, ksmag, bmag, vmag, e_bv, feh=0.0, star_type='giant', sigma=None,
+                       max_scatter=150., tables=None):
+    """
+    one teff per star from every calibration of its star type (v-k, v-j, v-h and b-v of alonso199x, ramirez2005
+    and casagrande2010), each dereddened color is calculated once and shared by the calibrations using it.
+    the valid teffs are averaged with weights 1/sigma**2.
+    :param star_type: 'giant' or 'dwarf', or an array of them (one per star)
+    :param feh: nan and 99.0 are taken as 0.0 (flagged FLAG_FEH_ASSUMED)
+    :param sigma: {(source, star_type, color): dispersion (K)} overriding TEFF_SIGMA
+    :param max_scatter: (K) stars whose calibrations scatter more are flagged FLAG_DISCREPANT
+    :param tables: teff_tables.TeffTables (or True) as in cal_teff_batch
+    :return: structured array of CONSENSUS_DTYPE
+    """
+    if tables is True:
+        from teff_tables import get_tables
+        tables = get_tables()
+    sigma = dict(TEFF_SIGMA, **(sigma or {}))
+    mags = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                 for x in (jmag, hmag, ksmag, bmag, vmag, e_bv, feh)])
+    res = np.zeros(mags[0].size, dtype=CONSENSUS_DTYPE)
+    res['teff'] = res['scatter'] = np.nan
+    assumed = np.isnan(mags[-1]) | (mags[-1] == 99.0)
+    mags[-1] = np.where(assumed, 0.0, mags[-1])
+    if np.ndim(star_type) == 0:
+        if star_type in ('giant', 'dwarf'):
+            _consensus_slots(res, star_type, *mags, sigma=sigma, tables=tables)
+    else:
+        star_type = np.broadcast_to(np.asarray(star_type), mags[0].shape)
+        for kind in ('giant', 'dwarf'):
+            idx = np.flatnonzero(star_type == kind)
+            if idx.size:
+                sub = res[idx]
+                _consensus_slots(sub, kind, *[x[idx] for x in mags], sigma=sigma, tables=tables)
+                res[idx] = sub
+    res['flags'] |= np.where(assumed, FLAG_FEH_ASSUMED, 0).astype(np.uint8)
+    res['flags'] |= np.where(res['n_cal'] == 0, FLAG_NO_TEFF, 0).astype(np.uint8)
+    res['flags'] |= np.where(res['n_cal'] == 1, FLAG_SINGLE, 0).astype(np.uint8)
+    with np.errstate(invalid='ignore'):
+        res['flags'] |= np.where(res['scatter'] > max_scatter, FLAG_DISCREPANT, 0).astype(np.uint8)
+    return res
+
+
+def cal_teff_consensus_frame(df, star_type='giant', columns=None, sigma=None, max_scatter=150., tables=None):
+    """
+    cal_teff_consensus on the columns of a pandas DataFrame, columns and star_type as in cal_teff_frame
+    """
+    names = dict(TEFF_COLUMNS)
+    names.update(columns or {})
+    kw = dict((key, np.asarray(df[col], dtype=float)) for key, col in names.items())
+    if isinstance(star_type, str) and star_type not in ('giant', 'dwarf'):
+        star_type = np.asarray(df[star_type])
+    return cal_teff_consensus(star_type=star_type, sigma=sigma, max_scatter=max_scatter, tables=tables, **kw)
+
+
+#======================================================================================================================
+# alonso1999 bolometric corrections: [(log10(teff) range of each [fe/h] band), coefficients] of the cool and the hot
+# relation, bc = c0/x + c1 + c2*x + c3*x**2 + c4*x*feh + c5*feh + c6*feh**2 with x = log10(teff) - 3.52
+BC_FEH_BANDS = ((-0.50, 0.20), (-1.50, -0.50), (-2.50, -1.50), (-3.00, -2.50))
+BC_RELATIONS = ((((3.50, 3.67), (3.56, 3.67), (3.58, 3.67), (3.61, 3.67)),
+                 (-0.05531, -0.6177, 4.420, -2.669, 0.6943, -0.1071, -0.008612)),
+                (((3.65, 3.96), (3.65, 3.83), (3.65, 3.80), (3.65, 3.74)),
+                 (-0.09930, 0.02887, 2.275, -4.425, 0.3505, -0.05558, -0.005375)))
+
+
+def _bc(c, x, feh):
+    return c[0] / x + c[1] + c[2] * x + c[3] * x**2 + c[4] * x * feh + c[5] * feh + c[6] * feh**2
+
+
+def _mbol_logg(vmag, bc, plx, a_v, teff, mass, test):
+    """
+    mbol and logg of scalars or arrays, with the 2014Bergemann_A&A_565_89 correction of a_v (for sfd98) if test
+    """
     mbol_sun, logg_sun, teff_sun = 4.77, 4.44, 5777.
-    x = np.log10(teff) - 3.52
-    if (np.log10(teff) >= 3.50) & (np.log10(teff) <= 3.67) & (feh >= -0.50) & (feh <= 0.20) or \
-       (np.log10(teff) >= 3.56) & (np.log10(teff) <= 3.67) & (feh >= -1.50) & (feh <= -0.50) or \
-       (np.log10(teff) >= 3.58) & (np.log10(teff) <= 3.67) & (feh >= -2.50) & (feh <= -1.50) or \
-       (np.log10(teff) >= 3.61) & (np.log10(teff) <= 3.67) & (feh >= -3.00) & (feh <= -2.50):
-        bc = -0.05531 / x - 0.6177 + 4.420 * x - 2.669 * x**2 + 0.6943 * x * feh - 0.1071 * feh - 0.008612 * feh**2
-    elif (np.log10(teff) >= 3.65) & (np.log10(teff) <= 3.96) & (feh >= -0.50) & (feh <= 0.20) or \
-         (np.log10(teff) >= 3.65) & (np.log10(teff) <= 3.83) & (feh >= -1.50) & (feh <= -0.50) or \
-         (np.log10(teff) >= 3.65) & (np.log10(teff) <= 3.80) & (feh >= -2.50) & (feh <= -1.50) or \
-         (np.log10(teff) >= 3.65) & (np.log10(teff) <= 3.74) & (feh >= -3.00) & (feh <= -2.50):
-        bc = -0.09930 / x + 0.02887 + 2.275 * x - 4.425 * x**2 + 0.3505 * x * feh - 0.05558 * feh - 0.005375 * feh**2
+    if test:
+        e_bv = a_v / 3.1
+        a_v = np.where(e_bv > 0.1, 3.1 * (0.035 + 0.65 * e_bv), a_v)
+    mbol = vmag + bc + 5 * np.log10(plx) + 5.0 - a_v  # plx in arcsec
+    return mbol, logg_sun + np.log10(mass) + 4 * np.log10(teff / teff_sun) + 0.4 * (mbol - mbol_sun)
+
+
+def cal_logg_batch(vmag, a_v, plx, teff, mass, feh=0.0, test=False):
+    """
+    cal_logg for arrays of stars, out-of-range stars get nan and branch -1 instead of raising
+    :param plx: parallax in arcsec
+    :param test: 2014Bergemann_A&A_565_89 correction of a_v for sfd98 (e(b-v) > 0.1 -> 0.035 + 0.65*e(b-v))
+    :return: structured array of LOGG_DTYPE, one row per star
+    """
+    vmag, a_v, plx, teff, mass, feh = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                                            for x in (vmag, a_v, plx, teff, mass, feh)])
+    res = np.zeros(vmag.shape, dtype=LOGG_DTYPE)
+    res['branch'] = -1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if logg_bc is not None:
+            bc, res['branch'] = logg_bc(teff, feh, BC_RELATIONS, BC_FEH_BANDS)
+        else:
+            logt = np.log10(teff)
+            bc = np.full(vmag.shape, np.nan)
+            todo = np.ones(vmag.shape, dtype=bool)
+            for branch, (ranges, c) in enumerate(BC_RELATIONS):
+                sel = np.zeros(vmag.shape, dtype=bool)
+                for (lo, hi), (feh_lo, feh_hi) in zip(ranges, BC_FEH_BANDS):
+                    sel |= (logt >= lo) & (logt <= hi) & (feh >= feh_lo) & (feh <= feh_hi)
+                sel &= todo  # the cool relation wins where both apply
+                bc[sel] = _bc(c, logt[sel] - 3.52, feh[sel])
+                res['branch'][sel] = branch
+                todo &= ~sel
+        res['mbol'], res['logg'] = _mbol_logg(vmag, bc, plx, a_v, teff, mass, test)
+    res['bc'] = bc
+    branch_hits('logg bc', res['branch'])
+    return res
+
+
+def cal_logg(vmag, a_v, plx, teff, mass, feh=0.0, test=False, as_str=True):
+    """
+    :param as_str: True (default) for the formatted string, False for a LoggResult
+    """
+    logt = np.log10(teff)
+    for branch, (ranges, c) in enumerate(BC_RELATIONS):
+        if any(lo <= logt <= hi and feh_lo <= feh <= feh_hi
+               for (lo, hi), (feh_lo, feh_hi) in zip(ranges, BC_FEH_BANDS)):
+            break
     else:
         raise ValueError('out of ranges of applications!')
-    if test:  # 2014Bergemann_A&A_565_89
+    bc = _bc(c, logt - 3.52, feh)
+    if test:
         print 'The test correction in A_V should be for SFD98'
-        e_bv = a_v / 3.1
-        if e_bv > 0.1:
-            e_bv = 0.035 + 0.65*e_bv
-            a_v = 3.1*e_bv
-            mbol_star = vmag + bc + 5 * np.log10(plx) + 5.0 - a_v  # plx in arcsec
-    else:
-        mbol_star = vmag + bc + 5 * np.log10(plx) + 5.0 - a_v  # plx in arcsec
-    logg = logg_sun + np.log10(mass) + 4 * np.log10(teff / teff_sun) + 0.4 * (mbol_star - mbol_sun)
-    return '{:.3f}'.format(logg)
+    mbol, logg = [float(x) for x in _mbol_logg(vmag, bc, plx, a_v, teff, mass, test)]
+    if as_str:
+        return '{:.3f}'.format(logg)
+    return LoggResult(logg, bc, mbol, branch)
 
 #======================================================================================================================
-def mass_age_giant(teff, logg, mh, cm, nm):
+def mass_age_giant(teff, logg, mh, cm, nm, as_str=True):
+    """
+    :param as_str: True (default) for the formatted string, False for a MassAgeResult
+    """
     cn = cm - nm
     cnm = cm + nm
     if mh > -0.8 and 4000. < teff < 5000. and 1.8 < logg < 3.3 and -0.25 < cm < 0.15 and -0.1 < nm < 0.45 and \
@@ -469,31 +452,99 @@ def mass_age_giant(teff, logg, mh, cm, nm):
         1.77*logg*nm + 14.24*logg*cnm - 34.68*logg*(teff/4000) + 4.17*logg**2
     else:
         raise ValueError('Out of ranges of relations!')
-    return '{:.3f} {:.3f}'.format(mass, logage)
+    if as_str:
+        return '{:.3f} {:.3f}'.format(mass, logage)
+    return MassAgeResult(mass, logage)
+
+# quadratic features of mass_age_giant in the order of its terms, with t = teff/4000 and cnm = cm + nm:
+# 1, mh, mh^2, cm, cm*mh, cm^2, nm, nm*mh, nm*cm, nm^2, cnm, cnm*mh, cnm*cm, cnm*nm, cnm^2,
+# t, t*mh, t*cm, t*nm, t*cnm, t^2, logg, logg*mh, logg*cm, logg*nm, logg*cnm, logg*t, logg^2
+MASS_AGE_COEF = np.array([
+    [95.87, -10.40, -0.73, 41.36, -5.32, -46.78, 15.05, -0.93, -30.52, -1.61, -67.61, 7.05, 133.58, 38.94, -88.99,
+     -144.18, 5.12, -73.77, -15.29, 101.75, 27.77, -9.42, 1.52, 16.04, 1.35, -18.65, 28.80, -4.10],
+    [-54.35, 6.53, 0.74, -19.02, 4.04, 26.90, -12.18, 0.76, 13.33, -1.04, 37.22, -4.94, -77.84, -17.60, 51.24,
+     59.58, -1.46, 48.29, 13.99, -65.67, 15.54, 16.14, -1.56, -13.12, -1.77, 14.24, -34.68, 4.17]]).T
+
+
+def mass_age_giant_batch(teff, logg, mh, cm, nm, block=2 ** 16):
+    """
+    mass_age_giant for arrays of giants: the quadratic feature matrix of a block of stars times MASS_AGE_COEF,
+    stars out of the calibration box are flagged instead of raising
+    :param block: stars per feature matrix, which holds 28 floats a star
+    :return: structured array of MASS_AGE_DTYPE, one row per star
+    """
+    teff, logg, mh, cm, nm = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                                   for x in (teff, logg, mh, cm, nm)])
+    teff, logg, mh, cm, nm = [x.ravel() for x in (teff, logg, mh, cm, nm)]
+    res = np.empty(len(teff), dtype=MASS_AGE_DTYPE)
+    with np.errstate(invalid='ignore'):
+        cn, cnm = cm - nm, cm + nm
+        res['valid'] = ((mh > -0.8) & (4000. < teff) & (teff < 5000.) & (1.8 < logg) & (logg < 3.3) & (-0.25 < cm) &
+                        (cm < 0.15) & (-0.1 < nm) & (nm < 0.45) & (-0.1 < cnm) & (cnm < 0.15) & (-0.6 < cn) & (cn < 0.2))
+    features = np.empty((min(block, len(teff)), MASS_AGE_COEF.shape[0]))
+    for start in range(0, len(teff), block):
+        stop = min(start + block, len(teff))
+        f = features[:stop - start]
+        f[:, 0] = 1.
+        col = 1
+        variables = [mh[start:stop], cm[start:stop], nm[start:stop], cnm[start:stop], teff[start:stop] / 4000.,
+                     logg[start:stop]]
+        for i, x in enumerate(variables):
+            f[:, col] = x
+            for y in variables[:i + 1]:
+                np.multiply(x, y, out=f[:, col + 1])
+                col += 1
+            col += 1
+        out = f.dot(MASS_AGE_COEF)
+        res['mass'][start:stop], res['logage'][start:stop] = out[:, 0], out[:, 1]
+    res['mass'][~res['valid']] = np.nan
+    res['logage'][~res['valid']] = np.nan
+    if active() is not None:
+        branch_hits('mass_age_giant', res['valid'].astype(np.int8) - 1)
+    return res
+
 
 #======================================================================================================================
-def cal_age(teff,dt,logg,dg,feh,dm):
-    #Zini, Age, Mini, Mass, logL, logTe, logg
-    from ezpadova import parsec
-    iso = parsec.get_t_isochrones(logt0, logt1, dlogt, metal)
-    teff_iso = iso['logT'][(iso['logT'] >= (iso['logT']+3*dt)) & (iso['logT'] <= (iso['logT'] - 3*dt))]
-    logg_iso = iso['logg'][(iso['logg'] >= (iso['logg']+3*dg)) & (iso['logg'] <= (iso['logg'] - 3*dg))]
-    feh_iso  = iso['Z'][(iso['Z'] >= (iso['Z']+3*dm)) & (iso['Z'] <= (iso['Z'] - 3*dm))]
-    p = np.exp(-(teff - t_iso)**2/(2*dt**2)) * np.exp(-(logg - g_iso)**2/(2*dg**2)) * np.exp(-(feh - m_iso)**2/(2*dm**2))
-    dp = np.sum(p)/dlogt
-    return
+def cal_age_batch(teff, dt, logg, dg, feh, dm, isochrones, nsigma=4., age_prior='uniform', percentiles=(16, 50, 84)):
+    """
+    bayesian age and mass of many stars from a parsec/mist isochrone grid (isochrones.IsochroneGrid.posterior)
+    :param teff, dt: teff and its error (K)
+    :param logg, dg: logg and its error
+    :param feh, dm: [m/h] and its error
+    :param isochrones: IsochroneGrid, or the path(s) of the isochrone files, parsed once into the on-disk cache
+                       (isochrones.load_isochrones) and memory mapped from it afterwards
+    :return: AgeResult, posterior mean and percentiles of log(age/yr) and mass, nan out of the grid
+    """
+    return get_isochrones(isochrones).posterior(teff, dt, logg, dg, feh, dm, nsigma=nsigma, age_prior=age_prior,
+                                                percentiles=percentiles)
+
+
+def cal_age(teff, dt, logg, dg, feh, dm, isochrones, age_prior='uniform', as_str=True):
+    """
+    :param as_str: True (default) for the formatted string 'logage mass', False for an AgeResult
+    """
+    res = cal_age_batch(teff, dt, logg, dg, feh, dm, isochrones, age_prior=age_prior)
+    if np.isnan(res.logage[0]):
+        raise ValueError('out of the isochrone grid!')
+    if as_str:
+        return '{:.3f} {:.3f}'.format(res.logage[0], res.mass[0])
+    return res
 
 #======================================================================================================================
-if __name__ == '__main__':
+def main(argv=None):
+    """
+    print the teff of every star of a whitespace catalog, the Lirich_v1.dat sample by default
+    """
+    import pandas as pd
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else '/Users/zyt/Desktop/Lirich/Lirich_v1.dat'
     # calculate multiple Teff
-    data_Teff = pd.read_csv('/Users/zyt/Desktop/Lirich/Lirich_v1.dat', delim_whitespace=True, usecols=range(23),
-                            skiprows=1)
-    # for  jmag, hmag, ksmag, bmag, vmag, e_bv, feh in data_Teff.Jmag, data_Teff.Hmag, data_Teff.Kmag, \
-    #     data_Teff.Bmag, data_Teff.Vmag, data_Teff.E_BV_SF, data_Teff.FeH:
-    Teff=[]
-    for i in range(len(data_Teff.Tel)):
-        Teffi = cal_teff(data_Teff.Jmag[i], data_Teff.Hmag[i], data_Teff.Kmag[i], data_Teff.Bmag[i],
-                 data_Teff.Vmag[i], data_Teff.E_BV_SF[i], data_Teff.FeH[i], display=False)
-        Teff.append(Teffi)
-        print Teffi
-    # print Teff
\ No newline at end of file
+    data_Teff = pd.read_csv(path, delim_whitespace=True, usecols=range(23), skiprows=1)
+    teff = cal_teff_frame(data_Teff, columns={'e_bv': 'E_BV_SF'})
+    for rec in teff:
+        print format_teff(TeffResult(rec['teff'], rec['valid'], rec['branch']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: pipeline.py
+# @author: zyt
+# @time: 2018/07/24
+# ====================
+"""
+stream a catalog through cal_teff -> cal_logg -> mass_age_giant in chunks of bounded size, writing every chunk out
+before the next one is read, so the memory does not grow with the catalog.
+input: whitespace-delimited text (.dat, .txt), csv, fits tables and parquet; output: parquet, csv or text, or a
+directory of parquet files (one per chunk, optionally bucketed by the hash of an id column for cheap joins).
+the new columns of a chunk stay contiguous numpy arrays and go to arrow without passing through a DataFrame.
+"""
+from collections import OrderedDict
+import os
+import numpy as np
+import pandas as pd
+from cachedir import make_dirs
+from profiling import stage
+from params import (FLAG_FEH_ASSUMED, TEFF_COLUMNS, cal_teff_batch, cal_teff_consensus, cal_logg_batch,
+                    log_teff_summary, mass_age_giant_batch, summarize_teff)
+#======================================================================================================================
+# inputs of the chain besides TEFF_COLUMNS: cal_logg needs plx (arcsec) and mass, a_v is 3.1*e_bv if not given;
+# mass_age_giant needs cm and nm, with feh as [m/h]
+CHAIN_COLUMNS = {'plx': 'plx', 'mass': 'mass', 'a_v': 'A_V', 'cm': 'CM', 'nm': 'NM'}
+# icrs coordinates (deg) for e(b-v) from a dust map
+COORD_COLUMNS = {'ra': 'ra', 'dec': 'dec'}
+TEXT_SUFFIXES = ('.dat', '.txt')
+
+
+def _suffix(path, fmt=None):
+    if fmt:
+        return '.' + fmt.lower().lstrip('.')
+    suffix = os.path.splitext(path)[1].lower()
+    return '.fits' if suffix in ('.fit', '.fits', '.fts') else suffix
+
+
+def read_chunks(path, chunksize=100000, fmt=None, skiprows=None, start=0):
+    """
+    yield the catalog as DataFrames of at most chunksize rows
+    :param fmt: 'dat'/'txt' (whitespace), 'csv', 'fits' or 'parquet', guessed from the file name by default
+    :param start: first row to read, for fits tables
+    """
+    suffix = _suffix(path, fmt)
+    if suffix in TEXT_SUFFIXES + ('.csv',):
+        kw = {'delim_whitespace': True} if suffix in TEXT_SUFFIXES else {}
+        for df in pd.read_csv(path, chunksize=chunksize, skiprows=skiprows, **kw):
+            yield df
+    elif suffix == '.fits':
+        from astropy.io import fits
+        with fits.open(path, memmap=True) as hdul:
+            data = next(hdu for hdu in hdul if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU))).data
+            for first in range(start, len(data), chunksize):
+                chunk = data[first:first + chunksize]
+                yield pd.DataFrame(dict((name, np.asarray(chunk[name]).astype(chunk[name].dtype.newbyteorder('=')))
+                                        for name in chunk.names), columns=chunk.names)
+    elif suffix == '.parquet':
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        for i in range(pf.num_row_groups):  # a row group is the smallest unit parquet reads
+            # a block per column and the arrow buffers released while converting, numeric columns are not copied
+            df = pf.read_row_group(i).to_pandas(split_blocks=True, self_destruct=True)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+    else:
+        raise ValueError('unknown catalog format {}!'.format(suffix))
+
+
+def _dataset(path, fmt=None):
+    """
+    whether the output path is a directory of parquet files: an existing directory, a path ending with a separator
+    or without suffix, or fmt 'dataset'
+    """
+    if fmt:
+        return fmt.lower().lstrip('.') == 'dataset'
+    return os.path.isdir(path) or path.endswith(os.sep) or not os.path.splitext(path)[1]
+
+
+def _arrow_table(cols, schema=None):
+    """
+    pyarrow Table of an OrderedDict of columns, the contiguous numeric columns without nan-as-null are not copied
+    :param schema: types of the columns, e.g. those of the first chunk, so all-null object columns keep their type
+    """
+    import pyarrow as pa
+    if schema is None:
+        return pa.Table.from_arrays([pa.array(np.asarray(x)) for x in cols.values()], names=list(cols))
+    return pa.Table.from_arrays([pa.array(np.asarray(cols[field.name]), type=field.type) for field in schema],
+                                schema=schema)
+
+
+def id_buckets(ids, buckets):
+    """
+    bucket of every id, a stable hash (the same in every run and process) modulo buckets
+    """
+    return (pd.util.hash_array(np.asarray(ids)) % np.uint64(buckets)).astype(np.int64)
+
+
+class ChunkWriter(object):
+    """
+    append chunks (DataFrames or OrderedDicts of columns) to a parquet, csv or whitespace-delimited text file, or
+    write every chunk as a parquet file of a directory
+    """
+    def __init__(self, path, fmt=None, id_column=None, buckets=None):
+        """
+        :param fmt: 'parquet', 'csv', 'dat'/'txt' or 'dataset', guessed from path by default
+        :param id_column: the id column of the chunks, by whose hash the rows of a dataset are bucketed
+        :param buckets: rows go to path/bucket=<id_buckets>/part-<chunk>.parquet of a dataset, so joins on the ids
+                        only need to pair up the files of the same bucket
+        """
+        self.path = path
+        self.dataset = _dataset(path, fmt) or bool(buckets)
+        self.suffix = '.parquet' if self.dataset else _suffix(path, fmt)
+        if self.suffix not in TEXT_SUFFIXES + ('.csv', '.parquet'):
+            raise ValueError('unknown output format {}!'.format(self.suffix))
+        if buckets and id_column is None:
+            raise ValueError('bucketing the output needs the id column!')
+        self.id_column, self.buckets = id_column, buckets
+        self._writer = None
+        self._schema = None
+        self.rows = 0
+        self.chunks = 0
+        if self.dataset and os.path.isdir(path):  # overwritten like a file, no parts of an earlier run left
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    if name.startswith('part-') and name.endswith('.parquet'):
+                        os.remove(os.path.join(root, name))
+
+    def write(self, df):
+        if self.suffix != '.parquet':
+            if not isinstance(df, pd.DataFrame):
+                df = pd.DataFrame(df, columns=list(df))
+            sep = ',' if self.suffix == '.csv' else ' '
+            df.to_csv(self.path, sep=sep, index=False, header=self.rows == 0, mode='w' if self.rows == 0 else 'a',
+                      na_rep='nan')
+            self.rows += len(df)
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.buckets:
+            bucket = id_buckets(np.asarray(df[self.id_column]), self.buckets)
+            order = np.argsort(bucket, kind='mergesort')  # the rows of a bucket keep their order
+            edges = np.searchsorted(bucket[order], np.arange(self.buckets + 1))
+            df = df.iloc[order] if isinstance(df, pd.DataFrame) else \
+                OrderedDict((name, np.asarray(x)[order]) for name, x in df.items())
+        if isinstance(df, pd.DataFrame):
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        else:
+            table = _arrow_table(df, self._schema)
+        self._schema = table.schema
+        if not self.dataset:
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        elif not self.buckets:
+            make_dirs(self.path)
+            pq.write_table(table, os.path.join(self.path, 'part-{:05d}.parquet'.format(self.chunks)))
+        else:
+            for b in np.flatnonzero(np.diff(edges)):
+                path = os.path.join(self.path, 'bucket={:03d}'.format(b))
+                make_dirs(path)
+                pq.write_table(table.slice(edges[b], edges[b + 1] - edges[b]),
+                               os.path.join(path, 'part-{:05d}.parquet'.format(self.chunks)))
+        self.rows += table.num_rows
+        self.chunks += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_results(path, columns=None, bucket=None, as_arrow=False):
+    """
+    the output of run_catalog/run_parallel (a parquet file or dataset directory) without copying the numeric columns
+    :param columns: columns to read, all by default
+    :param bucket: only this bucket of a bucketed dataset
+    :param as_arrow: the pyarrow Table, e.g. for polars.from_arrow, instead of a DataFrame
+    """
+    import pyarrow.parquet as pq
+    if bucket is not None:
+        path = os.path.join(path, 'bucket={:03d}'.format(bucket))
+    table = pq.ParquetDataset(path).read(columns=columns) if os.path.isdir(path) else pq.read_table(path, columns)
+    return table if as_arrow else table.to_pandas(split_blocks=True)
+
+
+#======================================================================================================================
+def best_teff(res):
+    """
+    first valid teff of each row of a cal_teff_batch result (alonso199x, then ramirez2005 ...), nan if none
+    """
+    valid = res['valid']
+    first = valid.argmax(axis=1)
+    teff = res['teff'][np.arange(len(res)), first]
+    return np.where(valid.any(axis=1), teff, np.nan)
+
+
+STAR_TYPES = ('giant', 'dwarf', 'other')  # codes of the star types in the inputs of chunk_results
+
+
+def chunk_results(inputs, mode=0, star_type='giant', consensus=False):
+    """
+    the columns run_chunk adds to a chunk, from its input arrays
+    :param inputs: {argument: float array} of TEFF_COLUMNS, plus plx, mass and a_v for logg and cm, nm for the giant
+                   mass and age, and star_type (codes of STAR_TYPES) when the type differs between the stars
+    :return: structured array of the new columns, in their order in the output
+    """
+    # an unknown [fe/h] (nan or 99.0) is 0.0 for teff, logg and mass/age alike, as in cal_teff_batch
+    assumed = np.isnan(inputs['feh']) | (inputs['feh'] == 99.0)
+    feh = np.where(assumed, 0.0, inputs['feh'])
+    mags = [inputs[key] for key in ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv')] + [feh]
+    if 'star_type' in inputs:
+        star_type = np.array(STAR_TYPES)[inputs['star_type'].astype(int)]
+    with stage('teff', len(mags[0])):
+        res = cal_teff_batch(*mags, mode=mode, star_type=star_type)
+    cols = []
+    for i in range(3):
+        cols += [('{}{}'.format(name, i), res[name][:, i]) for name in ('teff', 'valid', 'branch', 'status')]
+    if consensus:
+        with stage('teff.consensus', len(mags[0])):
+            res = cal_teff_consensus(*mags, star_type=star_type)
+        teff = res['teff']
+        flags = res['flags'] | np.where(assumed, FLAG_FEH_ASSUMED, 0).astype(np.uint8)
+        cols += [('teff', teff), ('teff_scatter', res['scatter']), ('n_cal', res['n_cal']), ('teff_flags', flags)]
+    else:
+        teff = best_teff(res)
+        cols.append(('teff', teff))
+    if 'plx' in inputs:
+        with stage('logg', len(teff)):
+            logg = cal_logg_batch(inputs['vmag'], inputs['a_v'], inputs['plx'], teff, inputs['mass'], feh)['logg']
+        cols.append(('logg', logg))
+        if 'cm' in inputs:
+            with stage('mass_age', len(teff)):
+                res = mass_age_giant_batch(teff, logg, feh, inputs['cm'], inputs['nm'])
+            # the giant relation only holds for giants, dwarfs falling in its box get nan as well
+            giant = inputs['star_type'] == 0 if 'star_type' in inputs else np.full(len(teff), star_type == 'giant')
+            cols += [('mass_giant', np.where(giant, res['mass'], np.nan).astype(res['mass'].dtype)),
+                     ('logage', np.where(giant, res['logage'], np.nan).astype(res['logage'].dtype))]
+    out = np.empty(len(teff), dtype=[(name, x.dtype) for name, x in cols])
+    for name, x in cols:
+        out[name] = x
+    return out
+
+
+def chunk_columns(df, columns=None, mode=0, star_type='giant', chain=True, dustmap=None, dust_scale='sf11',
+                  consensus=False, keep_columns=None):
+    """
+    run_chunk as an OrderedDict of the kept input columns and the new ones, as contiguous arrays, for ChunkWriter
+    and chunk_summary without building a DataFrame
+    """
+    names = dict(TEFF_COLUMNS, **CHAIN_COLUMNS)
+    names.update(COORD_COLUMNS)
+    names.update(columns or {})
+    col = lambda key: np.asarray(df[names[key]], dtype=float)
+    inputs = dict((key, col(key)) for key in ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'feh'))
+    keep = df.columns if keep_columns is None else list(keep_columns)
+    if star_type not in ('giant', 'dwarf') and star_type not in keep:
+        keep.append(star_type)  # for chunk_summary
+    cols = OrderedDict((name, df[name].values) for name in keep)
+    if star_type not in ('giant', 'dwarf'):
+        kind = np.asarray(df[star_type])
+        inputs['star_type'] = np.select([kind == 'giant', kind == 'dwarf'], [0., 1.], 2.)
+        star_type = None
+    if dustmap is None:
+        inputs['e_bv'] = col('e_bv')
+    else:
+        from extinction import get_dustmap
+        with stage('dustmap', len(df)):
+            inputs['e_bv'] = cols['e_bv_map'] = get_dustmap(dustmap, dust_scale).ebv_radec(col('ra'), col('dec'))
+    if chain and names['plx'] in df and names['mass'] in df:
+        inputs.update(plx=col('plx'), mass=col('mass'))
+        inputs['a_v'] = col('a_v') if names['a_v'] in df else 3.1 * inputs['e_bv']
+        if names['cm'] in df and names['nm'] in df:
+            inputs.update(cm=col('cm'), nm=col('nm'))
+    res = chunk_results(inputs, mode=mode, star_type=star_type, consensus=consensus)
+    for name in res.dtype.names:
+        cols[name] = np.ascontiguousarray(res[name])
+    return cols
+
+
+def run_chunk(df, columns=None, mode=0, star_type='giant', chain=True, dustmap=None, dust_scale='sf11',
+              consensus=False, keep_columns=None):
+    """
+    calculate teff (and, with chain, logg and mass/age where their inputs are mapped) for one chunk
+    :param columns: {argument: column name} overriding TEFF_COLUMNS and CHAIN_COLUMNS
+    :param star_type: 'giant', 'dwarf' or the name of a column holding them
+    :param dustmap: path of a local dust map (extinction.DustMap), e(b-v) is then looked up at the ra, dec columns
+                    instead of read from the e_bv column
+    :param dust_scale: 'sf11' (default) or 'sfd' calibration of the dust map
+    :param consensus: teff is the params.cal_teff_consensus of all the calibrations instead of the first valid one
+    :param keep_columns: input columns kept in the output, e.g. only the id, all by default (and the star type
+                         column)
+    :return: DataFrame of the chunk with teff0~teff2, valid0~valid2, branch0~branch2, status0~status2 (see
+             params.TEFF_STATUS) and teff (the first valid one),
+             plus e_bv_map with dustmap, teff_scatter, n_cal and teff_flags with consensus, and logg, mass_giant
+             and logage with chain
+    """
+    cols = chunk_columns(df, columns=columns, mode=mode, star_type=star_type, chain=chain, dustmap=dustmap,
+                         dust_scale=dust_scale, consensus=consensus, keep_columns=keep_columns)
+    return pd.DataFrame(cols, columns=list(cols), index=df.index)
+
+
+def chunk_summary(out, mode=0, star_type='giant', summary=None):
+    """
+    params.summarize_teff of the branch and status columns of a run_chunk output
+    """
+    if star_type not in ('giant', 'dwarf'):
+        star_type = np.asarray(out[star_type])
+    branch, status = [np.column_stack([out['{}{}'.format(name, i)] for i in range(3)]) for name in ('branch', 'status')]
+    return summarize_teff(branch, status, mode=mode, star_type=star_type, summary=summary)
+
+
+def run_catalog(path, output, chunksize=100000, columns=None, mode=0, star_type='giant', chain=True, fmt=None,
+                skiprows=None, dustmap=None, dust_scale='sf11', consensus=False, keep_columns=None,
+                id_column=None, buckets=None):
+    """
+    stream the catalog at path through run_chunk into output, one chunk in memory at a time.
+    the branches and range status of the stars are summarized and logged to the 'cal_params' logger at the end
+    :param keep_columns: input columns kept in the output, all by default, the id column is always kept
+    :param id_column: and buckets, the output is a parquet dataset bucketed by the id (see ChunkWriter)
+    :return: number of rows written
+    """
+    summary = {}
+    if keep_columns is not None and id_column is not None and id_column not in keep_columns:
+        keep_columns = [id_column] + list(keep_columns)
+    with ChunkWriter(output, id_column=id_column, buckets=buckets) as writer:
+        chunks = read_chunks(path, chunksize=chunksize, fmt=fmt, skiprows=skiprows)
+        while True:
+            with stage('read') as timer:
+                df = next(chunks, None)
+                timer.rows = 0 if df is None else len(df)
+            if df is None:
+                break
+            out = chunk_columns(df, columns=columns, mode=mode, star_type=star_type, chain=chain, dustmap=dustmap,
+                                dust_scale=dust_scale, consensus=consensus, keep_columns=keep_columns)
+            with stage('write', len(df)):
+                writer.write(out)
+            chunk_summary(out, mode=mode, star_type=star_type, summary=summary)
+    log_teff_summary(summary)
+    return writer.rows
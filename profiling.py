@@ -0,0 +1,188 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: profiling.py
+# @author: zyt
+# @time: 2018/08/10
+# ====================
+"""
+optional instrumentation of the pipeline: wall time, calls and rows of every stage (reading, dereddening, branch
+selection, formulas, formatting, writing ...), counters (e.g. stars out of range) and histograms (the branch every
+star of a calibration landed in). off by default, the hooks then only look up the global profiler and return.
+    profiler = profiling.enable()
+    run_catalog('input.dat', 'out.parquet')
+    profiler.write('profile.json')  # or profile.prom for the prometheus text format
+"""
+import json
+from timeit import default_timer
+import numpy as np
+#======================================================================================================================
+class Profiler(object):
+    """
+    stage timers, counters and histograms of integer values, all additive so the profiles of workers can be merged
+    """
+    def __init__(self):
+        self.stages = {}  # name: [calls, seconds, rows]
+        self.counters = {}  # name: count
+        self.histograms = {}  # name: {value: count}
+
+    def add_time(self, name, seconds, rows=0):
+        entry = self.stages.setdefault(name, [0, 0., 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += rows
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def histogram(self, name, values):
+        """
+        add the integer values (an array) to the histogram name
+        """
+        values, counts = np.unique(np.asarray(values).ravel(), return_counts=True)
+        hist = self.histograms.setdefault(name, {})
+        for value, n in zip(values.tolist(), counts.tolist()):
+            hist[value] = hist.get(value, 0) + n
+
+    def reset(self):
+        self.__init__()
+
+    def snapshot(self):
+        """
+        the profile as a json-able dict
+        """
+        return {'stages': dict((name, {'calls': calls, 'seconds': seconds, 'rows': rows})
+                               for name, (calls, seconds, rows) in self.stages.items()),
+                'counters': dict(self.counters),
+                'histograms': dict((name, dict((str(value), n) for value, n in hist.items()))
+                                   for name, hist in self.histograms.items())}
+
+    def merge(self, snapshot):
+        """
+        add a snapshot, e.g. of a worker process
+        """
+        for name, s in snapshot['stages'].items():
+            entry = self.stages.setdefault(name, [0, 0., 0])
+            entry[0] += s['calls']
+            entry[1] += s['seconds']
+            entry[2] += s['rows']
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+        for name, hist in snapshot['histograms'].items():
+            mine = self.histograms.setdefault(name, {})
+            for value, n in hist.items():
+                mine[int(value)] = mine.get(int(value), 0) + n
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1, sort_keys=True)
+
+    def to_prometheus(self, prefix='cal_params'):
+        """
+        the profile in the prometheus text exposition format, every metric a counter
+        """
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            for labels, value in samples:
+                text = ','.join('{}="{}"'.format(key, str(val).replace('"', '\\"')) for key, val in labels)
+                lines.append('{}_{}{{{}}} {}'.format(prefix, name, text, repr(float(value))))
+
+        stages = sorted(self.stages.items())
+        metric('stage_seconds_total', 'wall time spent in the stage', [([('stage', k)], v[1]) for k, v in stages])
+        metric('stage_calls_total', 'times the stage ran', [([('stage', k)], v[0]) for k, v in stages])
+        metric('stage_rows_total', 'stars through the stage', [([('stage', k)], v[2]) for k, v in stages])
+        metric('events_total', 'counted events', [([('name', k)], v) for k, v in sorted(self.counters.items())])
+        metric('histogram_total', 'stars per value, e.g. per branch of a calibration',
+               [([('name', name), ('value', value)], n)
+                for name, hist in sorted(self.histograms.items()) for value, n in sorted(hist.items())])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        write the profile to path, prometheus text for .prom/.txt, json otherwise
+        """
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+class _Stage(object):
+    def __init__(self, profiler, name, rows):
+        self.profiler, self.name, self.rows = profiler, name, rows
+
+    def __enter__(self):
+        self.t0 = default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, default_timer() - self.t0, self.rows)
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+_PROFILER = None
+
+
+def enable(profiler=None):
+    """
+    start collecting into profiler (a new Profiler by default)
+    :return: the active Profiler
+    """
+    global _PROFILER
+    _PROFILER = profiler or Profiler()
+    return _PROFILER
+
+
+def disable():
+    """
+    stop collecting
+    :return: the Profiler that was active, or None
+    """
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    return profiler
+
+
+def active():
+    """
+    the active Profiler, None when profiling is off
+    """
+    return _PROFILER
+
+
+def stage(name, rows=0):
+    """
+    context manager timing a stage of rows stars, a shared no-op one when profiling is off
+    """
+    if _PROFILER is None:
+        return _NULL_STAGE
+    return _Stage(_PROFILER, name, rows)
+
+
+def count(name, n=1):
+    if _PROFILER is not None:
+        _PROFILER.count(name, n)
+
+
+def histogram(name, values):
+    if _PROFILER is not None:
+        _PROFILER.histogram(name, values)
+
+
+def branch_hits(name, branch):
+    """
+    histogram of the branches the stars of calibration name landed in, the stars out of range (branch -1) are
+    also counted as out_of_range.name
+    """
+    if _PROFILER is not None:
+        _PROFILER.histogram('branch.' + name, branch)
+        _PROFILER.count('out_of_range.' + name, np.count_nonzero(np.asarray(branch) < 0))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: service.py
+# @author: zyt
+# @time: 2018/08/13
+# ====================
+"""
+http service of teff, logg and mass/age for single stars or small batches. every request is answered by a thread of
+the server, but the stars of concurrent requests are collected by one batching thread into a single call of the
+vectorized calibrations (at most max_batch stars, waiting at most max_wait for more), so the cost per star stays that
+of the batched path. the calibrations (and the teff tables with --tables) are loaded once at start.
+    python service.py --port 8080
+    curl -d '{"jmag": 7.18, "hmag": 6.68, "ksmag": 6.62, "bmag": 10.55, "vmag": 9.33, "e_bv": 0.07, "feh": -0.03}' \\
+         localhost:8080/params
+    POST /params  one star {"jmag": ...} or {"stars": [{...}, ...]}, the inputs as in cal_teff_consensus plus plx
+                  (arcsec), mass, a_v (3.1*e_bv by default) for logg and cm, nm for the giant mass and age
+    GET /metrics  prometheus text: requests, stars, batches and the p50/p99 latency of the recent requests
+    GET /stats    the same as json
+    GET /health
+"""
+import argparse
+import BaseHTTPServer
+import collections
+import functools
+import json
+import logging
+import Queue
+import SocketServer
+import socket
+import sys
+import threading
+import time
+import numpy as np
+from params import cal_teff_consensus, cal_logg_batch, mass_age_giant_batch
+#======================================================================================================================
+STAR_FIELDS = ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv', 'feh', 'plx', 'mass', 'a_v', 'cm', 'nm')
+RESULT_FIELDS = ('teff', 'teff_scatter', 'n_cal', 'teff_flags', 'logg', 'mass_giant', 'logage')
+logger = logging.getLogger('cal_params.service')
+
+
+def evaluate(stars, tables=None):
+    """
+    teff (cal_teff_consensus), logg and the giant mass/age of a batch
+    :param stars: {field: float array}, star_type an array of 'giant'/'dwarf', nan where a field was not given
+    :param tables: teff_tables.TeffTables for teff, as in cal_teff_batch
+    :return: {result field: array}, nan where the inputs are missing or out of range
+    """
+    cons = cal_teff_consensus(*[stars[key] for key in ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv', 'feh')],
+                              star_type=stars['star_type'], tables=tables)
+    feh = np.where(np.isnan(stars['feh']), 0.0, stars['feh'])
+    a_v = np.where(np.isnan(stars['a_v']), 3.1 * stars['e_bv'], stars['a_v'])
+    logg = cal_logg_batch(stars['vmag'], a_v, stars['plx'], cons['teff'], stars['mass'], feh)['logg']
+    ma = mass_age_giant_batch(cons['teff'], logg, feh, stars['cm'], stars['nm'])
+    giant = stars['star_type'] == 'giant'
+    return {'teff': cons['teff'], 'teff_scatter': cons['scatter'], 'n_cal': cons['n_cal'], 'teff_flags': cons['flags'],
+            'logg': logg, 'mass_giant': np.where(giant, ma['mass'], np.nan),
+            'logage': np.where(giant, ma['logage'], np.nan)}
+
+
+class MicroBatcher(object):
+    """
+    one thread running func on the stars of all the pending requests at once
+    """
+    def __init__(self, func=evaluate, max_batch=1024, max_wait=0.002):
+        """
+        :param func: {field: array} -> {field: array} of the same length
+        :param max_batch: stars per call of func
+        :param max_wait: (s) how long the first request of a batch waits for the requests being read meanwhile
+        """
+        self.func, self.max_batch, self.max_wait = func, max_batch, max_wait
+        self.queue = Queue.Queue()
+        self.batches = self.batch_stars = 0
+        self.arriving = 0  # requests announced by expect() but not submitted yet
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def expect(self, delta=1):
+        """
+        announce a request that will be submitted soon (-1 if it will not), the batch waits for it
+        """
+        with self._lock:
+            self.arriving += delta
+
+    def submit(self, stars, expected=False):
+        """
+        evaluate the stars of one request, blocking until its batch is done
+        :param expected: the request was announced by expect()
+        """
+        done = threading.Event()
+        job = [stars, len(stars['star_type']), done, None, None]  # inputs, n, done, result, error
+        self.queue.put(job)
+        if expected:
+            self.expect(-1)
+        done.wait()
+        if job[4] is not None:
+            raise job[4]
+        return job[3]
+
+    def _run(self):
+        while True:
+            jobs = [self.queue.get()]
+            n = jobs[0][1]
+            deadline = time.time() + self.max_wait
+            while n < self.max_batch:
+                try:
+                    job = self.queue.get_nowait()
+                except Queue.Empty:
+                    # only wait while other requests are being read, a lone request goes at once
+                    wait = deadline - time.time()
+                    if wait <= 0 or not self.arriving:
+                        break
+                    try:
+                        job = self.queue.get(timeout=wait)
+                    except Queue.Empty:
+                        break
+                jobs.append(job)
+                n += job[1]
+            try:
+                keys = jobs[0][0].keys()
+                stars = dict((key, np.concatenate([job[0][key] for job in jobs])) for key in keys)
+                result = self.func(stars)
+                start = 0
+                for job in jobs:
+                    job[3] = dict((key, value[start:start + job[1]]) for key, value in result.items())
+                    start += job[1]
+            except Exception as err:
+                logger.exception('batch of %d stars failed', n)
+                for job in jobs:
+                    job[4] = err
+            self.batches += 1
+            self.batch_stars += n
+            for job in jobs:
+                job[2].set()
+
+
+class LatencyStats(object):
+    """
+    request counts and the latencies of the last window requests, for the p50/p99
+    """
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = self.errors = self.stars = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, seconds, stars, error=False):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.stars += stars
+            self.errors += error
+
+    def snapshot(self, batcher=None):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            out = {'requests': self.requests, 'errors': self.errors, 'stars': self.stars,
+                   'uptime_seconds': time.time() - self.started}
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (np.nan, np.nan)
+        out.update(latency_p50_seconds=p50, latency_p99_seconds=p99)
+        if batcher is not None:
+            out.update(batches=batcher.batches, batch_stars=batcher.batch_stars)
+        return out
+
+
+def parse_stars(body):
+    """
+    the json body of /params -> ({field: array}, whether it was a single star, the ids of the stars)
+    """
+    data = json.loads(body)
+    single = isinstance(data, dict) and 'stars' not in data
+    stars = [data] if single else data['stars'] if isinstance(data, dict) else data
+    if not stars or not all(isinstance(star, dict) for star in stars):
+        raise ValueError('expected a star object or {"stars": [star objects]}')
+    unknown = set(key for star in stars for key in star) - set(STAR_FIELDS + ('star_type', 'id'))
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(', '.join(sorted(unknown))))
+    out = dict((key, np.array([np.nan if star.get(key) is None else star[key] for star in stars], dtype=float))
+               for key in STAR_FIELDS)
+    out['star_type'] = np.array([star.get('star_type', 'giant') for star in stars])
+    return out, single, [star.get('id') for star in stars]
+
+
+def format_stars(result, ids):
+    rows = []
+    for i, star_id in enumerate(ids):
+        row = {} if star_id is None else {'id': star_id}
+        for key in RESULT_FIELDS:
+            value = result[key][i].item()
+            row[key] = None if value != value else value  # nan is not json
+        rows.append(row)
+    return rows
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, clients reuse their connection
+    wbufsize = -1  # the response goes out in one write, flushed after every request
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # small responses are not held back by nagle's algorithm waiting for the delayed ack of the client
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _send(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, '{"status": "ok"}')
+        elif self.path == '/stats':
+            self._send(200, json.dumps(self.server.stats.snapshot(self.server.batcher)))
+        elif self.path == '/metrics':
+            lines = []
+            for key, value in sorted(self.server.stats.snapshot(self.server.batcher).items()):
+                kind = 'gauge' if key.startswith(('latency', 'uptime')) else 'counter'
+                lines += ['# TYPE cal_params_service_{} {}'.format(key, kind),
+                          'cal_params_service_{} {}'.format(key, repr(float(value)))]
+            self._send(200, '\n'.join(lines) + '\n', 'text/plain; version=0.0.4')
+        else:
+            self._send(404, '{"error": "not found"}')
+
+    def do_POST(self):
+        t0 = time.time()
+        if self.path != '/params':
+            self._send(404, '{"error": "not found"}')
+            return
+        n = 0
+        batcher = self.server.batcher
+        batcher.expect()
+        parsed = False
+        try:
+            stars, single, ids = parse_stars(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+            n, parsed = len(ids), True
+        except Exception as err:  # any bad body, e.g. an integer too large for a float (OverflowError)
+            self.server.stats.add(time.time() - t0, n, error=True)
+            self._send(400, json.dumps({'error': str(err)}))
+            return
+        finally:
+            if not parsed:
+                batcher.expect(-1)  # submit() takes the announcement back otherwise
+        try:
+            rows = format_stars(batcher.submit(stars, expected=True), ids)
+        except Exception as err:
+            self.server.stats.add(time.time() - t0, n, error=True)
+            self._send(500, json.dumps({'error': str(err)}))
+            return
+        self._send(200, json.dumps(rows[0] if single else {'stars': rows}))
+        self.server.stats.add(time.time() - t0, n)
+
+    def log_message(self, fmt, *args):
+        logger.debug('%s %s', self.address_string(), fmt % args)
+
+
+class ParamsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, max_batch=1024, max_wait=0.002, tables=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        if tables:
+            from teff_tables import get_tables
+            tables = get_tables()
+        func = functools.partial(evaluate, tables=tables or None)
+        self.batcher = MicroBatcher(func, max_batch=max_batch, max_wait=max_wait)
+        self.stats = LatencyStats()
+        # the first call imports and builds what the calibrations need, not the first request
+        func(dict([(key, np.full(1, np.nan)) for key in STAR_FIELDS] + [('star_type', np.array(['giant']))]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='http service of teff, logg and mass/age')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch', type=int, default=1024, help='stars per call of the calibrations')
+    parser.add_argument('--max-wait-ms', type=float, default=2., help='how long a request waits for others')
+    parser.add_argument('--tables', action='store_true', help='interpolate teff in the cached lookup tables')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    server = ParamsServer((args.host, args.port), max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000.,
+                          tables=args.tables)
+    logger.info('serving on %s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: solver.py
+# @author: zyt
+# @time: 2018/08/08
+# ====================
+"""
+self-consistent teff, logg (and [fe/h], mass) of a catalog. teff depends on [fe/h] and on the star type, logg on
+teff through the bolometric correction and 4*log(teff), and the star type (dwarf above logg_split), the giant mass
+of mass_age_giant and a photometric [fe/h] depend on logg and teff in turn. solve_params iterates
+teff -> logg -> (star type, mass, [fe/h]) for all the stars at once, and the stars that converged leave the active
+set, so the later iterations only cost the stars that still move. stars cycling between two states (the whole state
+repeating with an undamped swing) are stopped unconverged.
+    res = solve_params(jmag, hmag, ksmag, bmag, vmag, e_bv, a_v, plx, mass, feh)
+"""
+import numpy as np
+from params import FLAG_FEH_ASSUMED, cal_teff_consensus, cal_logg_batch, mass_age_giant_batch
+#======================================================================================================================
+# solution of every star: consensus teff and its scatter, logg, the [fe/h] and mass of the last iteration, whether
+# it is a dwarf, the consensus flags, the iterations it took and whether it converged within max_iter
+SOLVE_DTYPE = np.dtype([('teff', 'f8'), ('scatter', 'f8'), ('logg', 'f8'), ('feh', 'f8'), ('mass', 'f8'),
+                        ('dwarf', '?'), ('flags', 'u1'), ('n_iter', 'i1'), ('converged', '?')])
+# a star back in its state of two iterations ago is cycling unless its swing shrank below this fraction of the
+# previous one, slower damping would not converge within max_iter anyway
+CYCLE_DAMPING = 0.95
+
+
+def _moved(old, new, tol):
+    """
+    |new - old| > tol, a value staying nan has not moved
+    """
+    with np.errstate(invalid='ignore'):
+        return (np.abs(new - old) > tol) | (np.isnan(new) != np.isnan(old))
+
+
+def solve_params(jmag, hmag, ksmag, bmag, vmag, e_bv, a_v, plx, mass, feh=np.nan, star_type=None, cm=None,
+                 nm=None, feh_func=None, logg_split=3.5, tol_teff=1.0, tol_logg=1e-3, tol_feh=1e-3, max_iter=20,
+                 sigma=None, tables=None):
+    """
+    fixed point of teff (cal_teff_consensus) and logg (cal_logg_batch) for arrays of stars
+    :param a_v: v band extinction, 3.1*e_bv if None
+    :param plx: parallax in arcsec
+    :param mass: mass of the stars, the first guess of the giant mass with cm and nm
+    :param feh: nan and 99.0 are taken as 0.0, or as the first guess of feh_func
+    :param star_type: 'giant', 'dwarf' or an array of them to keep the type fixed, None (default) for dwarfs where
+                      logg >= logg_split, starting from giants
+    :param cm: [c/m] and nm [n/m], the mass of the giants in the mass_age_giant box is then updated from teff and logg
+    :param feh_func: photometric [fe/h], feh_func(index, teff, logg) -> [fe/h] of the stars at index
+    :param tol_teff: (K) a star converged once teff, logg (tol_logg), [fe/h] (tol_feh) and the mass (tol_logg as a
+                     fraction) stop moving and its type is unchanged, with a finite teff and logg
+    :param sigma: dispersions of the calibrations for the consensus weights, see params.TEFF_SIGMA
+    :param tables: teff_tables.TeffTables (or True) as in cal_teff_batch
+    :return: structured array of SOLVE_DTYPE
+    """
+    arrays = [np.atleast_1d(np.asarray(x, dtype=float)) for x in
+              (jmag, hmag, ksmag, bmag, vmag, e_bv, 3.1 * np.asarray(e_bv) if a_v is None else a_v, plx, mass, feh)]
+    if cm is not None:
+        arrays += [np.atleast_1d(np.asarray(x, dtype=float)) for x in (cm, nm)]
+    arrays = [x.ravel() for x in np.broadcast_arrays(*arrays)]
+    jmag, hmag, ksmag, bmag, vmag, e_bv, a_v, plx, mass0 = arrays[:9]
+    cm, nm = arrays[10:] if cm is not None else (None, None)
+    n = len(jmag)
+
+    res = np.zeros(n, dtype=SOLVE_DTYPE)
+    res['teff'] = res['scatter'] = res['logg'] = np.nan
+    res['mass'] = mass0
+    assumed = np.isnan(arrays[9]) | (arrays[9] == 99.0)
+    res['feh'] = np.where(assumed, 0.0, arrays[9])
+    if star_type is not None:
+        res['dwarf'] = np.broadcast_to(np.asarray(star_type), (n,)) == 'dwarf'
+    active = np.arange(n)
+    back = swing_back = None  # state of the active stars two iterations back, and their swing of the last iteration
+    for it in range(1, max_iter + 1):
+        if not len(active):
+            break
+        old = res[active]
+        feh = old['feh']
+        kind = np.where(old['dwarf'], 'dwarf', 'giant')
+        cons = cal_teff_consensus(jmag[active], hmag[active], ksmag[active], bmag[active], vmag[active],
+                                  e_bv[active], feh, star_type=kind, sigma=sigma, tables=tables)
+        teff = cons['teff']
+        logg = cal_logg_batch(vmag[active], a_v[active], plx[active], teff, old['mass'], feh)['logg']
+        new = old.copy()
+        new['teff'], new['scatter'], new['logg'], new['n_iter'] = teff, cons['scatter'], logg, it
+        new['flags'] = cons['flags']
+        if star_type is None:
+            with np.errstate(invalid='ignore'):
+                new['dwarf'] = logg >= logg_split
+        if cm is not None:
+            ma = mass_age_giant_batch(teff, logg, feh, cm[active], nm[active])
+            with np.errstate(invalid='ignore'):
+                new['mass'] = np.where(ma['valid'] & ~new['dwarf'] & (ma['mass'] > 0), ma['mass'], mass0[active])
+        if feh_func is not None:
+            new['feh'] = np.where(np.isfinite(teff) & np.isfinite(logg),
+                                  np.asarray(feh_func(active, teff, logg), dtype=float), feh)
+
+        moved = (_moved(old['teff'], teff, tol_teff) | _moved(old['logg'], logg, tol_logg) |
+                 _moved(old['feh'], new['feh'], tol_feh) | _moved(old['mass'], new['mass'], tol_logg * old['mass']) |
+                 (old['dwarf'] != new['dwarf']))
+        # stars without a teff or logg (no usable photometry) stop moving at once, but have not converged
+        new['converged'] = ~moved & np.isfinite(teff) & np.isfinite(logg)
+        res[active] = new
+        # stars jumping back and forth, e.g. in and out of the mass_age_giant box, have no fixed point: their whole
+        # state is back to the one of two iterations ago, and the swing does not shrink as in a damped oscillation
+        # (swing in units of the tolerances)
+        with np.errstate(invalid='ignore'):
+            swing = np.fmax(np.fmax(np.abs(teff - old['teff']) / tol_teff, np.abs(logg - old['logg']) / tol_logg),
+                            np.abs(new['feh'] - old['feh']) / tol_feh)
+        if back is None:
+            cycling = np.zeros(len(active), dtype=bool)
+        else:
+            repeated = ~(_moved(back['teff'], teff, tol_teff) | _moved(back['logg'], logg, tol_logg) |
+                         _moved(back['feh'], new['feh'], tol_feh) |
+                         _moved(back['mass'], new['mass'], tol_logg * back['mass']) | (back['dwarf'] != new['dwarf']))
+            with np.errstate(invalid='ignore'):
+                cycling = moved & repeated & ~(swing < CYCLE_DAMPING * swing_back) & ~np.isnan(logg)
+        keep = moved & ~cycling
+        back, swing_back = old[keep], swing[keep]
+        active = active[keep]
+    res['flags'] |= np.where(assumed & (feh_func is None), FLAG_FEH_ASSUMED, 0).astype(np.uint8)
+    return res
@@ -0,0 +1,213 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: teff_tables.py
+# @author: zyt
+# @time: 2018/08/06
+# ====================
+"""
+lookup tables of the teff calibrations for fast screening: every registered calibration is tabulated once on a
+regular (color, [fe/h]) grid, and teff is then bilinearly interpolated instead of evaluating the polynomials and
+picking the branch. cells crossed by an edge of a calibration box (where the branch, and so teff, jumps) and stars
+outside the table are evaluated with the formulas, so the branches are always the ones of eval_teff and the
+interpolation error is TeffTable.max_error, the largest difference from the formulas on a grid of ERROR_SAMPLES x
+ERROR_SAMPLES points of every interpolated cell (edges and corners included).
+the tables are cached on disk and memory mapped, so the processes of a run share one copy.
+    tables = load_tables()
+    res = cal_teff_batch(jmag, hmag, ksmag, bmag, vmag, e_bv, feh, tables=tables)
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from cachedir import CACHE_ROOT, make_dirs, publish, read_json, write_json
+from calibrations import CALIBRATIONS, eval_teff
+#======================================================================================================================
+TABLE_STEP = (0.005, 0.02)  # (color, [fe/h]) spacing of the nodes
+FEH_RANGE = (-4.0, 0.5)  # [fe/h] tabulated for calibrations without [fe/h] limits
+COLOR_PAD = 0.5  # tabulated beyond the color limits of calibrations with an unlimited (nan) box, e.g. alonso1999
+ERROR_SAMPLES = 5  # points per cell and axis where max_error is measured
+TABLE_VERSION = 2
+CACHE_DIR = os.path.join(CACHE_ROOT, 'teff_tables')
+
+
+# cell states besides the branch (>= 0) of the cells that are interpolated
+OUT_OF_RANGE, FORMULA = -1, -2
+
+
+class TeffTable(object):
+    """
+    one calibration on the cells [color0 + i*step[0], +step[0]) x [feh0 + j*step[1], +step[1])
+    coef: (4, ncolor, nfeh) bilinear teff = c0 + c1*u + c2*v + c3*u*v of every cell, u and v the position in the cell
+    state: (ncolor, nfeh) branch of the cell, OUT_OF_RANGE, or FORMULA where a box edge crosses it
+    """
+    def __init__(self, coef, state, color0, feh0, step, max_error, bounded):
+        """
+        :param bounded: every box of the calibration is inside the table, so the stars outside are out of range
+        """
+        self.coef, self.state = coef, state
+        self.bounded = bool(bounded)
+        self.color0, self.feh0 = float(color0), float(feh0)
+        self.step = tuple(float(s) for s in step)
+        self.max_error = float(max_error)
+
+    @classmethod
+    def build(cls, cal, step=TABLE_STEP):
+        """
+        tabulate the calibration cal over the finite limits of its (non-empty) boxes
+        """
+        dc, df = step
+        with np.errstate(invalid='ignore'):
+            boxes = cal.boxes[~((cal.boxes[:, 0] > cal.boxes[:, 1]) | (cal.boxes[:, 2] > cal.boxes[:, 3]))]
+        color_edges = boxes[:, :2][np.isfinite(boxes[:, :2])]
+        feh_edges = boxes[:, 2:][np.isfinite(boxes[:, 2:])]
+        feh_limits = np.concatenate([feh_edges, FEH_RANGE])
+        pad = COLOR_PAD if np.isnan(boxes[:, :2]).any() else 0.
+        # one node beyond the limits on both sides, the stars on an inclusive limit fall in a cell and not off the table
+        color0 = (np.floor((color_edges.min() - pad) / dc) - 1) * dc
+        feh0 = (np.floor(feh_limits.min() / df) - 1) * df
+        nc = int(np.ceil((color_edges.max() + pad - color0) / dc)) + 2
+        nf = int(np.ceil((feh_limits.max() - feh0) / df)) + 2
+        col, feh = np.meshgrid(color0 + dc * np.arange(nc), feh0 + df * np.arange(nf), indexing='ij')
+        teff, branch = eval_teff(cal, col, feh)
+
+        # a cell is interpolated if its corners share a branch and no box edge passes through it or along its sides:
+        # a node meant to be on an edge is off by rounding, and the stars on the edge would take the branch of the
+        # wrong side
+        b = branch[:-1, :-1]
+        state = np.where((b == branch[1:, :-1]) & (b == branch[:-1, 1:]) & (b == branch[1:, 1:]), b, FORMULA)
+        tc, tf = 1e-6 * dc, 1e-6 * df
+        for edge in color_edges:
+            state[(col[:-1, 0] <= edge + tc) & (edge - tc <= col[1:, 0]), :] = FORMULA
+        for edge in feh_edges:
+            state[:, (feh[0, :-1] <= edge + tf) & (edge - tf <= feh[0, 1:])] = FORMULA
+        t00, t10, t01, t11 = teff[:-1, :-1], teff[1:, :-1], teff[:-1, 1:], teff[1:, 1:]
+        coef = np.array([t00, t10 - t00, t01 - t00, t11 - t10 - t01 + t00])
+
+        table = cls(coef, state.astype(np.int8), color0, feh0, step, 0., np.isfinite(boxes).all())
+        inner = state >= 0
+        if inner.any():
+            # the error peaks at the center or on the edges of a cell depending on the signs of the curvatures, so it
+            # is measured on a grid of points of every cell, edges and corners included
+            col00, feh00 = col[:-1, :-1][inner], feh[:-1, :-1][inner]
+            for u in np.linspace(0., 1., ERROR_SAMPLES):
+                for v in np.linspace(0., 1., ERROR_SAMPLES):
+                    x, y = col00 + u * dc, feh00 + v * df
+                    error = np.abs(table.eval(cal, x, y)[0] - eval_teff(cal, x, y)[0]).max()
+                    table.max_error = max(table.max_error, error)
+        return table
+
+    def eval(self, cal, col_index, feh):
+        """
+        eval_teff through the table, the stars in FORMULA cells (or outside the table, unless bounded) are evaluated
+        by the formulas
+        """
+        col_index, feh = np.broadcast_arrays(np.asarray(col_index, dtype=float), np.asarray(feh, dtype=float))
+        nc, nf = self.state.shape
+        u = (col_index - self.color0) / self.step[0]
+        v = (feh - self.feh0) / self.step[1]
+        with np.errstate(invalid='ignore'):
+            outside = ~((u >= 0) & (u < nc) & (v >= 0) & (v < nf))
+        if outside.any():
+            u[outside] = v[outside] = 0.
+        i, j = u.astype(np.intp), v.astype(np.intp)
+        cell = i * nf + j
+        u -= i
+        v -= j
+        # np.take of contiguous planes is much faster than fancy indexing rows of (ncell, 4)
+        c0, c1, c2, c3 = [plane.reshape(-1).take(cell) for plane in self.coef]
+        teff = c0 + u * c1 + v * (c2 + u * c3)
+        branch = self.state.reshape(-1).take(cell)
+        branch[outside] = OUT_OF_RANGE if self.bounded else FORMULA
+        off = branch < 0
+        if off.any():
+            teff[off] = 0.
+            formula = branch == FORMULA
+            branch[off] = -1
+            if formula.any():
+                teff[formula], branch[formula] = eval_teff(cal, col_index[formula], feh[formula])
+        return teff, branch
+
+
+class TeffTables(object):
+    """
+    the TeffTable of every registered calibration
+    """
+    def __init__(self, tables):
+        self.tables = tables
+
+    def eval(self, cal, col_index, feh):
+        return self.tables[cal.source, cal.star_type, cal.color].eval(cal, col_index, feh)
+
+    @property
+    def max_error(self):
+        """
+        {(source, star_type, color): max |table - formula| (K)}
+        """
+        return dict((key, table.max_error) for key, table in self.tables.items())
+
+
+def build_tables(step=TABLE_STEP):
+    return TeffTables(dict((key, TeffTable.build(cal, step)) for key, cal in CALIBRATIONS.items()))
+
+
+def _name(key):
+    return '_'.join(key).replace('-', '')
+
+
+def save_tables(tables, path):
+    index = []
+    for key, table in tables.tables.items():
+        for name in ('coef', 'state'):
+            np.save(os.path.join(path, '{}.{}.npy'.format(_name(key), name)), getattr(table, name))
+        index.append({'key': list(key), 'color0': table.color0, 'feh0': table.feh0, 'step': list(table.step),
+                      'max_error': table.max_error, 'bounded': table.bounded})
+    write_json(os.path.join(path, 'index.json'), {'version': TABLE_VERSION, 'tables': index})
+
+
+def load_saved_tables(path, mmap_mode='r'):
+    index = read_json(os.path.join(path, 'index.json'))
+    tables = {}
+    for meta in index['tables']:
+        key = tuple(meta['key'])
+        arrays = [np.load(os.path.join(path, '{}.{}.npy'.format(_name(key), name)), mmap_mode=mmap_mode)
+                  for name in ('coef', 'state')]
+        tables[key] = TeffTable(*arrays + [meta['color0'], meta['feh0'], meta['step'], meta['max_error'],
+                                           meta['bounded']])
+    return TeffTables(tables)
+
+
+def tables_key(step=TABLE_STEP):
+    """
+    cache entry name: sha1 of the coefficients, boxes and branches of every calibration and the table layout
+    """
+    sha = hashlib.sha1(json.dumps([TABLE_VERSION, list(step), list(FEH_RANGE), COLOR_PAD]).encode('utf-8'))
+    for key, cal in CALIBRATIONS.items():
+        sha.update('/'.join(key).encode('utf-8'))
+        for arr in (cal.coef, cal.boxes, cal.branch, cal.cor):
+            if arr is not None:
+                sha.update(arr.tobytes())
+    return sha.hexdigest()
+
+
+def load_tables(step=TABLE_STEP, cache_dir=CACHE_DIR):
+    """
+    TeffTables built once into cache_dir and memory mapped afterwards, None as cache_dir to only build them
+    """
+    if cache_dir is None:
+        return build_tables(step)
+    make_dirs(cache_dir)
+    entry = publish(os.path.join(cache_dir, tables_key(step)), lambda path: save_tables(build_tables(step), path))
+    return load_saved_tables(entry)
+
+
+_TABLES = {}
+
+
+def get_tables(step=TABLE_STEP):
+    """
+    load_tables once per process
+    """
+    if step not in _TABLES:
+        _TABLES[step] = load_tables(step)
+    return _TABLES[step]
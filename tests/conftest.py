@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+the modules live at the top of the repository, import them from there
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
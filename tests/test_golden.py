@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import numpy as np
+import pytest
+import profiling
+from calibrations import CALIBRATIONS
+from params import cal_teff_batch, cal_teff_consensus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks'))
+import bench_hotpaths as bench
+
+# the b-v band 2 of the ramirez2005 giants starts at 0605 (octal, 389), as cal_teff always did
+UNREACHABLE = {('ramirez2005', 'giant', 'b-v'): set([2])}
+
+
+@pytest.fixture(scope='module')
+def golden_run():
+    s = bench.synthetic_stars(bench.GOLDEN_ROWS, bench.GOLDEN_SEED)
+    return s, bench.scalar_outputs(s, bench.GOLDEN_ROWS), bench.load_golden()
+
+
+@pytest.mark.parametrize('key', bench.GOLDEN_KEYS)
+def test_golden_values(golden_run, key):
+    s, scalar, golden = golden_run
+    assert bench.check_case(key, s, scalar, golden) == []
+
+
+def test_every_box_is_reached_by_the_batch_path():
+    # every dereddened color runs over x (b - v too), on a grid of x and [fe/h]
+    x, feh = [a.ravel() for a in np.meshgrid(np.arange(-0.5, 5.0, 0.005), np.arange(-4.5, 0.7, 0.02))]
+    mags = [10. - x, 10. - x, 10. - x, 10. + x, 10., 0.0, feh]
+    profiler = profiling.enable()
+    try:
+        for star_type in ('giant', 'dwarf'):
+            for mode in (0, 1, 2):
+                cal_teff_batch(*mags, mode=mode, star_type=star_type)
+            cal_teff_consensus(*mags, star_type=star_type)
+    finally:
+        profiling.disable()
+    for key, cal in CALIBRATIONS.items():
+        hits = profiler.histograms['branch.' + ' '.join(key)]
+        assert set(cal.branch) - UNREACHABLE.get(key, set()) <= set(hits), key
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import calibrations
+import kernels
+import params
+from calibrations import CALIBRATIONS, eval_teff
+from params import BC_FEH_BANDS, BC_RELATIONS, cal_logg_batch
+
+pytestmark = pytest.mark.skipif(kernels.eval_boxes is None, reason='needs numba')
+NUDGE = np.array([-1e-9, 0.0, 1e-9])
+
+
+def edges(limits, rng, n=50):
+    """
+    the finite limits, just inside and outside of them, random values around them and nan
+    """
+    limits = np.asarray(limits, dtype=float)
+    limits = limits[np.isfinite(limits)]
+    values = (limits[:, None] + NUDGE).ravel()
+    return np.concatenate([values, rng.uniform(limits.min() - 0.5, limits.max() + 0.5, n), [np.nan]])
+
+
+def test_eval_boxes_matches_the_numpy_masks(monkeypatch):
+    rng = np.random.RandomState(0)
+    monkeypatch.setattr(calibrations, 'eval_boxes', None)
+    for cal in CALIBRATIONS.values():
+        col, feh = [x.ravel() for x in np.meshgrid(edges(cal.boxes[:, :2], rng),
+                                                    edges(np.append(cal.boxes[:, 2:], [0.0, -0.5, 0.4]), rng))]
+        teff, branch = kernels.eval_boxes(cal, col, feh)
+        ref_teff, ref_branch = eval_teff(cal, col, feh)
+        np.testing.assert_array_equal(branch, ref_branch)
+        np.testing.assert_array_equal(teff, ref_teff)
+
+
+def test_logg_bc_matches_the_numpy_masks(monkeypatch):
+    rng = np.random.RandomState(1)
+    logt = edges([lim for ranges, _ in BC_RELATIONS for band in ranges for lim in band], rng, 200)
+    teff, feh = [x.ravel() for x in np.meshgrid(np.append(10 ** logt, [0.0, -10.0]), edges(BC_FEH_BANDS, rng))]
+    res = cal_logg_batch(9.33, 0.217, 0.004, teff, 1.2, feh)
+    monkeypatch.setattr(params, 'logg_bc', None)
+    ref = cal_logg_batch(9.33, 0.217, 0.004, teff, 1.2, feh)
+    np.testing.assert_array_equal(res['branch'], ref['branch'])
+    np.testing.assert_array_equal(res['bc'], ref['bc'])
+    np.testing.assert_array_equal(res['logg'], ref['logg'])
+    # both relations apply at 3.65 <= log(teff) <= 3.67 in every band, the cool one wins
+    with np.errstate(invalid='ignore', divide='ignore'):
+        both = (np.log10(teff) >= 3.65) & (np.log10(teff) <= 3.67) & (feh >= -3.0) & (feh <= 0.2)
+    assert both.any() and (res['branch'][both] == 0).all()
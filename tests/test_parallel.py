@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+from parallel import run_parallel
+
+STAR = '7.18 6.68 6.62 10.55 9.33 0.07 0.0'
+
+
+def test_changed_input_is_not_resumed(tmpdir):
+    path, output = tmpdir.join('cat.dat'), str(tmpdir.join('out.csv'))
+    path.write('Jmag Hmag Kmag Bmag Vmag E_BV FeH\n' + '\n'.join([STAR] * 4) + '\n')
+    kw = dict(workers=1, chunksize=2, workdir=str(tmpdir.join('shards')), keep=True)
+    assert run_parallel(str(path), output, **kw) == 4
+    assert run_parallel(str(path), output, **kw) == 4  # the same input resumes from its shards
+    with pytest.raises(ValueError):
+        run_parallel(str(path), output, fmt='csv', **kw)
+    os.utime(str(path), (0, 0))  # touched, same size
+    with pytest.raises(ValueError):
+        run_parallel(str(path), output, **kw)
+    path.write(STAR + '\n', mode='a')
+    with pytest.raises(ValueError):
+        run_parallel(str(path), output, **kw)
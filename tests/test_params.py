@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+from params import cal_teff
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+STARS = [(7.18, 6.68, 6.62, 10.55, 9.33, 0.07, -0.03), (8.90, 8.30, 8.18, 12.80, 11.30, 0.02, -0.50)]
+
+
+def test_main_prints_teff_of_every_star(tmpdir):
+    names = ['Jmag', 'Hmag', 'Kmag', 'Bmag', 'Vmag', 'E_BV_SF', 'FeH']
+    names += ['c{}'.format(i) for i in range(23 - len(names))]
+    path = tmpdir.join('catalog.dat')
+    lines = ['# skipped', ' '.join(names)]
+    lines += [' '.join(map(str, star + (0.0,) * (23 - len(star)))) for star in STARS]
+    path.write('\n'.join(lines) + '\n')
+    out = subprocess.check_output([sys.executable, 'params.py', str(path)], cwd=REPO)
+    expected = [cal_teff(*star, display=False) for star in STARS]
+    assert out.splitlines() == expected
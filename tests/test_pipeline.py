@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from params import FLAG_FEH_ASSUMED
+from pipeline import chunk_results
+
+# two giants differing only in [fe/h]: 0.0 and unknown
+INPUTS = {'jmag': 7.18, 'hmag': 6.68, 'ksmag': 6.62, 'bmag': 10.55, 'vmag': 9.33, 'e_bv': 0.07, 'plx': 0.004,
+          'mass': 1.2, 'a_v': 0.217, 'cm': 0.0, 'nm': 0.1}
+
+
+def inputs(feh, **kw):
+    out = dict((key, np.full(len(feh), value, dtype=float)) for key, value in INPUTS.items())
+    out['feh'] = np.array(feh, dtype=float)
+    out.update(kw)
+    return out
+
+
+def test_unknown_feh_is_zero_in_every_stage():
+    for consensus in (False, True):
+        res = chunk_results(inputs([0.0, np.nan, 99.0]), consensus=consensus)
+        for name in ('teff', 'logg', 'mass_giant', 'logage'):
+            assert np.isfinite(res[name]).all(), name
+            np.testing.assert_allclose(res[name], res[name][0], rtol=1e-12, err_msg=name)
+    res = chunk_results(inputs([0.0, np.nan]), consensus=True)
+    assert list(res['teff_flags'] & FLAG_FEH_ASSUMED) == [0, FLAG_FEH_ASSUMED]
+
+
+def test_giant_mass_and_age_only_for_giants():
+    res = chunk_results(inputs([0.0, 0.0], star_type=np.array([0., 1.])))
+    assert np.isfinite(res['mass_giant'][0]) and np.isfinite(res['logage'][0])
+    assert np.isnan(res['mass_giant'][1]) and np.isnan(res['logage'][1])
+    res = chunk_results(inputs([0.0]), star_type='dwarf')
+    assert np.isnan(res['mass_giant']).all() and np.isnan(res['logage']).all()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import httplib
+import json
+import threading
+import pytest
+from service import ParamsServer
+
+STAR = {'jmag': 7.18, 'hmag': 6.68, 'ksmag': 6.62, 'bmag': 10.55, 'vmag': 9.33, 'e_bv': 0.07, 'feh': -0.03}
+
+
+@pytest.fixture
+def server():
+    server = ParamsServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body):
+    conn = httplib.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    conn.request('POST', '/params', body)
+    resp = conn.getresponse()
+    return resp.status, json.loads(resp.read())
+
+
+def test_overflowing_value_is_a_bad_request(server):
+    status, body = post(server, json.dumps(dict(STAR, vmag=10 ** 400)))
+    assert status == 400 and 'error' in body
+    assert server.batcher.arriving == 0
+    status, body = post(server, json.dumps(STAR))
+    assert status == 200 and body['teff'] > 0
+
+
+def test_malformed_body_is_a_bad_request(server):
+    for body in ('{"jmag": ', '[1, 2]', '{"stars": []}', '{"color": 1.0}'):
+        assert post(server, body)[0] == 400
+    assert server.batcher.arriving == 0
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from solver import solve_params
+
+# a giant: jmag, hmag, ksmag, bmag, vmag, e_bv, a_v, plx, mass
+STAR = (7.18, 6.68, 6.62, 10.55, 9.33, 0.07, 0.217, 0.004, 1.2)
+
+
+def alternating_feh(step):
+    """
+    photometric [fe/h] -0.3 + 0.3 * step**k at the k-th call of every star
+    """
+    calls = {}
+
+    def feh_func(index, teff, logg):
+        k = np.array([calls.get(i, 0) for i in index])
+        for i in index:
+            calls[i] = calls.get(i, 0) + 1
+        return -0.3 + 0.3 * step ** k
+    return feh_func
+
+
+def test_damped_oscillation_converges():
+    res = solve_params(*STAR, feh=0.0, star_type='giant', feh_func=alternating_feh(-0.9), max_iter=100)
+    assert res['converged'][0]
+    assert abs(res['feh'][0] + 0.3) < 1e-2
+    assert 20 < res['n_iter'][0] < 100
+
+
+def test_two_state_cycle_is_stopped():
+    res = solve_params(*STAR, feh=0.0, star_type='giant', feh_func=alternating_feh(-1.0), max_iter=100)
+    assert not res['converged'][0]
+    assert res['n_iter'][0] < 10
+
+
+def test_no_photometry_is_not_converged():
+    mags = [[np.nan, x] for x in STAR[:5]]
+    res = solve_params(*(mags + list(STAR[5:])), feh=0.0)
+    assert np.isnan(res['teff'][0]) and np.isnan(res['logg'][0])
+    assert not res['converged'][0] and res['n_iter'][0] == 1
+    assert res['converged'][1] and np.isfinite(res['teff'][1])
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from calibrations import CALIBRATIONS, eval_teff
+from teff_tables import TeffTable
+
+
+def test_max_error_holds_inside_the_cells():
+    rng = np.random.RandomState(0)
+    keys = [('casagrande2010', 'dwarf', 'v-h'), ('casagrande2010', 'dwarf', 'v-k'), ('ramirez2005', 'dwarf', 'v-h')]
+    for key in keys:
+        cal = CALIBRATIONS[key]
+        table = TeffTable.build(cal)
+        inner = np.flatnonzero(table.state.ravel() >= 0)
+        i, j = np.unravel_index(inner[rng.randint(len(inner), size=200000)], table.state.shape)
+        col = table.color0 + (i + rng.rand(len(i))) * table.step[0]
+        feh = table.feh0 + (j + rng.rand(len(j))) * table.step[1]
+        assert np.abs(table.eval(cal, col, feh)[0] - eval_teff(cal, col, feh)[0]).max() <= table.max_error
+
+
+def test_stars_on_the_box_limits_take_the_branch_of_the_formulas():
+    rng = np.random.RandomState(1)
+    for cal in CALIBRATIONS.values():
+        table = TeffTable.build(cal)
+        edges = cal.boxes[:, :2][np.isfinite(cal.boxes[:, :2])]
+        col, feh = np.repeat(edges, 1000), rng.uniform(-5., 0.6, 1000 * len(edges))
+        teff, branch = table.eval(cal, col, feh)
+        ref_teff, ref_branch = eval_teff(cal, col, feh)
+        assert (branch == ref_branch).all()
+        assert np.abs(teff - ref_teff).max() <= table.max_error
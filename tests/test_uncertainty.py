@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from uncertainty import mc_teff
+
+STAR = (7.18, 6.68, 6.62, 10.55, 9.33, 0.07)
+
+
+def test_unknown_feh_is_not_drawn():
+    feh = np.array([99.0, np.nan, -0.3])
+    mags = [np.full(3, x) for x in STAR]
+    res = mc_teff(*mags + [feh], errors={'vmag': 0.02, 'feh': 0.1}, n_samples=200, seed=1)
+    ref = mc_teff(*mags + [np.array([0.0, 0.0, -0.3])], errors={'vmag': 0.02, 'feh': [0.0, 0.0, 0.1]},
+                  n_samples=200, seed=1)
+    np.testing.assert_array_equal(res.median, ref.median)
+    np.testing.assert_array_equal(res.valid_fraction, ref.valid_fraction)
+    assert (res.valid_fraction[:2, :2] == 1.0).all()
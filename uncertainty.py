@@ -0,0 +1,145 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: uncertainty.py
+# @author: zyt
+# @time: 2018/07/30
+# ====================
+"""
+monte carlo error propagation through cal_teff and cal_logg: every star gets n_samples draws of its photometry,
+e(b-v), parallax, mass ... from gaussian errors, the draws of a batch of stars are pushed through the batched
+calibrations as one (stars x samples) array, and the median and percentiles of every calibration are returned.
+the batches are sized so that at most max_draws draws are in memory at a time.
+"""
+from collections import namedtuple
+import numpy as np
+from params import cal_teff_batch, cal_logg_batch
+#======================================================================================================================
+# median, percentiles (..., len(percentiles)) and the fraction of the draws inside the calibration ranges
+MCResult = namedtuple('MCResult', ['median', 'percentiles', 'valid_fraction'])
+
+
+def sample_percentiles(samples, q):
+    """
+    percentiles along the last axis ignoring nan, the same as np.nanpercentile (linear interpolation).
+    rows without nan only need a partial sort (np.partition), the others are sorted.
+    :return: array with shape samples.shape[:-1] + (len(q),), nan where every draw is nan
+    """
+    q = np.asarray(q, dtype=float) / 100.
+    shape, size = samples.shape[:-1], samples.shape[-1]
+    samples = samples.reshape(-1, size)
+    count = size - np.isnan(samples).sum(axis=-1)
+    out = np.full((len(samples), len(q)), np.nan)
+
+    full = count == size
+    if full.any():
+        pos = q * (size - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, size - 1)
+        part = np.partition(samples[full], np.union1d(lo, hi), axis=-1)
+        out[full] = part[:, lo] + (pos - lo) * (part[:, hi] - part[:, lo])
+
+    some = (count > 0) & ~full
+    if some.any():
+        s = np.sort(samples[some], axis=-1)  # nan sorted to the end
+        pos = q * (count[some] - 1)[:, None]
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, (count[some] - 1)[:, None])
+        s_lo = np.take_along_axis(s, lo, axis=-1)
+        out[some] = s_lo + (pos - lo) * (np.take_along_axis(s, hi, axis=-1) - s_lo)
+    return out.reshape(shape + (len(q),))
+
+
+def _normal(rng, size, dtype):
+    if hasattr(rng, 'integers'):  # numpy >= 1.17 Generator, draws float32 directly
+        return rng.standard_normal(size, dtype=dtype)
+    return rng.standard_normal(size).astype(dtype)
+
+
+def _monte_carlo(func, values, errors, n_samples, percentiles, max_draws, dtype, seed):
+    """
+    :param func: calculates (draws, k) results from a dict of 1-d draws, nan where not valid
+    :param values: {argument: array of n stars}
+    :param errors: {argument: sigma}, arguments without error are repeated unchanged
+    """
+    rng = np.random.default_rng(seed) if hasattr(np.random, 'default_rng') else np.random.RandomState(seed)
+    n = len(next(iter(values.values())))
+    errors = dict((key, np.broadcast_to(np.asarray(sig, dtype=float), (n,))) for key, sig in (errors or {}).items())
+    unknown = set(errors) - set(values)
+    if unknown:
+        raise ValueError('errors given for unknown arguments: {}'.format(', '.join(sorted(unknown))))
+    step = max(1, int(max_draws) // n_samples)
+    median = percent = valid = None
+    for start in range(0, n, step):
+        stop = min(start + step, n)
+        draws = {}
+        for key, value in values.items():
+            value = value[start:stop, None]
+            if key in errors:
+                noise = _normal(rng, (stop - start, n_samples), dtype)
+                draws[key] = (value.astype(dtype) + errors[key][start:stop, None].astype(dtype) * noise).ravel()
+            else:
+                draws[key] = np.repeat(value, n_samples, axis=1).ravel()
+        result = func(draws)
+        result = result.reshape(stop - start, n_samples, -1).transpose(0, 2, 1)  # (stars, k, samples)
+        p = sample_percentiles(result, list(percentiles) + [50.])
+        if median is None:
+            k = result.shape[1]
+            median = np.empty((n, k))
+            percent = np.empty((n, k, len(percentiles)))
+            valid = np.empty((n, k))
+        median[start:stop] = p[..., -1]
+        percent[start:stop] = p[..., :-1]
+        valid[start:stop] = (~np.isnan(result)).mean(axis=-1)
+    return MCResult(median, percent, valid)
+
+
+def mc_teff(jmag, hmag, ksmag, bmag, vmag, e_bv, feh=0.0, errors=None, mode=0, star_type='giant', n_samples=1000,
+            percentiles=(16, 50, 84), max_draws=2 ** 21, dtype=np.float32, seed=None):
+    """
+    monte carlo cal_teff_batch
+    :param feh: nan and 99.0 are taken as 0.0 and not drawn, as in cal_teff
+    :param errors: {argument: sigma}, e.g. {'jmag': e_jmag, 'vmag': 0.02, 'e_bv': 0.03, 'feh': 0.1}, sigma is a
+                   scalar or one per star; arguments without error are not drawn
+    :param star_type: 'giant', 'dwarf' or one per star
+    :param max_draws: draws in memory at a time, stars x n_samples of a batch
+    :param dtype: float32 (default) halves the memory of the draws
+    :return: MCResult, median (n, 3), percentiles (n, 3, len(percentiles)), valid_fraction (n, 3)
+    """
+    names = ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv', 'feh')
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                   for x in (jmag, hmag, ksmag, bmag, vmag, e_bv, feh)])
+    # an unknown [fe/h] (nan or 99.0) is the 0.0 of cal_teff_batch before the draws, without noise, as a draw next to
+    # 99.0 would pass for a measured [fe/h]
+    unknown = np.isnan(arrays[-1]) | (arrays[-1] == 99.0)
+    arrays[-1] = np.where(unknown, 0.0, arrays[-1])
+    if errors and 'feh' in errors and unknown.any():
+        errors = dict(errors, feh=np.where(unknown, 0.0, np.broadcast_to(np.asarray(errors['feh'], dtype=float),
+                                                                         unknown.shape)))
+    values = dict(zip(names, arrays))
+    if np.ndim(star_type):
+        values['star_type'] = np.broadcast_to(np.asarray(star_type), arrays[0].shape)
+
+    def func(draws):
+        res = cal_teff_batch(*[draws[key] for key in names], mode=mode,
+                             star_type=draws.get('star_type', star_type))
+        return np.where(res['valid'], res['teff'], np.nan)
+
+    return _monte_carlo(func, values, errors, n_samples, percentiles, max_draws, dtype, seed)
+
+
+def mc_logg(vmag, a_v, plx, teff, mass, feh=0.0, errors=None, n_samples=1000, percentiles=(16, 50, 84),
+            max_draws=2 ** 21, dtype=np.float32, seed=None):
+    """
+    monte carlo cal_logg, the draws of a negative parallax or mass give nan
+    :param errors: {argument: sigma}, e.g. {'vmag': 0.02, 'a_v': 0.05, 'plx': e_plx, 'teff': 80., 'mass': 0.1}
+    :return: MCResult, median (n, 1), percentiles (n, 1, len(percentiles)), valid_fraction (n, 1)
+    """
+    names = ('vmag', 'a_v', 'plx', 'teff', 'mass', 'feh')
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                   for x in (vmag, a_v, plx, teff, mass, feh)])
+
+    def func(draws):
+        return cal_logg_batch(*[draws[key] for key in names])['logg'][:, None]
+
+    return _monte_carlo(func, dict(zip(names, arrays)), errors, n_samples, percentiles, max_draws, dtype, seed)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+# ====================
+# @file: validation.py
+# @author: zyt
+# @time: 2018/08/16
+# ====================
+"""
+validation of the teff calibrations against spectroscopic parameters. every registered calibration, and the
+consensus, is evaluated in batch on a catalog streamed in chunks, and the residuals teff - teff_spec are summarized
+as the count, median offset and robust scatter (1.4826 x median absolute deviation) overall and in bins of teff_spec,
+[fe/h], logg and e(b-v). the bins are vectorized group-bys, so millions of spectra take seconds to minutes, e.g.
+after every change of the coefficients.
+    python validation.py Kepler_para_v2.dat --skiprows 4 --spec-teff Teff2 --spec-logg logg2 --column feh=FeH2 \\
+        -o report.txt
+"""
+import argparse
+from collections import OrderedDict
+import sys
+import numpy as np
+import pandas as pd
+from calibrations import CALIBRATIONS, eval_teff
+from params import TEFF_COLUMNS, _color_index, cal_teff_consensus
+from pipeline import read_chunks
+from profiling import stage
+#======================================================================================================================
+# bin edges of the quantities the residuals are binned by
+BINS = OrderedDict([('teff', np.arange(3000., 7001., 250.)), ('feh', np.arange(-2.5, 0.51, 0.25)),
+                    ('logg', np.arange(0., 5.01, 0.5)), ('e_bv', np.arange(0., 0.51, 0.05))])
+MAD_SIGMA = 1.4826  # robust scatter = MAD_SIGMA * median absolute deviation, the sigma of a gaussian
+
+
+def calibration_teffs(jmag, hmag, ksmag, bmag, vmag, e_bv, feh, star_type, consensus=True):
+    """
+    teff of every calibration in CALIBRATIONS for the stars of its type, the dereddened colors shared
+    :param feh: nan and 99.0 are taken as 0.0
+    :param star_type: array of 'giant'/'dwarf'
+    :return: OrderedDict {'source star_type color': teff array}, nan for the stars of the other type and those out
+             of range, plus 'consensus' (params.cal_teff_consensus)
+    """
+    mags = [np.asarray(x, dtype=float) for x in (jmag, hmag, ksmag, bmag, vmag, e_bv)]
+    feh = np.asarray(feh, dtype=float)
+    feh = np.where(np.isnan(feh) | (feh == 99.0), 0.0, feh)
+    star_type = np.asarray(star_type)
+    out = OrderedDict()
+    for kind in ('giant', 'dwarf'):
+        idx = np.flatnonzero(star_type == kind)
+        colors = {}
+        for key, cal in CALIBRATIONS.items():
+            if cal.star_type != kind:
+                continue
+            if cal.index not in colors:
+                colors[cal.index] = _color_index(cal.index, kind, *[x[idx] for x in mags])
+            teff, branch = eval_teff(cal, colors[cal.index], feh[idx])
+            out[' '.join(key)] = res = np.full(len(feh), np.nan)
+            res[idx] = np.where(branch >= 0, teff, np.nan)
+    if consensus:
+        out['consensus'] = cal_teff_consensus(*mags + [feh], star_type=star_type)['teff']
+    return out
+
+
+def binned_stats(x, residual, edges):
+    """
+    count, median and robust scatter of residual in the bins [edges[i], edges[i+1]) of x
+    :return: three arrays of len(edges)-1, nan median and scatter for the empty bins
+    """
+    nbin = len(edges) - 1
+    group = np.searchsorted(edges, x, side='right') - 1  # nan sorts after the last edge
+    ok = (group >= 0) & (group < nbin) & np.isfinite(residual)
+    group, residual = group[ok], pd.Series(residual[ok])
+    count = np.bincount(group, minlength=nbin)
+    # the cython group-by median of pandas selects within every group, no sort of the whole array
+    median = residual.groupby(group).median().reindex(np.arange(nbin)).values
+    scatter = MAD_SIGMA * (residual - median[group]).abs().groupby(group).median().reindex(np.arange(nbin)).values
+    return count, median, scatter
+
+
+def residual_table(teffs, teff_spec, quantities, bins=None):
+    """
+    the statistics of teff - teff_spec of every calibration, overall and binned
+    :param teffs: {calibration: teff array} as calibration_teffs
+    :param quantities: {name: array} to bin by, with edges from bins or BINS
+    :return: DataFrame of calibration, by ('all' or the quantity), lo, hi, n, median, scatter
+    """
+    bins = dict(BINS, **(bins or {}))
+    rows = []
+    for label, teff in teffs.items():
+        residual = teff - teff_spec
+        finite = np.isfinite(residual)
+        median = np.median(residual[finite]) if finite.any() else np.nan
+        scatter = MAD_SIGMA * np.median(np.abs(residual[finite] - median)) if finite.any() else np.nan
+        rows.append(pd.DataFrame({'calibration': [label], 'by': 'all', 'lo': np.nan, 'hi': np.nan,
+                                  'n': finite.sum(), 'median': median, 'scatter': scatter}))
+        for name, x in quantities.items():
+            edges = bins[name]
+            n, median, scatter = binned_stats(x[finite], residual[finite], edges)
+            rows.append(pd.DataFrame({'calibration': label, 'by': name, 'lo': edges[:-1], 'hi': edges[1:], 'n': n,
+                                      'median': median, 'scatter': scatter}))
+    return pd.concat(rows, ignore_index=True)[['calibration', 'by', 'lo', 'hi', 'n', 'median', 'scatter']]
+
+
+def validate_catalog(path, spec_teff='Teff2', spec_logg=None, columns=None, star_type=None, logg_split=3.5,
+                     chunksize=1000000, fmt=None, skiprows=None, bins=None):
+    """
+    residual_table of a catalog, streamed through calibration_teffs in chunks
+    :param spec_teff: column of the spectroscopic teff, spec_logg of the logg (binned, and the star type)
+    :param columns: {argument: column name} overriding TEFF_COLUMNS, feh is binned as well
+    :param star_type: 'giant', 'dwarf' or a column of them, by default dwarfs where spec_logg >= logg_split
+    """
+    names = dict(TEFF_COLUMNS, **(columns or {}))
+    if star_type is None and spec_logg is None:
+        raise ValueError('the star type needs either star_type or spec_logg!')
+    parts = OrderedDict()
+    for df in read_chunks(path, chunksize=chunksize, fmt=fmt, skiprows=skiprows):
+        col = lambda name: pd.to_numeric(df[name], errors='coerce').values.astype(float)
+        mags = [col(names[key]) for key in ('jmag', 'hmag', 'ksmag', 'bmag', 'vmag', 'e_bv', 'feh')]
+        if star_type in ('giant', 'dwarf'):
+            kind = np.full(len(df), star_type, dtype=object)
+        elif star_type is not None:
+            kind = np.asarray(df[star_type])
+        else:
+            kind = np.where(np.nan_to_num(col(spec_logg)) >= logg_split, 'dwarf', 'giant')  # nan logg as a giant
+        with stage('validation.teff', len(df)):
+            teffs = calibration_teffs(*mags + [kind])
+        chunk = OrderedDict((label, teff.astype(np.float32)) for label, teff in teffs.items())
+        chunk['teff_spec'], chunk['feh'], chunk['e_bv'] = col(spec_teff), mags[6], mags[5]
+        if spec_logg is not None:
+            chunk['logg'] = col(spec_logg)
+        for name, x in chunk.items():
+            parts.setdefault(name, []).append(x)
+    data = OrderedDict((name, np.concatenate(x)) for name, x in parts.items())
+    teff_spec = data.pop('teff_spec')
+    quantities = OrderedDict((name, data.pop(name)) for name in ('feh', 'e_bv', 'logg') if name in data)
+    quantities['teff'] = teff_spec
+    with stage('validation.stats', len(teff_spec)):
+        return residual_table(data, teff_spec, quantities, bins)
+
+
+def format_report(table, min_count=10):
+    """
+    text report: the overall line of every calibration, then its bins holding at least min_count stars
+    """
+    lines = []
+    fmt = '{:<32} {:>8} {:>8.1f} {:>8.1f}'
+    for label, rows in table.groupby('calibration', sort=False):
+        lines.append('{:<32} {:>8} {:>8} {:>8}'.format(label, 'n', 'median', 'scatter'))
+        for _, row in rows.iterrows():
+            if row['by'] == 'all':
+                lines.append(fmt.format('  all', int(row['n']), row['median'], row['scatter']))
+            elif row['n'] >= min_count:
+                lines.append(fmt.format('  {} [{:g}, {:g})'.format(row['by'], row['lo'], row['hi']), int(row['n']),
+                                        row['median'], row['scatter']))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='residuals of every teff calibration against spectroscopic teff')
+    parser.add_argument('input', help='.dat/.txt (whitespace), .csv, .fits or .parquet catalog')
+    parser.add_argument('-o', '--output', help='.csv for the whole table, a text report otherwise (stdout)')
+    parser.add_argument('--spec-teff', default='Teff2', help='column of the spectroscopic teff')
+    parser.add_argument('--spec-logg', help='column of the spectroscopic logg, binned and giving the star type')
+    parser.add_argument('--column', action='append', metavar='ARG=COLUMN',
+                        help='map an input to a column, e.g. feh=FeH2, e_bv=E_BV_SF (repeatable)')
+    parser.add_argument('--star-type', help="'giant', 'dwarf' or a column holding them, by default from the logg")
+    parser.add_argument('--logg-split', type=float, default=3.5, help='dwarfs from this spectroscopic logg')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='rows read at a time')
+    parser.add_argument('--format', dest='fmt', help='input format if not clear from the file name')
+    parser.add_argument('--skiprows', type=int, help='lines to skip at the top of a text catalog')
+    parser.add_argument('--min-count', type=int, default=10, help='bins with fewer stars are left out of the report')
+    args = parser.parse_args(argv)
+    from cal_params import parse_columns
+    try:
+        columns = parse_columns(args.column)
+    except argparse.ArgumentTypeError as err:
+        parser.error(str(err))
+    if args.star_type is None and args.spec_logg is None:
+        parser.error('--star-type or --spec-logg is needed for the star type')
+    table = validate_catalog(args.input, spec_teff=args.spec_teff, spec_logg=args.spec_logg, columns=columns,
+                             star_type=args.star_type, logg_split=args.logg_split, chunksize=args.chunksize,
+                             fmt=args.fmt, skiprows=args.skiprows)
+    if args.output and args.output.endswith('.csv'):
+        table.to_csv(args.output, index=False)
+    else:
+        report = format_report(table, args.min_count)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(report)
+        else:
+            sys.stdout.write(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())